@@ -0,0 +1,124 @@
+import hashlib
+import os
+import shutil
+import time
+from pathlib import Path
+
+from app import values
+
+"""
+Content-addressed store for artifacts that are expensive to produce but fully determined by their inputs,
+e.g. the class files of a compiled patch.
+
+Artifacts live in `values.dir_cache`, outside of any output directory, so they are shared across generations,
+across reruns with `--dir-output` and across seeds. Each artifact is a directory:
+
+{dir_cache}/
+|__ {kind}/
+    |__ {key[:2]}/
+        |__ {key}/
+"""
+
+
+class ArtifactStore:
+    def __init__(self, root):
+        assert os.path.isabs(root), str(root)
+        self.root = Path(root)
+
+    def path_for(self, kind, key):
+        return Path(self.root, kind, key[:2], key)
+
+    def lookup(self, kind, key):
+        path = self.path_for(kind, key)
+        return path if path.is_dir() else None
+
+    def obtain(self, kind, key, produce):
+        """
+        Return the directory of the artifact `key`, producing it first if it is not in the store.
+
+        :param produce: callable taking an empty absolute directory, into which it writes the artifact;
+                        if it raises, nothing is stored and the exception propagates
+        """
+        existing = self.lookup(kind, key)
+        if existing is not None:
+            return existing
+
+        final_dir = self.path_for(kind, key)
+        os.makedirs(final_dir.parent, exist_ok=True)
+
+        tmp_dir = Path(final_dir.parent, f".{key}.{os.getpid()}.{time.time()}")
+        os.makedirs(tmp_dir)
+        try:
+            produce(tmp_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        try:
+            os.rename(tmp_dir, final_dir)
+        except OSError:
+            # another run produced the same artifact in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not final_dir.is_dir():
+                raise
+        return final_dir
+
+
+store = ArtifactStore(values.dir_cache)
+
+
+def digest_strings(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def digest_directory(path):
+    """
+    Digest of the relative paths and contents of all regular files under `path`.
+    """
+    h = hashlib.sha256()
+    for dir_path, dir_names, file_names in os.walk(path):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            file_path = os.path.join(dir_path, file_name)
+            h.update(os.path.relpath(file_path, path).encode("utf-8"))
+            h.update(b"\0")
+            with open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+            h.update(b"\0")
+    return h.hexdigest()
+
+
+def digest_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def normalize_diff(diff):
+    """
+    Drop the parts of a unified diff that do not affect the patched program: line endings, trailing whitespace,
+    and timestamps in file headers.
+    """
+    lines = []
+    for line in diff.replace("\r\n", "\n").split("\n"):
+        if line.startswith("--- ") or line.startswith("+++ "):
+            line = line.split("\t")[0]
+        lines.append(line.rstrip())
+    return "\n".join(lines).strip("\n")
+
+
+def build_fingerprint():
+    """
+    Fingerprint of the base build, i.e., the class files in `values.dir_info["classes"]` and the build command.
+    Computed once per run.
+    """
+    if values.build_fingerprint is None:
+        values.build_fingerprint = digest_strings(digest_directory(values.dir_info["classes"]), values.cmd_build)
+    return values.build_fingerprint
@@ -19,12 +19,12 @@ def config_project(project_path, custom_config_command=None):
         error_exit("CONFIGURATION FAILED!!\nExit Code: " + str(ret_code))
 
 
-def build_project(project_path, build_command=None):
+def build_project(project_path, build_command=None, deadline=None):
     dir_command = "cd " + project_path + ";"
 
     build_command = dir_command + build_command
     build_command = build_command + " > " + values.file_log_build
-    ret_code = execute_command(build_command)
+    ret_code = execute_command(build_command, deadline=deadline)
     if int(ret_code) != 0:
         emitter.error(build_command)
         error_exit("BUILD FAILED!!\nExit Code: " + str(ret_code))
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import struct
+from pathlib import Path
+
+"""
+Normalized hashing of Java class files.
+
+Two class files get the same normalized hash if they only differ in debug information, i.e., the attributes in
+`DEBUG_ATTRIBUTES`. The hash is computed over a canonical byte stream, not over a valid class file.
+"""
+
+DEBUG_ATTRIBUTES = frozenset([
+    "LineNumberTable",
+    "LocalVariableTable",
+    "LocalVariableTypeTable",
+    "SourceFile",
+    "SourceDebugExtension"
+])
+
+# constant pool tag -> size of the entry after the tag; Utf8 (1) has a variable size
+_CONSTANT_SIZES = {
+    3: 4, 4: 4, 5: 8, 6: 8, 7: 2, 8: 2, 9: 4, 10: 4, 11: 4, 12: 4, 15: 3, 16: 2, 17: 4, 18: 4, 19: 2, 20: 2
+}
+
+
+class ClassFileError(Exception):
+    pass
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def take(self, n):
+        if self.pos + n > len(self.data):
+            raise ClassFileError("truncated class file")
+        chunk = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return chunk
+
+    def u1(self):
+        return self.take(1)[0]
+
+    def u2(self):
+        return struct.unpack(">H", self.take(2))[0]
+
+    def u4(self):
+        return struct.unpack(">I", self.take(4))[0]
+
+
+def normalized_class_hash(class_file):
+    with open(class_file, 'rb') as f:
+        data = f.read()
+
+    reader = _Reader(data)
+    h = hashlib.sha256()
+
+    if reader.u4() != 0xCAFEBABE:
+        raise ClassFileError(f"{str(class_file)} is not a class file")
+    reader.take(4)  # minor & major versions
+
+    # constant pool; copied verbatim, but Utf8 entries are remembered to resolve attribute names
+    cp_start = reader.pos - 8
+    utf8 = {}
+    count = reader.u2()
+    index = 1
+    while index < count:
+        tag = reader.u1()
+        if tag == 1:
+            utf8[index] = reader.take(reader.u2()).decode("utf-8", errors="replace")
+        elif tag in _CONSTANT_SIZES:
+            reader.take(_CONSTANT_SIZES[tag])
+        else:
+            raise ClassFileError(f"unknown constant pool tag {tag} in {str(class_file)}")
+        index += 2 if tag in (5, 6) else 1
+    h.update(data[cp_start:reader.pos])
+
+    def feed_attributes():
+        # debug attributes are skipped without a trace; every kept attribute is delimited by its name
+        for _ in range(reader.u2()):
+            name = utf8.get(reader.u2())
+            length = reader.u4()
+            if name in DEBUG_ATTRIBUTES:
+                reader.take(length)
+                continue
+            h.update(str(name).encode("utf-8"))
+            h.update(b"\0")
+            if name == "Code":
+                feed_code()
+            else:
+                h.update(struct.pack(">I", length))
+                h.update(reader.take(length))
+        h.update(b"\1")
+
+    def feed_code():
+        h.update(reader.take(4))  # max_stack & max_locals
+        code_length = reader.u4()
+        h.update(struct.pack(">I", code_length))
+        h.update(reader.take(code_length))
+        exception_table_length = reader.u2()
+        h.update(struct.pack(">H", exception_table_length))
+        h.update(reader.take(8 * exception_table_length))
+        feed_attributes()
+
+    # access flags, this class, super class
+    h.update(reader.take(6))
+    num_interfaces = reader.u2()
+    h.update(struct.pack(">H", num_interfaces))
+    h.update(reader.take(2 * num_interfaces))
+
+    for _ in range(2):  # fields, then methods
+        num_members = reader.u2()
+        h.update(struct.pack(">H", num_members))
+        for _ in range(num_members):
+            h.update(reader.take(6))  # access flags, name, descriptor
+            feed_attributes()
+
+    feed_attributes()
+
+    if reader.pos != len(data):
+        raise ClassFileError(f"trailing bytes in {str(class_file)}")
+
+    return h.hexdigest()
+
+
+def class_hashes(bin_dir):
+    """
+    :return: map from path of each class file under `bin_dir`, relative to `bin_dir`, to its normalized hash
+    """
+    result = {}
+    for dir_path, _, file_names in os.walk(bin_dir):
+        for file_name in file_names:
+            if file_name.endswith(".class"):
+                class_file = Path(dir_path, file_name)
+                result[str(class_file.relative_to(bin_dir))] = normalized_class_hash(class_file)
+    return result
+
+
+def digest_class_hashes(hashes):
+    h = hashlib.sha256()
+    for relative_path, class_hash in sorted(hashes.items()):
+        h.update(relative_path.encode("utf-8"))
+        h.update(b"\0")
+        h.update(class_hash.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
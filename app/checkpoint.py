@@ -0,0 +1,50 @@
+import os
+import pickle
+from pathlib import Path
+
+from app import interning, values
+
+"""
+Checkpoints of the co-evolution state, written at the end of each iteration so that a run can be resumed with
+`--resume` after a crash.
+
+A checkpoint holds two pickles: first the interning registries, then the state itself. The registries are restored
+before the state is unpickled, so that tests and patches get back the same ids that the spectra and the kill matrix
+refer to.
+"""
+
+CHECKPOINT_FILENAME = "checkpoint.pkl"
+
+
+def get_checkpoint_file():
+    return Path(values.dir_output, CHECKPOINT_FILENAME)
+
+
+def save(state):
+    """
+    Atomically replace the checkpoint with `state`, a dict.
+    """
+    checkpoint_file = get_checkpoint_file()
+    tmp_file = Path(checkpoint_file.parent, f".{CHECKPOINT_FILENAME}.tmp")
+    with open(tmp_file, 'wb') as f:
+        pickle.dump({"tests": interning.tests, "patches": interning.patches, "locations": interning.locations}, f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, checkpoint_file)
+
+
+def load():
+    """
+    Restore the interning registries and return the state of the last checkpoint, or None if there is none.
+    """
+    checkpoint_file = get_checkpoint_file()
+    if not checkpoint_file.is_file():
+        return None
+    with open(checkpoint_file, 'rb') as f:
+        registries = pickle.load(f)
+        interning.tests = registries["tests"]
+        interning.patches = registries["patches"]
+        interning.locations = registries["locations"]
+        return pickle.load(f)
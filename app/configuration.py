@@ -42,6 +42,13 @@ class Configurations:
         self.__runtime_config_values["num-perfect-patches"] = arg_list.num_perfect_patches
         self.__runtime_config_values["patch-gen-timeout"] = arg_list.patch_gen_timeout
         self.__runtime_config_values["test-gen-timeout"] = arg_list.test_gen_timeout
+        self.__runtime_config_values["test-gen-jobs"] = arg_list.test_gen_jobs
+        self.__runtime_config_values["max-cpus"] = arg_list.max_cpus
+        self.__runtime_config_values["max-memory"] = arg_list.max_memory
+        self.__runtime_config_values["test-minimization"] = arg_list.test_minimization
+        self.__runtime_config_values["fl-top-k"] = arg_list.fl_top_k
+        self.__runtime_config_values["pipelined"] = arg_list.pipelined
+        self.__runtime_config_values["resume"] = arg_list.resume
         self.__runtime_config_values["num-iterations"] = arg_list.num_iterations
         self.__runtime_config_values["total-timeout"] = arg_list.total_timeout
         self.__runtime_config_values["dry-run-patch"] = arg_list.dry_run_patch
@@ -110,6 +117,17 @@ class Configurations:
         emitter.configuration("desired number of perfect patches", values.num_perfect_patches)
         emitter.configuration("patch generation timeout", values.patch_gen_timeout)
         emitter.configuration("test generation timeout", values.test_gen_timeout)
+        emitter.configuration("maximum number of concurrent test generation runs",
+                              values.test_gen_jobs if values.test_gen_jobs > 0 else "number of available CPUs")
+        emitter.configuration("CPUs for external tools",
+                              values.max_cpus if values.max_cpus > 0 else "number of available CPUs")
+        emitter.configuration("memory for external tools (MiB)",
+                              values.max_memory if values.max_memory > 0 else "available memory")
+        emitter.configuration("minimize killing tests for patch generation", values.minimize_tests)
+        emitter.configuration("number of suspicious locations given to patch generation",
+                              values.fl_top_k if values.fl_top_k is not None else "all")
+        emitter.configuration("overlap test generation with the next patch generation", values.pipelined)
+        emitter.configuration("resume from the last checkpoint", values.resume)
         emitter.configuration("number of iterations to run", values.num_iterations)
         emitter.configuration("total timeout", values.total_timeout)
         emitter.configuration("dry run for patch generation", values.dry_run_repair)
@@ -149,6 +167,13 @@ class Configurations:
         values.num_perfect_patches = self.__runtime_config_values["num-perfect-patches"]
         values.patch_gen_timeout = self.__runtime_config_values["patch-gen-timeout"]
         values.test_gen_timeout = self.__runtime_config_values["test-gen-timeout"]
+        values.test_gen_jobs = self.__runtime_config_values["test-gen-jobs"]
+        values.max_cpus = self.__runtime_config_values["max-cpus"]
+        values.max_memory = self.__runtime_config_values["max-memory"]
+        values.minimize_tests = self.__runtime_config_values["test-minimization"]
+        values.fl_top_k = self.__runtime_config_values["fl-top-k"]
+        values.pipelined = self.__runtime_config_values["pipelined"]
+        values.resume = self.__runtime_config_values["resume"]
         values.num_iterations = self.__runtime_config_values["num-iterations"]
         values.total_timeout = self.__runtime_config_values["total-timeout"]
         values.no_test_filtered = self.__runtime_config_values["no-test-filtered"]
@@ -172,6 +197,8 @@ class Configurations:
         time = datetime.now(tz=timezone(offset=timedelta(hours=8))).strftime("%y%m%d_%H%M%S")
         if self.__runtime_config_values['dir-output'] is not None:
             values.dir_output = Path(self.__runtime_config_values['dir-output']).resolve()
+        elif values.resume:
+            error_exit("--resume requires --dir-output of the run to resume")
         else:
             values.dir_output = Path(values.dir_output_base, f"{subject_id}-{time}")
         values.file_oracle_locations = Path(values.dir_output, values.filename_oracle_locations)
@@ -203,7 +230,10 @@ class Configurations:
         values.fix_locations = self.__runtime_config_values["fix-locations"]
 
     def prepare_experiment(self):
-        if not values.use_cache:
+        if values.resume:
+            if not os.path.isdir(values.dir_output):
+                error_exit(f"cannot resume: output directory {str(values.dir_output)} does not exist")
+        elif not values.use_cache:
             if os.path.isdir(values.dir_output):
                 shutil.rmtree(values.dir_output)
             os.mkdir(values.dir_output)
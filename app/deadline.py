@@ -0,0 +1,68 @@
+import time
+
+from app import values
+
+"""
+Deadlines passed from the phases of a run down to every external tool.
+
+A `Deadline` is a point in time (or none, for no limit). Phases derive tighter deadlines for their steps with
+`within`, and size the budgets they give to tools with `budget`, from the time that is actually left. The executor
+stops a tool whose deadline passes, and raises `DeadlineExceeded`.
+"""
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, end=None):
+        self.end = end  # seconds since the epoch; None for no limit
+
+    @staticmethod
+    def of_run():
+        """
+        :return: the deadline of the whole run, i.e., --total-timeout
+        """
+        return Deadline(values.time_system_end)
+
+    def remaining(self):
+        """
+        :return: seconds left, at least 0; None if there is no limit
+        """
+        if self.end is None:
+            return None
+        return max(self.end - time.time(), 0)
+
+    def expired(self):
+        return self.end is not None and time.time() >= self.end
+
+    def check(self, what):
+        """
+        :raise DeadlineExceeded: if the deadline has passed, naming `what` could not be done
+        """
+        if self.expired():
+            raise DeadlineExceeded(f"deadline passed before {what}")
+
+    def within(self, seconds):
+        """
+        :return: a deadline `seconds` from now, or this one if it is earlier; `seconds` of None or 0 means no limit
+        """
+        if not seconds:
+            return self
+        end = time.time() + seconds
+        return Deadline(end if self.end is None else min(self.end, end))
+
+    def budget(self, seconds, parts=1):
+        """
+        :return: `seconds`, reduced to an equal share of the time left when it is split into `parts`;
+                 `seconds` of None or 0 means as much as is left
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return seconds
+        share = remaining / max(parts, 1)
+        return min(seconds, share) if seconds else share
+
+    def __repr__(self):
+        return f"Deadline({self.end})"
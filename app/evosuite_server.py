@@ -1,10 +1,11 @@
-from app import emitter, utilities, values
+from app import emitter, interning, utilities, values
 from app.uniapr import run_uniapr
 from app.test_suite import TestSuite, Test, IndexedTest
 from app.tester import read_evosuite_version
 from app.validator import validate
 from app import repair
 from app.patch import IndexedPatch
+from app.kill_matrix import KillMatrix
 
 import os
 from pathlib import Path
@@ -22,7 +23,7 @@ import itertools
 hall_of_fame_i_patches = set()
 perfect_i_patches = set()
 all_i_tests = set()
-kill_matrix = defaultdict(set)  # IndexedPatch |-> set(IndexedTest)
+kill_matrix = KillMatrix()
 
 evosuite_goal_i_patches = set()
 
@@ -113,16 +114,17 @@ async def main():
 
         patch_gen_timeout_in_secs = 1200
 
-        validation_result = validate(evosuite_goal_i_patches, indexed_tests, dir_validation)
+        validation_result, _, _ = validate(evosuite_goal_i_patches, indexed_tests, dir_validation)
 
-        reply_kill_matrix = defaultdict(list)
+        reply_kill_matrix = KillMatrix()
         useful_i_tests = set()
 
         num_killed_patches = 0
 
         for i_patch, _, failing_i_tests in validation_result:
             for i_test in failing_i_tests:
-                reply_kill_matrix[i_test].append(i_patch)
+                reply_kill_matrix.add(i_test.id, i_patch.id)
+                kill_matrix.add(i_test.id, i_patch.id)
                 useful_i_tests.add(i_test)
             if failing_i_tests:
                 if i_patch in perfect_i_patches:
@@ -159,8 +161,12 @@ async def main():
             "cmd": json_data["cmd"],
             "data": {
                 "killMatrix": [
-                    {"testName": i_test.method_name, "killedPatches": [str(i_patch) for i_patch in killed_i_patches]}
-                    for i_test, killed_i_patches in reply_kill_matrix.items()
+                    {
+                        "testName": interning.tests.object_of(test_id).method_name,
+                        "killedPatches": [str(interning.patches.object_of(patch_id))
+                                          for patch_id in reply_kill_matrix.get_killed_patches(test_id)]
+                    }
+                    for test_id in reply_kill_matrix.get_test_ids()
                 ],
                 "patches": [{"index": str(i_patch)} for i_patch in evosuite_goal_i_patches],
                 "fixLocations": goal_fix_locations
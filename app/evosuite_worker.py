@@ -0,0 +1,176 @@
+import json
+import os
+import shlex
+import shutil
+import socket
+import subprocess
+import threading
+from pathlib import Path
+from subprocess import STDOUT
+
+from app import emitter, executor, utilities, values
+from app.deadline import Deadline
+
+"""
+Long-running EvoSuite processes that are reused across classes and iterations.
+
+Each worker is a JVM running `evorepair.EvoSuiteWorker` (see extern/evosuite-worker) with EvoSuite on its classpath.
+It connects back to a socket opened here and then takes generation jobs, one JSON object per line, so that JVM
+startup, loading EvoSuite and loading the project classpath are paid once per worker instead of once per EvoSuite run.
+The client of EvoSuite runs in the worker's JVM for every job.
+
+A worker reserves no resources of its own: each job reserves a CPU and the memory of a worker while it runs (see
+`tester.run_evosuite_job`), so that idle workers do not hold back other tools. Since a worker is only started for a
+job that holds such a reservation, there are never more workers than the budget can run at a time.
+
+Workers are only used if `values.use_evosuite_worker` is set, which has no command line option until the worker has
+been built and tested against EvoSuite.
+"""
+
+WORKER_JAR = Path(values._dir_root, "extern", "evosuite-worker", "target",
+                  "evosuite-worker-1.0-SNAPSHOT-jar-with-dependencies.jar")
+
+STARTUP_TIMEOUT = 60  # seconds
+
+POLL_INTERVAL = 1  # seconds
+
+MEMORY_MB = 2 * executor.DEFAULT_MEMORY_MB  # reserved by each job, and bounds the heap of a worker
+
+
+class EvoSuiteWorker:
+    def __init__(self, evosuite_jar, log_file):
+        assert os.path.isfile(WORKER_JAR), str(WORKER_JAR)
+        assert os.path.isfile(evosuite_jar), str(evosuite_jar)
+
+        java_executable = shutil.which("java")
+        if java_executable is None:
+            raise RuntimeError("Java executable not found")
+
+        server_socket = socket.socket()
+        server_socket.bind(("localhost", 0))
+        server_socket.listen(1)
+        server_socket.settimeout(STARTUP_TIMEOUT)
+        _, port = server_socket.getsockname()
+
+        heap_size = int(MEMORY_MB * executor.JVM_HEAP_RATIO)
+        command = (f"{java_executable} -Xmx{heap_size}m -cp {str(WORKER_JAR)}:{str(evosuite_jar)}"
+                   f" evorepair.EvoSuiteWorker {port}")
+        emitter.command(command)
+
+        self.log_file = log_file
+        self.log_fp = open(log_file, 'a')
+        # resources are reserved by the jobs of the worker, not by the worker itself.
+        # Its resource usage is charged to the span in which it was started, once it is shut down.
+        self.popen = executor.popen(shlex.split(command), "EvoSuite worker", cpus=0, memory_mb=0,
+                                    stdout=self.log_fp, stderr=STDOUT)
+        try:
+            self.connection, _ = server_socket.accept()
+        except socket.timeout:
+            self.kill()
+            utilities.error_exit(f"EvoSuite worker did not connect within {STARTUP_TIMEOUT} seconds",
+                                 f"see logs in {str(log_file)}")
+        finally:
+            server_socket.close()
+        self.connection.settimeout(POLL_INTERVAL)
+        self.buffer = bytearray()
+
+    def is_alive(self):
+        return executor.poll(self.popen) is None
+
+    def run_job(self, args, base_dir, stop_event=None, deadline=None):
+        """
+        Run EvoSuite with command line arguments `args`, writing tests to `base_dir`.
+
+        :return: reply of the worker, i.e., a dict with "status", "message" and "files";
+                 None if the job is cancelled by `deadline` (default: of the run) or `stop_event`, in which case
+                 the worker is killed
+        """
+        if deadline is None:
+            deadline = Deadline.of_run()
+        job = {"args": [str(x) for x in args], "baseDir": str(base_dir)}
+        self.connection.sendall((json.dumps(job) + "\n").encode("utf-8"))
+
+        while b"\n" not in self.buffer:
+            if deadline.expired() or (stop_event is not None and stop_event.is_set()):
+                self.kill()
+                return None
+            try:
+                chunk = self.connection.recv(1 << 16)
+            except socket.timeout:
+                continue
+            if not chunk:
+                self.kill()
+                utilities.error_exit("EvoSuite worker exited unexpectedly", f"see logs in {str(self.log_file)}")
+            self.buffer.extend(chunk)
+
+        line, _, rest = bytes(self.buffer).partition(b"\n")
+        self.buffer = bytearray(rest)
+        return json.loads(line.decode("utf-8"))
+
+    def close(self):
+        try:
+            self.connection.close()
+            executor.wait(self.popen, timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            self.kill()
+        self.log_fp.close()
+
+    def kill(self):
+        executor.kill(self.popen)
+        try:
+            self.connection.close()
+        except (AttributeError, OSError):
+            pass
+        self.log_fp.close()
+
+
+_idle_workers = []
+_lock = threading.Lock()
+_num_started = 0
+
+
+def acquire(evosuite_jar, dir_logs):
+    """
+    Take an idle worker, or start a new one if there is none. Call with a job's reservation held (see module
+    docstring), which bounds the number of workers.
+    """
+    global _num_started
+
+    with _lock:
+        while _idle_workers:
+            worker = _idle_workers.pop()
+            if worker.is_alive():
+                return worker
+            worker.kill()
+        _num_started += 1
+        worker_no = _num_started
+
+    os.makedirs(dir_logs, exist_ok=True)
+    emitter.normal(f"\tstarting EvoSuite worker #{worker_no}")
+    return EvoSuiteWorker(evosuite_jar, Path(dir_logs, f"worker{worker_no}.log"))
+
+
+def max_workers():
+    """
+    :return: number of workers whose jobs the resource budget can run at a time
+    """
+    budget = executor.get_budget()
+    return max(min(budget.cpus, budget.memory_mb // MEMORY_MB), 1)
+
+
+def release(worker):
+    with _lock:
+        if not worker.is_alive():
+            return
+        if len(_idle_workers) < max_workers():
+            _idle_workers.append(worker)
+            return
+    worker.close()
+
+
+def shutdown():
+    with _lock:
+        workers = list(_idle_workers)
+        _idle_workers.clear()
+    for worker in workers:
+        worker.close()
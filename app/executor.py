@@ -0,0 +1,397 @@
+import atexit
+import heapq
+import itertools
+import os
+import signal
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+from app import emitter, profiler, utilities, values
+from app.deadline import Deadline, DeadlineExceeded
+
+"""
+The single place where external tools (JVMs, javac, build and patch commands) are started.
+
+Every process reserves CPU slots and memory from global budgets (`--max-cpus`, `--max-memory`) before it is started,
+and gives them back when it is reaped. Requests that do not fit wait in a queue ordered by priority, then by arrival,
+so that work on the critical path of the co-evolution loop goes ahead of background work (e.g., a pipelined
+evaluation), and so that several phases can run tools in parallel without oversubscribing the machine.
+
+The heap of a JVM is set from its memory reservation if the caller gives one; otherwise the JVM keeps its default
+heap size, and the default reservation only accounts for it in the budget. Processes are started and reaped through `profiler`, so they
+show up in the profile; reap them with `wait`, `poll`, `communicate` or `terminate` of this module.
+
+A `Deadline` bounds both the wait for resources and the run of a process; when it passes, the process is terminated
+(SIGTERM, then SIGKILL after a grace period) and `DeadlineExceeded` is raised.
+
+Every process is started in a session, and thus a process group, of its own, so that it does not get the signals
+meant for this process and can be stopped together with everything it started (e.g., the client JVMs of EvoSuite or
+the children of a shell command). The groups are tracked until they are empty: `kill_all` stops all of them and runs
+at exit, and a reaper thread stops what is left in a group after its leader has exited.
+"""
+
+PRIORITY_CRITICAL = 0  # on the critical path of the co-evolution loop
+PRIORITY_BACKGROUND = 10  # overlaps the critical path, e.g., a pipelined evaluation
+
+DEFAULT_MEMORY_MB = 2048  # reservation of a process that does not give one; does not limit its heap
+SMALL_MEMORY_MB = 256  # reservation of small native tools, e.g., patch
+JVM_HEAP_RATIO = 0.75  # share of the reservation of a JVM given to its heap; the rest is for metaspace, stacks, etc.
+TERMINATION_GRACE = 10  # seconds between SIGTERM and SIGKILL
+REAP_INTERVAL = 30  # seconds between two checks for processes left over in the group of an exited process
+
+
+class Budget:
+    def __init__(self, cpus, memory_mb):
+        self.cpus = cpus
+        self.memory_mb = memory_mb
+        self.free_cpus = cpus
+        self.free_memory_mb = memory_mb
+        self.__waiting = []  # heap of (priority, arrival)
+        self.__arrivals = itertools.count()
+        self.__condition = threading.Condition()
+
+    def acquire(self, cpus, memory_mb, priority, timeout=None):
+        """
+        Wait until the request is the most urgent one and fits. A request larger than the whole budget is reduced
+        to the whole budget.
+
+        :return: (cpus, memory_mb) actually reserved, to be given back with `release`
+        :raise subprocess.TimeoutExpired: if the request cannot be granted within `timeout` seconds
+        """
+        cpus = min(cpus, self.cpus)
+        memory_mb = min(memory_mb, self.memory_mb)
+        time_to_stop = time.time() + timeout if timeout is not None else None
+        with self.__condition:
+            ticket = (priority, next(self.__arrivals))
+            heapq.heappush(self.__waiting, ticket)
+            try:
+                while (self.__waiting[0] != ticket
+                       or self.free_cpus < cpus or self.free_memory_mb < memory_mb):
+                    remaining = time_to_stop - time.time() if time_to_stop is not None else None
+                    if remaining is not None and remaining <= 0:
+                        raise subprocess.TimeoutExpired("(waiting for resources)", timeout)
+                    self.__condition.wait(remaining)
+            except BaseException:
+                self.__waiting.remove(ticket)
+                heapq.heapify(self.__waiting)
+                self.__condition.notify_all()
+                raise
+            heapq.heappop(self.__waiting)
+            self.free_cpus -= cpus
+            self.free_memory_mb -= memory_mb
+            # the next request may fit as well
+            self.__condition.notify_all()
+        return cpus, memory_mb
+
+    def release(self, cpus, memory_mb):
+        with self.__condition:
+            self.free_cpus += cpus
+            self.free_memory_mb += memory_mb
+            self.__condition.notify_all()
+
+
+_budget = None
+_budget_lock = threading.Lock()
+_local = threading.local()
+_lock = threading.Lock()
+_reservation_for_pid = {}
+_leader_for_group = {}  # id of a process group started here |-> its leader
+_leftover_groups = set()  # groups whose leader has exited, and that have been sent SIGTERM by the reaper
+_reaper = None
+
+
+def get_budget():
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            cpus = values.max_cpus if values.max_cpus > 0 else utilities.available_cpus()
+            memory_mb = values.max_memory if values.max_memory > 0 else utilities.available_memory_mb()
+            _budget = Budget(cpus, memory_mb)
+        return _budget
+
+
+def current_priority():
+    """
+    :return: priority of the tools started by this thread, unless given explicitly
+    """
+    return getattr(_local, "priority", PRIORITY_CRITICAL)
+
+
+@contextmanager
+def priority(level):
+    """
+    Start the tools of this thread with priority `level` (lower is more urgent). Threads started from here do not
+    inherit it; pass `current_priority()` to them.
+    """
+    previous = current_priority()
+    _local.priority = level
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def _acquire(cpus, memory_mb, priority, timeout, deadline):
+    if deadline is not None:
+        deadline.check("acquiring resources")
+    limit = (deadline or Deadline()).within(timeout)
+    try:
+        return get_budget().acquire(cpus, memory_mb, priority if priority is not None else current_priority(),
+                                    limit.remaining())
+    except subprocess.TimeoutExpired:
+        if deadline is not None and deadline.expired():
+            raise DeadlineExceeded("deadline passed while waiting for resources")
+        raise
+
+
+@contextmanager
+def reserve(cpus=1, memory_mb=0, priority=None, timeout=None, deadline=None):
+    """
+    Hold resources for work that is not a process of its own, e.g., a job of a long-running worker.
+    """
+    reserved = _acquire(cpus, memory_mb, priority, timeout, deadline)
+    try:
+        yield
+    finally:
+        get_budget().release(*reserved)
+
+
+def _with_heap_size(args, memory_mb):
+    if isinstance(args, (str, bytes)) or not args or os.path.basename(str(args[0])) != "java":
+        return args
+    if any(str(arg).startswith("-Xmx") for arg in args):
+        return args
+    return [args[0], f"-Xmx{max(int(memory_mb * JVM_HEAP_RATIO), 64)}m", *args[1:]]
+
+
+def _signal_group(pgid, sig):
+    """
+    :return: whether the group still had a process to signal
+    """
+    try:
+        os.killpg(pgid, sig)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # the id has been taken by a group that is not ours
+        return False
+
+
+def _get_live_groups():
+    """
+    :return: ids of the process groups with a process that is not a zombie (zombies do not take signals, and are
+             reaped by their parent, which may not be this process); None if it cannot be told
+    """
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return None
+    groups = set()
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # state and process group follow the command name, which is in parentheses and may contain anything
+        fields = stat[stat.rindex(")") + 2:].split()
+        if fields[0] != "Z":
+            groups.add(int(fields[2]))
+    return groups
+
+
+def _is_live_group(pgid, live_groups):
+    return pgid in live_groups if live_groups is not None else _signal_group(pgid, 0)
+
+
+def _forget_group(pgid):
+    with _lock:
+        _leader_for_group.pop(pgid, None)
+        _leftover_groups.discard(pgid)
+
+
+def reap_leftovers():
+    """
+    Stop the processes left over in the groups of exited processes: SIGTERM the first time they are seen, SIGKILL the
+    next time. Forget groups that are empty.
+    """
+    with _lock:
+        groups = [pgid for pgid, leader in _leader_for_group.items() if leader.returncode is not None]
+    if not groups:
+        return
+    live_groups = _get_live_groups()
+    for pgid in groups:
+        if not _is_live_group(pgid, live_groups):
+            _forget_group(pgid)
+            continue
+        with _lock:
+            seen_before = pgid in _leftover_groups
+            _leftover_groups.add(pgid)
+        _signal_group(pgid, signal.SIGKILL if seen_before else signal.SIGTERM)
+
+
+def _run_reaper():
+    while True:
+        time.sleep(REAP_INTERVAL)
+        try:
+            reap_leftovers()
+        except Exception as e:
+            # the reaper must keep running; a failure here only delays the cleanup
+            emitter.warning(f"failed to reap leftover processes: {str(e)}")
+
+
+def _start_reaper():
+    global _reaper
+    with _lock:
+        if _reaper is not None:
+            return
+        _reaper = threading.Thread(target=_run_reaper, name="process reaper", daemon=True)
+    _reaper.start()
+    atexit.register(kill_all)
+
+
+def popen(args, name, cpus=1, memory_mb=None, priority=None, timeout=None, deadline=None, parent=None, **kwargs):
+    """
+    Reserve resources and start a process like `subprocess.Popen`, in a new session. If `memory_mb` is given and
+    `args` is a list that starts a JVM without -Xmx, its maximum heap size is set from `memory_mb`.
+
+    :param memory_mb: memory to reserve; DEFAULT_MEMORY_MB if None, without limiting the heap of a JVM
+    :param timeout: how long to wait for resources, in seconds
+    :param deadline: Deadline by which resources must be granted; the caller stops the process at the deadline
+    """
+    if parent is None:
+        parent = profiler.current()
+    _start_reaper()
+    reserved = _acquire(cpus, memory_mb if memory_mb is not None else DEFAULT_MEMORY_MB, priority, timeout, deadline)
+    if memory_mb is not None:
+        args = _with_heap_size(args, reserved[1])
+    try:
+        process = profiler.popen(args, name, parent=parent, start_new_session=True, **kwargs)
+    except BaseException:
+        get_budget().release(*reserved)
+        raise
+    with _lock:
+        _reservation_for_pid[process.pid] = reserved
+        _leader_for_group[process.pid] = process
+    return process
+
+
+def _release_if_reaped(process):
+    if process.returncode is None:
+        return
+    with _lock:
+        reserved = _reservation_for_pid.pop(process.pid, None)
+    if reserved is not None:
+        get_budget().release(*reserved)
+        if not _signal_group(process.pid, 0):
+            _forget_group(process.pid)
+
+
+def poll(process):
+    try:
+        return profiler.poll(process)
+    finally:
+        _release_if_reaped(process)
+
+
+def wait(process, timeout=None):
+    try:
+        return profiler.wait(process, timeout)
+    finally:
+        _release_if_reaped(process)
+
+
+def communicate(process, timeout=None):
+    try:
+        return profiler.communicate(process, timeout)
+    finally:
+        _release_if_reaped(process)
+
+
+def terminate(process, grace=TERMINATION_GRACE):
+    """
+    Stop the process and its group with SIGTERM, or with SIGKILL if the process is still running after `grace`
+    seconds, and reap it. What is left in the group afterwards is killed.
+    """
+    if poll(process) is None:
+        _signal_group(process.pid, signal.SIGTERM)
+        try:
+            communicate(process, grace)
+        except subprocess.TimeoutExpired:
+            _signal_group(process.pid, signal.SIGKILL)
+            communicate(process)
+    _signal_group(process.pid, signal.SIGKILL)
+    return process.returncode
+
+
+def kill(process):
+    """
+    Kill the process and its group with SIGKILL, and reap the process.
+    """
+    _signal_group(process.pid, signal.SIGKILL)
+    wait(process)
+    return process.returncode
+
+
+def kill_all(grace=TERMINATION_GRACE):
+    """
+    Stop all the process groups started here, e.g., when the run ends or fails: SIGTERM, then SIGKILL for the groups
+    that are not empty after `grace` seconds. Their leaders are reaped.
+    """
+    with _lock:
+        groups = list(_leader_for_group.items())
+    if not groups:
+        return
+    groups = [(pgid, leader) for pgid, leader in groups if _signal_group(pgid, signal.SIGTERM)]
+
+    time_to_stop = time.time() + grace
+    while groups and time.time() < time_to_stop:
+        time.sleep(0.05)
+        for _, leader in groups:
+            poll(leader)
+        live_groups = _get_live_groups()
+        groups = [(pgid, leader) for pgid, leader in groups
+                  if leader.returncode is None or _is_live_group(pgid, live_groups)]
+
+    for pgid, leader in groups:
+        _signal_group(pgid, signal.SIGKILL)
+    for pgid, leader in groups:
+        try:
+            wait(leader, grace)
+        except subprocess.TimeoutExpired:
+            pass
+    with _lock:
+        _leader_for_group.clear()
+        _leftover_groups.clear()
+
+
+def run(args, name, cpus=1, memory_mb=None, priority=None, timeout=None, deadline=None, parent=None,
+        **kwargs):
+    """
+    Like `subprocess.run` without input and `check`. `timeout` and `deadline` cover both waiting for resources and
+    running; the process is terminated when either runs out.
+
+    :raise subprocess.TimeoutExpired: if `timeout` runs out first
+    :raise DeadlineExceeded: if `deadline` passes first
+    """
+    if deadline is None:
+        deadline = Deadline()
+    limit = deadline.within(timeout)
+    process = popen(args, name, cpus=cpus, memory_mb=memory_mb, priority=priority, timeout=timeout,
+                    deadline=deadline, parent=parent, **kwargs)
+    try:
+        stdout, stderr = communicate(process, limit.remaining())
+    except subprocess.TimeoutExpired:
+        terminate(process)
+        if deadline.expired():
+            raise DeadlineExceeded(f"{name} was stopped at the deadline")
+        raise
+    except BaseException:
+        kill(process)
+        raise
+    return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
@@ -0,0 +1,105 @@
+import sys
+import threading
+
+"""
+Interning of values that are created many times but compared and hashed even more often, e.g. the indices of
+tests and patches. Interned values that are equal are identical, so they can share memory and be compared by
+identity first.
+"""
+
+_interned_indices = {}
+
+
+def intern_index(index):
+    """
+    :param index: hashable tuple, e.g. a `TestIndex`
+    :return: the first tuple equal to `index` that was interned, with its strings interned as well
+    """
+    result = _interned_indices.get(index)
+    if result is None:
+        fields = (sys.intern(x) if type(x) is str else x for x in index)
+        index = index._make(fields) if hasattr(index, "_make") else tuple(fields)
+        result = _interned_indices.setdefault(index, index)
+    return result
+
+
+def intern_str(s):
+    return sys.intern(s)
+
+
+class Interner:
+    """
+    Dense integer ids for keys, assigned in order of first use. Optionally, an object can be registered for each
+    id, e.g. the `IndexedTest` of a test name.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._keys = []
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __getstate__(self):
+        # registered objects are registered again when they are unpickled
+        return {"keys": self._keys}
+
+    def __setstate__(self, state):
+        self._keys = state["keys"]
+        self._ids = {key: id_ for id_, key in enumerate(self._keys)}
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def id_of(self, key):
+        result = self._ids.get(key)
+        if result is None:
+            with self._lock:
+                result = self._ids.get(key)
+                if result is None:
+                    result = len(self._keys)
+                    self._keys.append(key)
+                    self._ids[key] = result
+        return result
+
+    def lookup(self, key):
+        """
+        :return: id of `key`, or None if `key` has never been interned
+        """
+        return self._ids.get(key)
+
+    def key_of(self, id_):
+        return self._keys[id_]
+
+    def register(self, id_, obj):
+        self._objects.setdefault(id_, obj)
+
+    def object_of(self, id_):
+        return self._objects[id_]
+
+    def object_of_key(self, key):
+        """
+        :return: object registered for the id of `key`, or None if `key` has never been interned or has no object
+        """
+        id_ = self._ids.get(key)
+        return self._objects.get(id_) if id_ is not None else None
+
+    def objects_of_keys(self, keys):
+        """
+        :return: objects registered for `keys`, in order, and the keys that have no object
+        """
+        objects = []
+        unknown_keys = []
+        for key in keys:
+            obj = self.object_of_key(key)
+            if obj is None:
+                unknown_keys.append(key)
+            else:
+                objects.append(obj)
+        return objects, unknown_keys
+
+
+tests = Interner()  # full test name, i.e. "{junit_class}#{method_name}"; objects are `IndexedTest`s
+patches = Interner()  # `PatchIndex`; objects are `IndexedPatch`s
+locations = Interner()  # `spectra.Location`
@@ -0,0 +1,125 @@
+from app.spectra import popcount, bitset
+
+"""
+Which generated tests kill which patches, over the ids of `interning.tests` and `interning.patches`.
+
+The matrix is stored twice as sparse rows of bitsets, once per test and once per patch, so that both
+"which patches does this test kill" and "which tests kill this patch" are single lookups, and unions over
+sets of tests or patches are bitwise ORs.
+"""
+
+
+def ids_of(bits):
+    """
+    :return: ids of the set bits of `bits`, in increasing order
+    """
+    ids = []
+    while bits:
+        lowest = bits & -bits
+        ids.append(lowest.bit_length() - 1)
+        bits ^= lowest
+    return ids
+
+
+class KillMatrix:
+    def __init__(self):
+        self.patches_of_test = {}  # test id |-> bitset of ids of killed patches
+        self.tests_of_patch = {}  # patch id |-> bitset of ids of killing tests
+        self.num_kills = 0
+
+    def add(self, test_id, patch_id):
+        """
+        :return: whether the kill is new
+        """
+        patch_bit = 1 << patch_id
+        patches = self.patches_of_test.get(test_id, 0)
+        if patches & patch_bit:
+            return False
+        self.patches_of_test[test_id] = patches | patch_bit
+        self.tests_of_patch[patch_id] = self.tests_of_patch.get(patch_id, 0) | (1 << test_id)
+        self.num_kills += 1
+        return True
+
+    def update(self, other):
+        for test_id, patches in other.patches_of_test.items():
+            for patch_id in ids_of(patches & ~self.patches_of_test.get(test_id, 0)):
+                self.add(test_id, patch_id)
+
+    def copy(self):
+        result = KillMatrix()
+        result.patches_of_test = dict(self.patches_of_test)
+        result.tests_of_patch = dict(self.tests_of_patch)
+        result.num_kills = self.num_kills
+        return result
+
+    def kills(self, test_id, patch_id):
+        return bool(self.patches_of_test.get(test_id, 0) >> patch_id & 1)
+
+    def get_killed_patches(self, test_id):
+        """
+        :return: ids of the patches killed by the test, in increasing order
+        """
+        return ids_of(self.patches_of_test.get(test_id, 0))
+
+    def get_killing_tests(self, patch_id):
+        """
+        :return: ids of the tests that kill the patch, in increasing order
+        """
+        return ids_of(self.tests_of_patch.get(patch_id, 0))
+
+    def get_killed_patches_bits(self, test_ids):
+        """
+        :return: bitset of the patches killed by any of the tests
+        """
+        result = 0
+        for test_id in test_ids:
+            result |= self.patches_of_test.get(test_id, 0)
+        return result
+
+    def get_killing_tests_bits(self, patch_ids):
+        """
+        :return: bitset of the tests that kill any of the patches
+        """
+        result = 0
+        for patch_id in patch_ids:
+            result |= self.tests_of_patch.get(patch_id, 0)
+        return result
+
+    def count_killed_patches(self, test_ids):
+        return popcount(self.get_killed_patches_bits(test_ids))
+
+    def get_uncovered_patches(self, patch_ids, test_ids):
+        """
+        :return: ids of the patches among `patch_ids` that none of the tests kill
+        """
+        return ids_of(bitset(patch_ids) & ~self.get_killed_patches_bits(test_ids))
+
+    def get_test_ids(self):
+        """
+        :return: ids of the tests that kill at least one patch
+        """
+        return self.patches_of_test.keys()
+
+    def get_patch_ids(self):
+        """
+        :return: ids of the patches killed by at least one test
+        """
+        return self.tests_of_patch.keys()
+
+    def __contains__(self, test_id):
+        return test_id in self.patches_of_test
+
+    def __len__(self):
+        return len(self.patches_of_test)
+
+    def __getstate__(self):
+        # the patch rows are the transpose of the test rows
+        return {"patches_of_test": self.patches_of_test}
+
+    def __setstate__(self, state):
+        self.patches_of_test = {}
+        self.tests_of_patch = {}
+        self.num_kills = 0
+        for test_id, patches in state["patches_of_test"].items():
+            for patch_id in ids_of(patches):
+                self.add(test_id, patch_id)
@@ -2,19 +2,25 @@ import csv
 import itertools
 import os
 import sys
+import shutil
 import time
 import argparse
 import traceback
 import signal
+import threading
 import multiprocessing as mp
 import app.utilities
 from app import emitter, logger, values, repair, builder, tester, validator, utilities, oracle_extractor
+from app import artifact_store, checkpoint, evosuite_worker, executor, interning, profiler, spectra_store
+from app import test_minimizer
 from app.configuration import  Configurations
+from app.deadline import Deadline, DeadlineExceeded
 from app.patch import IndexedPatch
 from app.test_suite import IndexedTest
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
 from collections import OrderedDict, Counter, defaultdict
+from concurrent.futures import Future
 import asyncio
 from app.test_suite import TestSuite, IndexedSuite, Test, IndexedTest
 from app.patch import Patch, IndexedPatch
@@ -22,6 +28,7 @@ import random
 import json
 from app.test_suite import USER_TEST_GENERATION
 from app.spectra import Spectra, Location
+from app.kill_matrix import KillMatrix, ids_of
 
 
 class Interval:
@@ -33,12 +40,14 @@ class Interval:
 class Timer:
     def __init__(self):
         self.time_intervals = OrderedDict()
+        self.spans = {}  # running phase |-> its profiler span
 
     def start_phase(self, phase):
         if self.__exists(phase):
             raise ValueError(f"Phase {phase} already exists")
 
         self.time_intervals[phase] = [Interval(time.time(), None)]
+        self.spans[phase] = profiler.begin(phase, "phase")
 
     def pause_phase(self, phase):
         if not self.__exists(phase):
@@ -47,6 +56,7 @@ class Timer:
             raise ValueError(f"Phase {phase} is already paused")
 
         self.time_intervals[phase][-1].end = time.time()
+        profiler.end(self.spans.pop(phase))
 
     def last_interval_duration(self, phase, unit="s"):
         if not self.__exists(phase):
@@ -64,11 +74,16 @@ class Timer:
             duration /= 3600
         return duration
 
+    def pause_if_running(self, phase):
+        if self.__exists(phase) and self.__is_running(phase):
+            self.pause_phase(phase)
+
     def pause_all(self):
         end_time = time.time()
         for phase, intervals in self.time_intervals.items():
             if self.__is_running(phase):
                 intervals[-1].end = end_time
+                profiler.end(self.spans.pop(phase))
 
     def resume_phase(self, phase):
         if not self.__exists(phase):
@@ -77,6 +92,48 @@ class Timer:
             raise ValueError(f"Phase {phase} is already running")
 
         self.time_intervals[phase].append(Interval(time.time(), None))
+        self.spans[phase] = profiler.begin(phase, "phase")
+
+    def get_state(self):
+        """
+        :return: map from phase to list of (start, end), with running phases ending now
+        """
+        now = time.time()
+        return OrderedDict([
+            (phase, [(interval.start, interval.end if interval.end is not None else now) for interval in intervals])
+            for phase, intervals in self.time_intervals.items()
+        ])
+
+    def merge_state(self, state):
+        """
+        Put the intervals of an earlier run, as returned by `get_state`, before the intervals of this timer.
+        """
+        time_intervals = OrderedDict()
+        for phase, intervals in state.items():
+            time_intervals[phase] = [Interval(start, end) for start, end in intervals]
+        for phase, intervals in self.time_intervals.items():
+            time_intervals.setdefault(phase, []).extend(intervals)
+        self.time_intervals = time_intervals
+
+    def merge(self, other):
+        """
+        Add the intervals of `other`, e.g., the timer of an evaluation that ran on another thread. A Timer is only
+        used by one thread at a time; the phases of `other` must be paused.
+        """
+        for phase, intervals in other.time_intervals.items():
+            assert intervals[-1].end is not None, f"Phase {phase} is still running"
+            merged = self.time_intervals.setdefault(phase, [])
+            running = merged.pop() if merged and merged[-1].end is None else None
+            merged.extend(Interval(interval.start, interval.end) for interval in intervals)
+            merged.sort(key=lambda interval: interval.start)
+            if running is not None:
+                merged.append(running)
+
+    def start_or_resume_phase(self, phase):
+        if self.__exists(phase):
+            self.resume_phase(phase)
+        else:
+            self.start_phase(phase)
 
     def summarize(self):
         for phase, intervals in self.time_intervals.items():
@@ -99,6 +156,47 @@ class Timer:
 
 timer = Timer()
 
+
+class Evaluation:
+    """
+    Test generation, validation and spectra retrieval of one iteration. The inputs are fixed when it is created,
+    so that it can run while the next iteration generates patches; see `run`.
+    """
+
+    def __init__(self, iteration_no, num_partitions, target_i_patches, validated_i_patches, new_i_patches,
+                 remaining_user_i_tests, redundant_killing_i_tests, dir_tests, target_patches_file, seed_tests_file,
+                 dir_validation, compile_tests, dry_run_test_gen):
+        self.iteration_no = iteration_no
+        self.num_partitions = num_partitions
+        self.target_i_patches = target_i_patches  # tests are generated for these, one per class of equivalent bytecode
+        self.validated_i_patches = validated_i_patches  # all perfect patches
+        self.new_i_patches = new_i_patches
+        self.remaining_user_i_tests = remaining_user_i_tests
+        self.redundant_killing_i_tests = redundant_killing_i_tests
+        self.dir_tests = dir_tests
+        self.target_patches_file = target_patches_file
+        self.seed_tests_file = seed_tests_file
+        self.dir_validation = dir_validation
+        self.compile_tests = compile_tests
+        self.dry_run_test_gen = dry_run_test_gen
+
+        self.seed_i_tests = set()
+        self.kill_matrix = KillMatrix()
+        self.test_gen_random_seed = 0
+        self.random_state = None  # of `random` at the end of the iteration, for its checkpoint
+        # the evaluation may run on another thread; its phases are timed separately and merged by `fold_evaluation`
+        self.timer = Timer()
+
+        self.generated_i_tests = []
+        self.non_compilable_i_tests = []
+        self.non_compilable_i_patches = []
+        self.noop_i_patches = []
+        self.validation_result = None  # None if the evaluation was cut short by the global timeout
+        self.spectra_file = None
+
+        self.profiler_span = profiler.current()  # the iteration
+
+
 stop_event = mp.Event()
 
 
@@ -107,7 +205,8 @@ def create_directories():
         values.dir_tmp,
         values.dir_output_base,
         values.dir_log_base,
-        values.dir_backup
+        values.dir_backup,
+        values.dir_cache
     ]
 
     for dir_i in dir_list:
@@ -126,6 +225,34 @@ def shutdown(signum, frame):
     raise SystemExit
 
 
+def discard_iteration_outputs(first_iteration_no):
+    """
+    Remove the outputs of iterations from `first_iteration_no` on, which a resumed run had not finished.
+    """
+    iteration_no = first_iteration_no
+    while True:
+        paths = [
+            Path(values.dir_info["repair"], f"gen{iteration_no}"),
+            Path(values.dir_info["repair"], f"gen{iteration_no}-args"),
+            Path(values.dir_info["repair"], "arja_tmp", f"gen{iteration_no}"),
+            Path(values.dir_info["repair"], f"gen{iteration_no}_log.txt"),
+            Path(values.dir_info["test-gen"], f"gen{iteration_no}"),
+            Path(values.dir_info["test-gen"], f"gen{iteration_no}-args"),
+            Path(values.dir_output, "validation", f"gen{iteration_no}"),
+            Path(values.dir_output, "spectra", f"gen{iteration_no}")
+        ]
+        existing_paths = [path for path in paths if os.path.lexists(path)]
+        if not existing_paths:
+            break
+        emitter.normal(f"discarding unfinished outputs of iteration #{iteration_no}")
+        for path in existing_paths:
+            if path.is_dir() and not path.is_symlink():
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        iteration_no += 1
+
+
 def bootstrap(arg_list):
     emitter.header("Starting " + values.tool_name + " (Co-Evolution for Java Repair) ")
     emitter.sub_title("Loading Configurations")
@@ -134,7 +261,14 @@ def bootstrap(arg_list):
     config.read_conf_file()
     config.update_configuration()
     config.prepare_experiment()
-    os.link(values.file_log_main, Path(values.dir_output, "log.txt"))
+    log_link = Path(values.dir_output, "log.txt")
+    if values.resume and os.path.lexists(log_link):
+        # keep the log of the run being resumed next to the new one
+        n = 1
+        while os.path.lexists(Path(values.dir_output, f"log.{n}.txt")):
+            n += 1
+        os.rename(log_link, Path(values.dir_output, f"log.{n}.txt"))
+    os.link(values.file_log_main, log_link)
     config.print_configuration()
     values.arg_parsed = True
 
@@ -146,7 +280,21 @@ def run(arg_list):
 
     bootstrap(arg_list)
 
-    oracle_extractor.extract_oracle_locations()
+    resumed_state = None
+    if values.resume:
+        resumed_state = checkpoint.load()
+        if resumed_state is None:
+            utilities.error_exit(f"cannot resume: no checkpoint in {str(values.dir_output)}")
+        emitter.information(f"resuming after iteration #{resumed_state['iteration_no']}")
+        discard_iteration_outputs(resumed_state["iteration_no"] + 1)
+        # user tests are scanned again (usually from the cache); the spectra directory is recreated
+        shutil.rmtree(Path(values.dir_info["repair"], "spectra"), ignore_errors=True)
+        # the time used before is taken off the total timeout, before any deadline is derived from it
+        values.time_elapsed_before_resume = resumed_state["elapsed"]
+        if values.total_timeout is not None:
+            values.time_system_end = values.time_system_start + values.total_timeout - values.time_elapsed_before_resume
+
+    oracle_extractor.extract_oracle_locations(Deadline.of_run())
     oracle_locations_file = Path(values.dir_output, "oracleLocations.json")
     assert os.path.isfile(oracle_locations_file), str(oracle_locations_file)
 
@@ -156,7 +304,7 @@ def run(arg_list):
     fame_i_patches = set()
     generated_i_tests = set()
     killing_i_tests = set()
-    kill_matrix = {}
+    kill_matrix = KillMatrix()
     user_i_tests = set()
     passing_user_i_tests = []
     failing_user_i_tests = []
@@ -165,10 +313,12 @@ def run(arg_list):
 
     dir_statistics = Path(values.dir_output, "statistics")
     os.makedirs(dir_statistics, exist_ok=True)
-    assert utilities.is_empty_dir(dir_statistics), str(dir_statistics)
+    if resumed_state is None:
+        assert utilities.is_empty_dir(dir_statistics), str(dir_statistics)
 
     stat_file = Path(dir_statistics, "statistics.csv")
-    assert not os.path.exists(stat_file), f"statistics file {str(stat_file)} already exists"
+    if resumed_state is None:
+        assert not os.path.exists(stat_file), f"statistics file {str(stat_file)} already exists"
 
     field_names = ["Iteration", "#Hall-of-Fame", "#Plausible", "#Valid", "#Overfitting",
                    "Hall-of-Fame", "Plausible\\Hall-of-Fame", "Valid\\Plausible", "#Generated-Tests",
@@ -178,49 +328,100 @@ def run(arg_list):
         writer = csv.DictWriter(f, fieldnames=field_names)
         writer.writeheader()
 
-    dir_kill_matrices = Path(dir_statistics, "kill_matrices")
-    os.makedirs(dir_kill_matrices)
+    # one line per iteration with the kills found since the previous one; see reader.read_kill_matrix
+    kill_matrix_file = Path(dir_statistics, "kill_matrix.jsonl")
+    if resumed_state is None:
+        assert not os.path.exists(kill_matrix_file), f"kill matrix file {str(kill_matrix_file)} already exists"
+    reported_kills = {}  # IndexedTest.id |-> bitset of the IndexedPatch.id reported so far
 
     iteration_stats = []
-    def report():
+    def report(iteration_no=None):
+        if iteration_no is None:
+            iteration_no = values.iteration_no
+
+        # in pipelined mode, patches of the next iteration may already be in the archive
+        perfect = set(x for x in perfect_i_patches if x.generation <= iteration_no)
+        plausible = set(x for x in plausible_i_patches if x.generation <= iteration_no)
+        fame = set(x for x in fame_i_patches if x.generation <= iteration_no)
         stat = {
-            "Iteration": values.iteration_no,
-            "#Hall-of-Fame": len(perfect_i_patches),
-            "#Plausible": len(plausible_i_patches),
-            "#Valid": len(fame_i_patches) + len(perfect_i_patches),
+            "Iteration": iteration_no,
+            "#Hall-of-Fame": len(perfect),
+            "#Plausible": len(plausible),
+            "#Valid": len(fame) + len(perfect),
             "#Overfitting": total_num_killed_patches,
-            "Hall-of-Fame": ' '.join([x.get_index_str() for x in perfect_i_patches]),
-            "Plausible\\Hall-of-Fame": ' '.join([x.get_index_str() for x in plausible_i_patches - perfect_i_patches]),
-            "Valid\\Plausible": ' '.join([x.get_index_str() for x in fame_i_patches - plausible_i_patches]),
+            "Hall-of-Fame": ' '.join([x.get_index_str() for x in perfect]),
+            "Plausible\\Hall-of-Fame": ' '.join([x.get_index_str() for x in plausible - perfect]),
+            "Valid\\Plausible": ' '.join([x.get_index_str() for x in fame - plausible]),
             "#Generated-Tests": len(generated_i_tests),
-            "#Generated-Killing-Tests": len(set(kill_matrix.keys()) & generated_i_tests)
+            "#Generated-Killing-Tests": sum(1 for i_test in generated_i_tests if i_test.id in kill_matrix)
         }
         iteration_stats.append(stat)
 
         for key, value in stat.items():
             emitter.normal(f"{key:>{width}}: {value}")
 
-        with open(stat_file, 'w', newline="") as f:
+        with open(stat_file, 'a', newline="") as f:
             writer = csv.DictWriter(f, fieldnames=field_names)
-            writer.writeheader()
-            writer.writerows(iteration_stats)
-
-        with open(Path(dir_kill_matrices, f"kill_matrix_{values.iteration_no}.json"), 'w') as f:
-            json.dump({i_test.get_index_str(): [x.get_index_str() for x in i_patches]
-                       for i_test, i_patches in kill_matrix.items()},
-                      f)
+            writer.writerow(stat)
+
+        new_kills = {}
+        for test_id, patches in kill_matrix.patches_of_test.items():
+            new_patches = patches & ~reported_kills.get(test_id, 0)
+            if new_patches:
+                new_kills[interning.tests.object_of(test_id).get_index_str()] = \
+                    [interning.patches.object_of(x).get_index_str() for x in ids_of(new_patches)]
+                reported_kills[test_id] = patches
+        with open(kill_matrix_file, 'a') as f:
+            f.write(json.dumps({"iteration": iteration_no, "kills": new_kills}, separators=(",", ":")))
+            f.write("\n")
 
     dir_perfect_patches = Path(values.dir_output, "perfect-patches")
+    dir_plausible_patches = Path(values.dir_output, "plausible-patches")
+    if resumed_state is not None:
+        # links are recreated from the checkpoint
+        shutil.rmtree(dir_perfect_patches, ignore_errors=True)
+        shutil.rmtree(dir_plausible_patches, ignore_errors=True)
+
     os.makedirs(dir_perfect_patches, exist_ok=True)
     utilities.check_is_empty_dir(dir_perfect_patches), str(dir_perfect_patches)
     save_path_for_i_patch = {}
 
-    dir_plausible_patches = Path(values.dir_output, "plausible-patches")
     os.makedirs(dir_plausible_patches, exist_ok=True)
     utilities.check_is_empty_dir(dir_plausible_patches), str(dir_plausible_patches)
 
     assert values.iteration_no == 0, f"values.iteration_no is {values.iteration_no}, expected 0"
 
+    def save_checkpoint(iteration_no, random_state):
+        """
+        Save the state as of the end of iteration `iteration_no`; patches of later generations are left out.
+
+        :param random_state: state of `random` at the end of the iteration; in pipelined mode, the next iteration
+                             has already drawn from it when the checkpoint is saved
+        """
+        def up_to_iteration(i_patches):
+            return set(x for x in i_patches if x.generation <= iteration_no)
+
+        checkpoint.save({
+            "iteration_no": iteration_no,
+            "perfect_i_patches": up_to_iteration(perfect_i_patches),
+            "fame_i_patches": up_to_iteration(fame_i_patches),
+            "plausible_i_patches": up_to_iteration(plausible_i_patches),
+            "save_path_for_i_patch": {x: path for x, path in save_path_for_i_patch.items()
+                                      if x.generation <= iteration_no},
+            "generated_i_tests": generated_i_tests,
+            "killing_i_tests": killing_i_tests,
+            "kill_matrix": kill_matrix,
+            "total_num_killed_patches": total_num_killed_patches,
+            "spectra": spectra,
+            "iteration_stats": iteration_stats,
+            "indexed_patch_to_bin_dir": validator.indexed_patch_to_bin_dir,
+            "indexed_suite_to_bin_dir": validator.indexed_suite_to_bin_dir,
+            "bin_dir_to_class_hashes": validator.bin_dir_to_class_hashes,
+            "time_intervals": timer.get_state(),
+            "random_state": random_state,
+            "elapsed": values.time_elapsed_before_resume + time.time() - values.time_system_start
+        })
+
     timer.pause_phase(phase)
     emitter.normal(f"\n\tUsed {timer.last_interval_duration(phase, unit='m'):.2f} minutes")
 
@@ -232,7 +433,8 @@ def run(arg_list):
     builder.config_project(values.dir_exp, values.cmd_pre_build)
 
     emitter.normal("compiling program")
-    builder.build_project(values.dir_exp, values.cmd_build)
+    builder.build_project(values.dir_exp, values.cmd_build, deadline=Deadline.of_run())
+    emitter.normal(f"base build fingerprint: {artifact_store.build_fingerprint()}")
 
     timer.pause_phase(phase)
     emitter.normal(f"\n\tUsed {timer.last_interval_duration(phase, unit='m'):.2f} minutes")
@@ -251,16 +453,33 @@ def run(arg_list):
     os.makedirs(dir_spectra_base, exist_ok=True)
     assert utilities.is_empty_dir(dir_spectra_base), str(dir_spectra_base)
 
+    def scan_user_tests(out_dir):
+        repair.arja_scan_and_filter_tests(
+            values.dir_info["source"], values.dir_info["classes"], values.dir_info["tests"], values.dir_info["deps"],
+            Path(out_dir, "passing_user_tests.txt"), Path(out_dir, "relevant_user_tests.txt"),
+            Path(out_dir, "spectra_user_tests.csv"), Path(out_dir, "test_scanning_log.txt"),
+            source_version=values.source_version, deadline=Deadline.of_run()
+        )
+        # the scan is cached and loaded again by later runs
+        spectra_store.convert_csv(Path(out_dir, "spectra_user_tests.csv"))
+
+    # the scan only depends on the program, tests, dependencies and the scanner itself; reuse it across runs
+    scan_key = artifact_store.digest_strings(
+        "user-test-scan",
+        artifact_store.digest_directory(values.dir_info["source"]),
+        artifact_store.digest_directory(dir_bin), artifact_store.digest_directory(dir_tests_bin),
+        artifact_store.digest_directory(dir_deps) if dir_deps else "",
+        *[artifact_store.digest_file(jar) for jar in repair.get_test_scanning_jars()],
+        values.source_version
+    )
+    if artifact_store.store.lookup("user_test_scans", scan_key) is not None:
+        emitter.normal(f"reusing cached scan of user tests {scan_key}")
+    dir_scan = artifact_store.store.obtain("user_test_scans", scan_key, scan_user_tests)
+
     dir_user_tests_spectra = Path(dir_spectra_base, "user")
-    os.makedirs(dir_user_tests_spectra)
+    shutil.copytree(dir_scan, dir_user_tests_spectra)
     spectra_file = Path(dir_user_tests_spectra, "spectra_user_tests.csv")
-    test_scanning_log = Path(dir_user_tests_spectra, "test_scanning_log.txt")
-    orig_tests_file = Path(dir_user_tests_spectra, "passing_user_tests.txt")
-    final_tests_file = Path(dir_user_tests_spectra, "relevant_user_tests.txt")
-    passing_user_tests, failing_user_tests = repair.arja_scan_and_filter_tests(
-        values.dir_info["source"], values.dir_info["classes"], values.dir_info["tests"], values.dir_info["deps"],
-        orig_tests_file, final_tests_file, spectra_file, test_scanning_log, source_version=values.source_version
-    )
+    passing_user_tests, failing_user_tests = repair.read_scanned_tests(spectra_file)
 
     spectra = Spectra()
     spectra.update(spectra_file)
@@ -301,6 +520,43 @@ def run(arg_list):
                             f" to {len(passing_user_i_tests)} because there are too few passing user tests")
         values.passing_tests_partitions = len(passing_user_i_tests)
 
+    if resumed_state is not None:
+        perfect_i_patches.update(resumed_state["perfect_i_patches"])
+        fame_i_patches.update(resumed_state["fame_i_patches"])
+        plausible_i_patches.update(resumed_state["plausible_i_patches"])
+        save_path_for_i_patch.update(resumed_state["save_path_for_i_patch"])
+        generated_i_tests.update(resumed_state["generated_i_tests"])
+        killing_i_tests.update(resumed_state["killing_i_tests"])
+        kill_matrix.update(resumed_state["kill_matrix"])
+        reported_kills.update(kill_matrix.patches_of_test)
+        total_num_killed_patches = resumed_state["total_num_killed_patches"]
+        spectra = resumed_state["spectra"]
+        iteration_stats.extend(resumed_state["iteration_stats"])
+        # drop what the interrupted run reported after the checkpoint
+        with open(stat_file, 'a', newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=field_names)
+            writer.writerows(iteration_stats)
+        if os.path.exists(kill_matrix_file):
+            with open(kill_matrix_file) as f:
+                kill_matrix_lines = [line for line in f
+                                     if json.loads(line)["iteration"] <= resumed_state["iteration_no"]]
+            with open(kill_matrix_file, 'w') as f:
+                f.writelines(kill_matrix_lines)
+        validator.indexed_patch_to_bin_dir.update(resumed_state["indexed_patch_to_bin_dir"])
+        validator.indexed_suite_to_bin_dir.update(resumed_state["indexed_suite_to_bin_dir"])
+        validator.bin_dir_to_class_hashes.update(resumed_state["bin_dir_to_class_hashes"])
+
+        for i_patch in perfect_i_patches:
+            save_path = save_path_for_i_patch[i_patch]
+            os.symlink(os.path.relpath(i_patch.patch.diff_file, save_path.parent), save_path)
+        for i_patch in plausible_i_patches:
+            save_path = Path(dir_plausible_patches, f"{i_patch.get_index_str()}.diff")
+            os.symlink(os.path.relpath(i_patch.patch.diff_file, save_path.parent), save_path)
+
+        timer.merge_state(resumed_state["time_intervals"])
+        random.setstate(resumed_state["random_state"])
+        values.iteration_no = resumed_state["iteration_no"] + 1
+
     if values.use_given_locations:
         perfect_locations = []
         for x in values.fix_locations:
@@ -319,11 +575,224 @@ def run(arg_list):
 
     emitter.information("\n\tStarting co-evolution")
 
+    # every phase plans its tool runs from the time left, and every tool is stopped when the run is out of time
+    run_deadline = Deadline.of_run()
+
+    def remove_from_perfect(i_patch, reason):
+        emitter.warning(f"removing patch {str(i_patch)} from perfect patches because {reason}")
+        perfect_i_patches.remove(i_patch)
+        assert i_patch in save_path_for_i_patch, i_patch.get_index_str()
+        os.remove(save_path_for_i_patch[i_patch])
+
+    def apply_kills(validation_result):
+        """
+        Move patches failing some test from perfect to fame patches, and record the kills.
+
+        :return: number of killed patches
+        """
+        num_killed_patches = 0
+        for i_patch, _, failing_i_tests in validation_result:
+            if failing_i_tests:
+                perfect_i_patches.remove(i_patch)
+                assert i_patch in save_path_for_i_patch, i_patch.get_index_str()
+                os.remove(save_path_for_i_patch[i_patch])
+
+                fame_i_patches.add(i_patch)
+
+                for i_test in failing_i_tests:
+                    kill_matrix.add(i_test.id, i_patch.id)
+                killing_i_tests.update(failing_i_tests)
+
+                num_killed_patches += 1
+        return num_killed_patches
+
+    def evaluate(ev):
+        """
+        Generate tests (or take the remaining user tests), validate `ev.validated_i_patches` with them, and retrieve
+        their spectra. Only fills in the results of `ev`; the state of the run is updated by `fold_evaluation`.
+        If the run is out of time, the results are left incomplete.
+        """
+        try:
+            evaluate_until(ev, run_deadline)
+        except DeadlineExceeded as e:
+            emitter.normal(f"stopped evaluation of iteration #{ev.iteration_no} due to global timeout: {str(e)}")
+            ev.timer.pause_if_running("Test Generation")
+            ev.timer.pause_if_running("Validation")
+            ev.validation_result = None
+
+    def evaluate_until(ev, deadline):
+        if ev.remaining_user_i_tests:
+            emitter.information(f"Skipping test generation because there are remaining user tests")
+            emitter.information(f"Will validate perfect patches with {len(ev.remaining_user_i_tests)} user tests")
+            indexed_tests = ev.remaining_user_i_tests
+        else:
+            if deadline.expired():
+                return
+
+            phase = "Test Generation"
+            ev.timer.start_phase(phase)
+
+            tests = tester.generate_additional_test(ev.target_i_patches, ev.dir_tests,
+                                                    target_patches_file=ev.target_patches_file,
+
+                                                    seed_i_tests=ev.seed_i_tests, seeds_file=ev.seed_tests_file,
+                                                    kill_matrix=ev.kill_matrix,
+
+                                                    junit_suffix=f"_gen{ev.iteration_no}_ESTest",
+                                                    timeout_per_class_in_seconds=values.test_gen_timeout,
+                                                    dry_run=ev.dry_run_test_gen,
+
+                                                    random_seed=ev.test_gen_random_seed,
+                                                    max_parallel=values.test_gen_jobs, deadline=deadline)
+            indexed_tests = [IndexedTest(ev.iteration_no, test) for test in tests]
+            ev.generated_i_tests = indexed_tests
+
+            ev.timer.pause_phase(phase)
+            emitter.normal(f"\n\t\tUsed {ev.timer.last_interval_duration(phase, unit='m'):.2f} minutes")
+
+        if deadline.expired():
+            return
+
+        phase = "Validation"
+        ev.timer.start_phase(phase)
+
+        validation_result, ev.non_compilable_i_patches, ev.noop_i_patches = validator.validate(
+            ev.validated_i_patches, indexed_tests, ev.dir_validation,
+            compile_patches=True, compile_tests=ev.compile_tests, execute_tests=True,
+            use_d4j_instr=True, deadline=deadline)
+
+        ev.non_compilable_i_tests = [it for it in indexed_tests
+                                     if it.indexed_suite not in validator.indexed_suite_to_bin_dir]
+        if ev.non_compilable_i_tests:
+            emitter.warning(f"discarding {len(ev.non_compilable_i_tests)} generated tests whose suites do not compile")
+            indexed_tests = [it for it in indexed_tests if it.indexed_suite in validator.indexed_suite_to_bin_dir]
+
+        if ev.redundant_killing_i_tests:
+            # new patches were generated without the killing tests dropped by minimization; check them here
+            new_i_patches = [x for x in ev.new_i_patches
+                             if x not in ev.non_compilable_i_patches and x not in ev.noop_i_patches]
+            dir_validation_dropped = Path(ev.dir_validation, "dropped-killing-tests")
+            os.makedirs(dir_validation_dropped)
+            emitter.normal(f"validating {len(new_i_patches)} new patch(es)"
+                           f" with {len(ev.redundant_killing_i_tests)} killing tests dropped by minimization")
+            extra_validation_result, _, _ = validator.validate(new_i_patches, ev.redundant_killing_i_tests,
+                                                               dir_validation_dropped,
+                                                               compile_patches=False, compile_tests=False,
+                                                               execute_tests=True, use_d4j_instr=True,
+                                                               deadline=deadline)
+            passing_i_tests_for = defaultdict(list)
+            failing_i_tests_for = defaultdict(list)
+            for i_patch, passing_i_tests, failing_i_tests in [*validation_result, *extra_validation_result]:
+                passing_i_tests_for[i_patch].extend(passing_i_tests)
+                failing_i_tests_for[i_patch].extend(failing_i_tests)
+            validation_result = [(i_patch, passing_i_tests, failing_i_tests_for[i_patch])
+                                 for i_patch, passing_i_tests in passing_i_tests_for.items()]
+
+        spectra_dir = Path(values.dir_output, "spectra", f"gen{ev.iteration_no}")
+        os.makedirs(spectra_dir, exist_ok=True)
+        test_names_path = Path(spectra_dir, "test_names.txt")
+        orig_pos_tests_file = Path(spectra_dir, "orgTests.txt")
+        spectra_file = Path(spectra_dir, "spectra.csv")
+        log_file = Path(spectra_dir, "log.txt")
+        assert not os.path.exists(test_names_path), str(test_names_path)
+        assert not os.path.exists(spectra_file), str(spectra_file)
+        assert not os.path.exists(log_file), str(log_file)
+
+        emitter.information("Retriving spectra of generated tests")
+
+        repair.arja_get_tests_spectra(
+            values.dir_info["source"], values.dir_info["classes"],
+            values.dir_info["tests"], values.dir_info["deps"],
+            indexed_tests, test_names_path, orig_pos_tests_file, spectra_file, log_file,
+            values.source_version, deadline=deadline)
+        ev.validation_result = validation_result
+        ev.spectra_file = spectra_file
+
+        ev.timer.pause_phase(phase)
+        emitter.normal(f"\n\tUsed {ev.timer.last_interval_duration(phase, unit='m'):.2f} minutes")
+
+    def fold_evaluation(ev):
+        """
+        Update the state of the run with the results of `ev`.
+
+        :return: whether the evaluation was complete, i.e., not cut short by the global timeout
+        """
+        nonlocal total_num_killed_patches
+
+        timer.merge(ev.timer)
+
+        for i_patch in ev.non_compilable_i_patches:
+            remove_from_perfect(i_patch, "compilation failed")
+        for i_patch in ev.noop_i_patches:
+            remove_from_perfect(i_patch, "it does not change bytecode")
+
+        generated_i_tests.update(ev.generated_i_tests)
+        generated_i_tests.difference_update(ev.non_compilable_i_tests)
+
+        if ev.validation_result is None:
+            return False
+
+        num_killed_patches = apply_kills(ev.validation_result)
+
+        if ev.num_partitions + 1 == values.passing_tests_partitions:
+            for i_patch in perfect_i_patches:
+                plausible_i_patches.add(i_patch)
+                save_path = Path(dir_plausible_patches, f"{i_patch.get_index_str()}.diff")
+                os.symlink(os.path.relpath(i_patch.patch.diff_file, save_path.parent), save_path)
+
+        if not ev.remaining_user_i_tests:
+            total_num_killed_patches += num_killed_patches
+
+        emitter.normal(f"{num_killed_patches} perfect patch(es) are killed")
+
+        spectra.update(ev.spectra_file)
+        return True
+
+    # In pipelined mode, the evaluation of an iteration that generates tests runs in the background, while the next
+    # iteration generates patches from the archive as it is. Its results are folded in when that patch generation
+    # is done, and the new patches are then checked against the tests that became killing in the meantime.
+    pending_evaluation = None
+
+    def wait_for_pending_evaluation():
+        nonlocal pending_evaluation
+        if pending_evaluation is None:
+            return True
+        ev = pending_evaluation.result()
+        pending_evaluation = None
+        emitter.normal(f"folding in results of iteration #{ev.iteration_no}")
+        complete = fold_evaluation(ev)
+        report(ev.iteration_no)
+        if complete:
+            save_checkpoint(ev.iteration_no, ev.random_state)
+        return complete
+
+    def start_evaluation(ev):
+        nonlocal pending_evaluation
+        pending_evaluation = Future()
+
+        def target(future):
+            try:
+                # the patch generation of the next iteration is on the critical path
+                with profiler.span(f"evaluation of iteration #{ev.iteration_no}", "evaluation",
+                                   parent=ev.profiler_span), executor.priority(executor.PRIORITY_BACKGROUND):
+                    evaluate(ev)
+                future.set_result(ev)
+            except BaseException as e:
+                future.set_exception(e)
+
+        # a daemon thread, so that a failure of the main thread does not wait for test generation to finish
+        threading.Thread(target=target, args=(pending_evaluation,), daemon=True).start()
+
+    iteration_span = None
     while True:
+        if iteration_span is not None:
+            profiler.end(iteration_span)
         if values.iteration_no > values.num_iterations > 0:
             break
 
         emitter.sub_title("Iteration #{}".format(values.iteration_no))
+        iteration_span = profiler.begin(f"iteration #{values.iteration_no}", "iteration",
+                                        iteration=values.iteration_no)
 
         num_partitions = values.iteration_no + 1
 
@@ -346,11 +815,9 @@ def run(arg_list):
         use_arja = values.use_arja
 
         dry_run_test_gen = values.dry_run_test_gen
-        test_gen_timeout_per_class_in_secs = values.test_gen_timeout
 
         compile_patches = True
         compile_tests = num_partitions >= values.passing_tests_partitions
-        execute_tests = True
 
         dir_patches_base = Path(values.dir_info["repair"], f"gen{values.iteration_no}")
         dir_patches = Path(dir_patches_base, "test-adequate")
@@ -394,6 +861,7 @@ def run(arg_list):
 
         basic_i_tests = failing_user_i_tests
         delta_passing_user_i_tests = []
+        redundant_killing_i_tests = []
         if num_partitions < values.passing_tests_partitions:
             num_passing_user_tests = len(passing_user_i_tests) * num_partitions // values.passing_tests_partitions
             next_num_passing_user_tests = (len(passing_user_i_tests)
@@ -407,19 +875,24 @@ def run(arg_list):
             emitter.normal(
                 f"Will use {num_passing_user_tests} of {len(passing_user_i_tests)} passing user test cases"
                 " for patch generation")
+        elif values.minimize_tests and killing_i_tests:
+            minimized_killing_i_tests = test_minimizer.minimize_killing_tests(killing_i_tests, kill_matrix, spectra)
+            redundant_killing_i_tests = list(killing_i_tests - set(minimized_killing_i_tests))
+            additional_i_tests = [*passing_user_i_tests, *minimized_killing_i_tests]
         else:
             additional_i_tests = [*passing_user_i_tests, *killing_i_tests]
 
         all_tests = set()
-        all_tests.update([i_test.get_full_test_name() for i_test in basic_i_tests])
-        all_tests.update([i_test.get_full_test_name() for i_test in additional_i_tests])
+        all_tests.update([i_test.id for i_test in basic_i_tests])
+        all_tests.update([i_test.id for i_test in additional_i_tests])
 
         if values.no_change_localization:
-            localization_ignored_tests = set([i_test.get_full_test_name() for i_test in generated_i_tests])
+            localization_ignored_tests = set([i_test.id for i_test in generated_i_tests])
         else:
             localization_ignored_tests = set()
 
-        if utilities.timed_out():
+        if run_deadline.expired():
+            wait_for_pending_evaluation()
             report()
             break
 
@@ -460,7 +933,11 @@ def run(arg_list):
 
             localization_ignored_tests=localization_ignored_tests,
 
-            perfect_locations=perfect_locations
+            perfect_locations=perfect_locations,
+
+            fl_top_k=values.fl_top_k,
+
+            deadline=run_deadline
         )
         indexed_patches = [IndexedPatch(values.iteration_no, patch) for patch in patches]
         indexed_fame_patches = [IndexedPatch(values.iteration_no, fame_patch) for fame_patch in fame_patches]
@@ -488,124 +965,112 @@ def run(arg_list):
         timer.pause_phase(phase)
         emitter.normal(f"\n\t\tUsed {timer.last_interval_duration(phase, unit='m'):.2f} minutes")
 
-        if delta_passing_user_i_tests:
-            emitter.information(f"Skipping test generation because there are remaining user tests")
-            emitter.information(f"Will validate perfect patches with {len(delta_passing_user_i_tests)} user tests")
-            indexed_tests = delta_passing_user_i_tests
-        else:
-            if utilities.timed_out():
+        if pending_evaluation is not None:
+            previous_killing_i_tests = set(killing_i_tests)
+            if not wait_for_pending_evaluation():
                 report()
                 break
 
-            phase = "Test Generation"
-            if num_partitions == values.passing_tests_partitions:
-                timer.start_phase(phase)
-            else:
-                timer.resume_phase(phase)
-
+            # the new patches were generated before these tests were known to kill patches
+            new_killing_i_tests = list(killing_i_tests - previous_killing_i_tests)
+            new_i_patches = [x for x in indexed_patches if x in perfect_i_patches]
+            if new_killing_i_tests and new_i_patches:
+                dir_validation_pipelined = Path(dir_validation, "pipelined-killing-tests")
+                os.makedirs(dir_validation_pipelined)
+                emitter.normal(f"validating {len(new_i_patches)} new patch(es)"
+                               f" with {len(new_killing_i_tests)} tests that killed patches of the previous iteration")
+
+                timer.start_or_resume_phase("Validation")
+                try:
+                    catch_up_result, non_compilable_i_patches, noop_i_patches = validator.validate(
+                        new_i_patches, new_killing_i_tests, dir_validation_pipelined,
+                        compile_patches=True, compile_tests=False, execute_tests=True, use_d4j_instr=True,
+                        deadline=run_deadline)
+                except DeadlineExceeded:
+                    timer.pause_phase("Validation")
+                    report()
+                    break
+                timer.pause_phase("Validation")
+
+                for i_patch in non_compilable_i_patches:
+                    remove_from_perfect(i_patch, "compilation failed")
+                for i_patch in noop_i_patches:
+                    remove_from_perfect(i_patch, "it does not change bytecode")
+                num_killed_patches = apply_kills(catch_up_result)
+                total_num_killed_patches += num_killed_patches
+                emitter.normal(f"{num_killed_patches} new perfect patch(es) are killed")
+
+        # patches that need no tests are dropped before tests are generated for them
+        timer.start_or_resume_phase("Validation")
+        try:
+            non_compilable_i_patches, noop_i_patches, equivalent_i_patch_groups = validator.screen_patches(
+                perfect_i_patches, Path(dir_validation, "screening"), deadline=run_deadline)
+        except DeadlineExceeded:
+            timer.pause_phase("Validation")
+            report()
+            break
+        timer.pause_phase("Validation")
+        for i_patch in non_compilable_i_patches:
+            remove_from_perfect(i_patch, "compilation failed")
+        for i_patch in noop_i_patches:
+            remove_from_perfect(i_patch, "it does not change bytecode")
+        # a test kills either all or none of the patches in a class of equivalent bytecode
+        representative_i_patches = set(group[0] for group in equivalent_i_patch_groups)
+
+        ev = Evaluation(values.iteration_no, num_partitions,
+                        target_i_patches=representative_i_patches, validated_i_patches=set(perfect_i_patches),
+                        new_i_patches=indexed_patches,
+                        remaining_user_i_tests=delta_passing_user_i_tests,
+                        redundant_killing_i_tests=redundant_killing_i_tests,
+                        dir_tests=dir_tests, target_patches_file=target_patches_file, seed_tests_file=seed_tests_file,
+                        dir_validation=dir_validation, compile_tests=compile_tests, dry_run_test_gen=dry_run_test_gen)
+        if not delta_passing_user_i_tests:
             EVOSUITE_DEFAULT_POPULATION = 50
-            seed_i_tests = set()
             num_perfect_test_seed = int(min(EVOSUITE_DEFAULT_POPULATION * 0.5, len(killing_i_tests)))
-            seed_i_tests.update(random.sample(tuple(killing_i_tests), k=num_perfect_test_seed))
+            ev.seed_i_tests.update(random.sample(tuple(killing_i_tests), k=num_perfect_test_seed))
 
             # fame_i_tests = generated_i_tests - killing_i_tests
             # num_fame_test_seed = int(min(EVOSUITE_DEFAULT_POPULATION * 0.25, len(fame_i_tests)))
             # seed_i_tests.update(random.sample(tuple(fame_i_tests), k=num_fame_test_seed))
 
-            tests = tester.generate_additional_test(perfect_i_patches, dir_tests,
-                                                    target_patches_file=target_patches_file,
-
-                                                    seed_i_tests=seed_i_tests, seeds_file=seed_tests_file,
-                                                    kill_matrix=kill_matrix,
-
-                                                    junit_suffix=f"_gen{values.iteration_no}_ESTest",
-                                                    timeout_per_class_in_seconds=test_gen_timeout_per_class_in_secs,
-                                                    dry_run=dry_run_test_gen,
-
-                                                    random_seed=random.randint(INT_MIN, INT_MAX))
-            indexed_tests = [IndexedTest(values.iteration_no, test) for test in tests]
-            generated_i_tests.update(indexed_tests)
+            ev.kill_matrix = kill_matrix.copy()
+            ev.test_gen_random_seed = random.randint(INT_MIN, INT_MAX)
+        # the iteration draws nothing more from `random`
+        ev.random_state = random.getstate()
 
-            timer.pause_phase(phase)
-            emitter.normal(f"\n\t\tUsed {timer.last_interval_duration(phase, unit='m'):.2f} minutes")
-
-        if utilities.timed_out():
-            report()
-            break
-
-        phase = "Validation"
-        if values.iteration_no == 0:
-            timer.start_phase(phase)
+        if values.pipelined and not delta_passing_user_i_tests:
+            emitter.normal(f"evaluating iteration #{values.iteration_no} in the background")
+            start_evaluation(ev)
         else:
-            timer.resume_phase(phase)
-
-        validation_result, non_compilable_i_patches = validator.validate(perfect_i_patches, indexed_tests,
-                                                                         dir_validation,
-                                                                         compile_patches=compile_patches,
-                                                                         compile_tests=compile_tests,
-                                                                         execute_tests=execute_tests,
-                                                                         use_d4j_instr=True)
-        for i_patch in non_compilable_i_patches:
-            emitter.warning(f"removing patch {str(i_patch)} from perfect patches because compilation failed")
-            perfect_i_patches.remove(i_patch)
-            assert i_patch in save_path_for_i_patch, i_patch.get_index_str()
-            os.remove(save_path_for_i_patch[i_patch])
-
-        num_killed_patches = 0
-        for i_patch, _, failing_i_tests in validation_result:
-            if failing_i_tests:
-                perfect_i_patches.remove(i_patch)
-                assert i_patch in save_path_for_i_patch, i_patch.get_index_str()
-                os.remove(save_path_for_i_patch[i_patch])
-
-                fame_i_patches.add(i_patch)
-
-                for i_test in failing_i_tests:
-                    if i_test not in kill_matrix:
-                        kill_matrix[i_test] = []
-                    kill_matrix[i_test].append(i_patch)
-                killing_i_tests.update(failing_i_tests)
-
-                num_killed_patches += 1
-
-        if num_partitions + 1 == values.passing_tests_partitions:
-            for i_patch in perfect_i_patches:
-                plausible_i_patches.add(i_patch)
-                save_path = Path(dir_plausible_patches, f"{i_patch.get_index_str()}.diff")
-                os.symlink(os.path.relpath(i_patch.patch.diff_file, save_path.parent), save_path)
-
-        if not delta_passing_user_i_tests:
-            total_num_killed_patches += num_killed_patches
-
-        emitter.normal(f"{num_killed_patches} perfect patch(es) are killed")
-
-        spectra_dir = Path(values.dir_output, "spectra", f"gen{values.iteration_no}")
-        os.makedirs(spectra_dir, exist_ok=True)
-        test_names_path = Path(spectra_dir, "test_names.txt")
-        orig_pos_tests_file = Path(spectra_dir, "orgTests.txt")
-        spectra_file = Path(spectra_dir, "spectra.csv")
-        log_file = Path(spectra_dir, "log.txt")
-        assert not os.path.exists(test_names_path), str(test_names_path)
-        assert not os.path.exists(spectra_file), str(spectra_file)
-        assert not os.path.exists(log_file), str(log_file)
+            with profiler.span(f"evaluation of iteration #{ev.iteration_no}", "evaluation"):
+                evaluate(ev)
+            if not fold_evaluation(ev):
+                report()
+                break
+            report()
+            save_checkpoint(values.iteration_no, ev.random_state)
 
-        emitter.information("Retriving spectra of generated tests")
+        if run_deadline.expired():
+            wait_for_pending_evaluation()
+            break
 
-        repair.arja_get_tests_spectra(
-            values.dir_info["source"], values.dir_info["classes"],
-            values.dir_info["tests"], values.dir_info["deps"],
-            indexed_tests, test_names_path, orig_pos_tests_file, spectra_file, log_file,
-            values.source_version)
-        spectra.update(spectra_file)
+        values.iteration_no = values.iteration_no + 1
 
-        timer.pause_phase(phase)
-        emitter.normal(f"\n\tUsed {timer.last_interval_duration(phase, unit='m'):.2f} minutes")
+    wait_for_pending_evaluation()
+    if iteration_span is not None:
+        profiler.end(iteration_span)
 
-        report()
-        if utilities.timed_out():
-            break
 
-        values.iteration_no = values.iteration_no + 1
+def write_profile():
+    """
+    Write the profile of this run next to statistics.csv, if the run got that far.
+    """
+    dir_statistics = Path(values.dir_output, "statistics") if values.dir_output else None
+    if dir_statistics is None or not dir_statistics.is_dir():
+        return
+    profiler.end_all()
+    profiler.write_json(Path(dir_statistics, "profile.json"))
+    profiler.write_chrome_trace(Path(dir_statistics, "profile.trace.json"))
 
 
 def parse_args():
@@ -655,6 +1120,37 @@ def parse_args():
     optional.add_argument('--test-gen-timeout', help='timeout of each test generation attempt in seconds',
                           type=int,
                           default=60)
+    optional.add_argument('--test-gen-jobs',
+                          help='maximum number of classes to generate tests for concurrently;'
+                               ' 0 means the number of available CPUs',
+                          type=int,
+                          default=0)
+    optional.add_argument('--max-cpus',
+                          help='CPUs shared by all external tools; 0 means the number of available CPUs',
+                          type=int,
+                          default=0)
+    optional.add_argument('--max-memory',
+                          help='memory in MiB shared by all external tools, which also bounds the JVM heaps of EvoSuite;'
+                               ' 0 means the available memory',
+                          type=int,
+                          default=0)
+    optional.add_argument('--test-minimization',
+                          help='give a minimal subset of the killing tests to patch generation, not all of them',
+                          action='store_true',
+                          default=False)
+    optional.add_argument('--resume',
+                          help='continue the run in --dir-output from its last checkpoint',
+                          action='store_true',
+                          default=False)
+    optional.add_argument('--pipelined',
+                          help='generate patches of the next iteration while tests of the current one are generated'
+                               ' and validated',
+                          action='store_true',
+                          default=False)
+    optional.add_argument('--fl-top-k',
+                          help='only give the K most suspicious locations to patch generation',
+                          type=int,
+                          default=None)
     optional.add_argument('--num-iterations', help='number of co-evolution iterations to run',
                           type=int,
                           default=0)
@@ -726,6 +1222,10 @@ def main():
     signal.signal(signal.SIGTERM, shutdown)
     try:
         run(parsed_args)
+    except DeadlineExceeded as e:
+        timer.pause_all()
+
+        emitter.information(f"Repair process stopped due to global timeout: {str(e)}")
     except Exception as e:
         timer.pause_all()
 
@@ -738,6 +1238,10 @@ def main():
 
         emitter.information("Repair process stopped by user")
     finally:
+        evosuite_worker.shutdown()
+        # stop the tools still running, e.g., after an error, a signal or in a pending evaluation
+        executor.kill_all()
+        write_profile()
         emitter.end(timer, is_error)
         logger.store_logs()
         if is_error:
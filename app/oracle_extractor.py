@@ -1,14 +1,13 @@
 import os
 import shlex
 import shutil
-import subprocess
 
-from app import values, emitter, utilities
+from app import values, emitter, utilities, executor
 from pathlib import Path
 from subprocess import DEVNULL, PIPE
 
 
-def extract_oracle_locations():
+def extract_oracle_locations(deadline=None):
     dir_oracle_parser = Path(values._dir_root, "extern", "oracle-parser")
     oracle_parser_jar = Path(dir_oracle_parser, "target", "oracle-parser-1.0-SNAPSHOT-jar-with-dependencies.jar")
     assert os.path.isfile(oracle_parser_jar), oracle_parser_jar
@@ -25,7 +24,8 @@ def extract_oracle_locations():
 
     emitter.command(oracle_parser_command)
 
-    process = subprocess.run(shlex.split(oracle_parser_command), stdout=DEVNULL, stderr=PIPE)
+    process = executor.run(shlex.split(oracle_parser_command), "oracle parser", deadline=deadline,
+                           stdout=DEVNULL, stderr=PIPE)
 
     if process.returncode != 0:
         utilities.error_exit("failed to extract oracle locations", process.stderr.decode("utf-8"),
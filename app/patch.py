@@ -1,6 +1,5 @@
-from app import values, emitter, utilities, builder
+from app import values, emitter, utilities, builder, artifact_store, interning, executor
 
-import subprocess
 from subprocess import DEVNULL, PIPE
 import shutil
 import os
@@ -9,10 +8,15 @@ import time
 from collections import namedtuple
 from unidiff import PatchSet
 import shlex
+import glob
+import json
+
+
+METADATA_FILENAME = "metadata.json"
 
 
 class Patch:
-    def __init__(self, diff_file, strip: int, changed_files, changed_classes, key, summary_file):
+    def __init__(self, diff_file, strip: int, changed_files, changed_classes, key, summary_file, fix_locations=None):
         self.diff_file = diff_file
         self.strip = strip
         self.changed_files = changed_files
@@ -20,11 +24,47 @@ class Patch:
         self.key = key
         self.summary_file = summary_file
         self.__summary = None
+        self.__diff_digest = None
+        self.__fix_locations = fix_locations
+
+    @classmethod
+    def load(cls, directory, strip, key):
+        """
+        Load a patch from an ARJA patch directory (see `repair.generate`).
+
+        Changed files and fix locations are computed once and persisted in `{directory}/metadata.json`,
+        so that reloading the patch needs no parsing of the diff.
+        """
+        diff_file = Path(directory, "diff")
+        summary_file = Path(directory, "summary")
+        metadata_file = Path(directory, METADATA_FILENAME)
+
+        if metadata_file.is_file():
+            with open(metadata_file) as f:
+                metadata = json.load(f)
+        else:
+            patched_dir = Path(directory, "patched")
+            changed_files = [str(Path(x).relative_to(patched_dir)) for x in
+                             glob.glob(os.path.join(patched_dir, "**", "*.java"), recursive=True)]
+            metadata = {
+                "changedFiles": sorted(changed_files),
+                "fixLocations": compute_fix_locations(diff_file)
+            }
+            tmp_file = Path(directory, f".{METADATA_FILENAME}.{os.getpid()}")
+            with open(tmp_file, 'w') as f:
+                json.dump(metadata, f)
+            os.replace(tmp_file, metadata_file)
+
+        changed_files = [Path(x) for x in metadata["changedFiles"]]
+        changed_classes = [".".join(file.with_suffix("").parts) for file in changed_files]
+        fix_locations = {classname: tuple(lines) for classname, lines in metadata["fixLocations"].items()}
+
+        return cls(diff_file, strip, changed_files, changed_classes, key, summary_file, fix_locations=fix_locations)
 
     def __repr__(self):
         return f"Patch@{self.key}[diff={self.diff_file}, strip={self.strip}, classes={self.changed_classes}]"
 
-    def compile(self, out_dir, changed_only=True):
+    def compile(self, out_dir, changed_only=True, deadline=None):
         assert os.path.isabs(out_dir), out_dir
         assert utilities.is_empty_dir(out_dir), out_dir
 
@@ -49,7 +89,8 @@ class Patch:
             assert abs_file.is_file(), f"{str(abs_file)} is not a file"
             dos2unix_command = f"dos2unix {str(abs_file)}"
             emitter.command(dos2unix_command)
-            cp = subprocess.run(shlex.split(dos2unix_command), stdout=DEVNULL, stderr=PIPE, shell=False)
+            cp = executor.run(shlex.split(dos2unix_command), "dos2unix", memory_mb=executor.SMALL_MEMORY_MB,
+                              deadline=deadline, stdout=DEVNULL, stderr=PIPE, shell=False)
             if cp.returncode != 0:
                 utilities.error_exit(f"Command `{dos2unix_command}` failed", cp.stderr.decode("utf-8"),
                                      f"exit code: {cp.returncode}")
@@ -60,15 +101,15 @@ class Patch:
         patch_command = f"{patch_executable} -p{self.strip} --binary < {self.diff_file}"
         emitter.normal("\tapplying patch file")
         emitter.command(patch_command)
-        patch_cp = subprocess.run(patch_command, shell=True, stdout=DEVNULL, stderr=PIPE,
-                                 cwd=patched_dir_src)
+        patch_cp = executor.run(patch_command, "patch", memory_mb=executor.SMALL_MEMORY_MB, deadline=deadline,
+                                shell=True, stdout=DEVNULL, stderr=PIPE, cwd=patched_dir_src)
         if patch_cp.returncode != 0:
             utilities.error_exit(f"executing `{patch_command}` in {patched_dir_src} failed",
                                  patch_cp.stderr.decode("utf-8"),
                                  f"exit code: {patch_cp.returncode}")
 
         emitter.normal("\tbuilding patched program")
-        builder.build_project(str(tmp_dir), values.cmd_build)
+        builder.build_project(str(tmp_dir), values.cmd_build, deadline=deadline)
 
         patched_dir_bin = Path(tmp_dir, os.path.relpath(values.dir_info["classes"], start=dir_project))
 
@@ -78,10 +119,15 @@ class Patch:
                 copy_src = Path(patched_dir_bin, x)
                 assert copy_src.is_file(), str(copy_src)
 
-                copy_dst = Path(out_dir, x)
-                os.makedirs(copy_dst.parent, exist_ok=True)
+                # nested and anonymous classes are compiled into separate class files
+                nested_class_files = [Path(y).relative_to(patched_dir_bin) for y in
+                                      glob.glob(os.path.join(patched_dir_bin, x.parent, f"{x.stem}$*.class"))]
 
-                shutil.copy2(copy_src, copy_dst)
+                for y in [x, *nested_class_files]:
+                    copy_dst = Path(out_dir, y)
+                    os.makedirs(copy_dst.parent, exist_ok=True)
+
+                    shutil.copy2(Path(patched_dir_bin, y), copy_dst)
         else:
             shutil.copytree(patched_dir_bin, out_dir, dirs_exist_ok=True)
 
@@ -90,47 +136,27 @@ class Patch:
     def get_fix_locations(self):
         """
 
-        :return: map from full class name to list of changed line numbers (int)
+        :return: map from full class name to changed line numbers (int)
 
         {
-            "foo.bar.Baz1": [2, 3],
-            "foo.bar.Baz2": [101, 500, 933]
+            "foo.bar.Baz1": (2, 3),
+            "foo.bar.Baz2": (101, 500, 933)
         }
         """
-        result = {}
-
-        with open(self.diff_file) as f:
-            diff = f.read()
-
-        patch_set = PatchSet.from_string(diff)
-        for patched_file in patch_set:
-            assert values.dir_info["source"] in Path(patched_file.source_file).parents
-            relative_path = Path(patched_file.source_file).relative_to(values.dir_info["source"])
-            classname = ".".join(relative_path.with_suffix("").parts)
-
-            changed_lines = []
-            for hunk in patched_file:
-                i = 0
-                num_lines = len(hunk)
-                last_line = None
-                while i < num_lines:
-                    line = hunk[i]
-                    if line.is_removed:
-                        assert not last_line.is_added
-                        if last_line.is_context:
-                            changed_lines.append(line.source_line_no)
-                    elif line.is_added:
-                        if last_line.is_context:
-                            changed_lines.append(last_line.source_line_no + 1)
-                    elif line.is_context:
-                        pass
-                    else:
-                        assert not line.value.strip(), line
-                    last_line = line
-                    i += 1
-
-            result[classname] = changed_lines
-        return result
+        if self.__fix_locations is None:
+            self.__fix_locations = {classname: tuple(lines)
+                                    for classname, lines in compute_fix_locations(self.diff_file).items()}
+        return self.__fix_locations
+
+    def get_diff_digest(self):
+        """
+        :return: digest of the normalized diff; textually equivalent patches have the same digest
+        """
+        if self.__diff_digest is None:
+            with open(self.diff_file) as f:
+                self.__diff_digest = artifact_store.digest_strings(artifact_store.normalize_diff(f.read()),
+                                                                   self.strip)
+        return self.__diff_digest
 
     def read_summary_file(self):
         if self.__summary is None:
@@ -139,27 +165,80 @@ class Patch:
         return self.__summary
 
 
+def compute_fix_locations(diff_file):
+    """
+
+    :return: map from full class name to list of changed line numbers (int), parsed from a unified diff file
+    """
+    result = {}
+
+    with open(diff_file) as f:
+        diff = f.read()
+
+    patch_set = PatchSet.from_string(diff)
+    for patched_file in patch_set:
+        assert values.dir_info["source"] in Path(patched_file.source_file).parents
+        relative_path = Path(patched_file.source_file).relative_to(values.dir_info["source"])
+        classname = ".".join(relative_path.with_suffix("").parts)
+
+        changed_lines = []
+        for hunk in patched_file:
+            i = 0
+            num_lines = len(hunk)
+            last_line = None
+            while i < num_lines:
+                line = hunk[i]
+                if line.is_removed:
+                    assert not last_line.is_added
+                    if last_line.is_context:
+                        changed_lines.append(line.source_line_no)
+                elif line.is_added:
+                    if last_line.is_context:
+                        changed_lines.append(last_line.source_line_no + 1)
+                elif line.is_context:
+                    pass
+                else:
+                    assert not line.value.strip(), line
+                last_line = line
+                i += 1
+
+        result[classname] = changed_lines
+    return result
+
+
 PatchIndex = namedtuple("PatchIndex", ["generation", "key"])
 
 
 class IndexedPatch:
+    __slots__ = ("generation", "patch", "id", "_index", "_hash", "_index_str")
+
     def __init__(self, generation, patch):
         self.generation = generation
         self.patch = patch
+        self._index = interning.intern_index(PatchIndex(generation, patch.key))
+        self._hash = hash(self._index)
+        self._index_str = interning.intern_str(f"{patch.key}@gen{generation}")
+        self.id = interning.patches.id_of(self._index)
+        interning.patches.register(self.id, self)
+
+    def __reduce__(self):
+        return IndexedPatch, (self.generation, self.patch)
 
     def __hash__(self):
-        return hash((self.generation, self.patch.key))
+        return self._hash
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if not isinstance(other, IndexedPatch):
             return False
-        return self.generation == other.generation and self.patch.key == other.patch.key
+        return self._index == other._index
 
     def __str__(self):
         return f"{str(self.patch)}@gen{self.generation}"
 
     def get_index(self):
-        return PatchIndex(self.generation, self.patch.key)
+        return self._index
 
     def get_index_str(self):
-        return f"{self.patch.key}@gen{self.generation}"
+        return self._index_str
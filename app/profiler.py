@@ -0,0 +1,293 @@
+import json
+import os
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+"""
+Hierarchical profile of a run: iteration > phase > tool invocation > patch or class.
+
+A span is opened under the innermost open span of the calling thread, or under an explicitly given parent (for work
+handed to other threads). External processes started with `popen` (usually through `executor`) get a span of their
+own that lasts until they are reaped with `wait4`, and their CPU time and peak RSS are charged to that span and all
+enclosing spans.
+
+The profile is written as a tree in JSON (`write_json`) and in the Chrome trace event format (`write_chrome_trace`),
+which can be opened in chrome://tracing or https://ui.perfetto.dev.
+"""
+
+# return code of a process whose exit status is lost because it was reaped by someone else
+UNKNOWN_RETURNCODE = 255
+
+
+class Span:
+    def __init__(self, name, category, parent, args):
+        self.name = name
+        self.category = category
+        self.parent = parent
+        self.args = args
+        self.thread_id = threading.get_ident()
+        self.start = time.time()
+        self.end = None
+        self.children = []
+        self.num_processes = 0  # processes reaped within this span
+        self.child_user_time = 0.0  # seconds
+        self.child_system_time = 0.0  # seconds
+        self.child_max_rss = 0  # KiB
+        self._stack = None
+
+    def get_duration(self):
+        return (self.end if self.end is not None else time.time()) - self.start
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "category": self.category,
+            "args": self.args,
+            "start": self.start,
+            "duration": self.get_duration(),
+            "processes": self.num_processes,
+            "child_user_time": self.child_user_time,
+            "child_system_time": self.child_system_time,
+            "child_max_rss_kb": self.child_max_rss,
+            "children": [child.to_dict() for child in self.children]
+        }
+
+
+_lock = threading.Lock()
+_local = threading.local()
+_roots = []
+_span_for_pid = {}
+
+
+def _get_stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def current():
+    """
+    :return: the innermost open span of this thread, or None
+    """
+    stack = _get_stack()
+    return stack[-1] if stack else None
+
+
+def begin(name, category, parent=None, **args):
+    """
+    Open a span; it must be closed with `end` by the same thread.
+
+    :param parent: enclosing span; defaults to `current()`
+    """
+    if parent is None:
+        parent = current()
+    span = Span(name, category, parent, args)
+    with _lock:
+        (parent.children if parent is not None else _roots).append(span)
+    span._stack = _get_stack()
+    span._stack.append(span)
+    return span
+
+
+def end(span):
+    if span.end is not None:
+        return
+    span.end = time.time()
+    if span in span._stack:
+        span._stack.remove(span)
+
+
+@contextmanager
+def span(name, category, parent=None, **args):
+    opened = begin(name, category, parent, **args)
+    try:
+        yield opened
+    finally:
+        end(opened)
+
+
+def end_all():
+    """
+    Close all open spans, e.g., when the run is aborted.
+    """
+    def close(spans):
+        for x in spans:
+            if x.end is None:
+                end(x)
+            close(x.children)
+
+    with _lock:
+        roots = list(_roots)
+    close(roots)
+
+
+def _charge(span, rusage):
+    with _lock:
+        while span is not None:
+            span.num_processes += 1
+            span.child_user_time += rusage.ru_utime
+            span.child_system_time += rusage.ru_stime
+            span.child_max_rss = max(span.child_max_rss, rusage.ru_maxrss)
+            span = span.parent
+
+
+def popen(args, name, parent=None, **kwargs):
+    """
+    Start a process like `subprocess.Popen`, with a span named `name` that lasts until the process is reaped by
+    `wait`, `poll` or `communicate` of this module. Do not reap it with the methods of the `Popen` object.
+    """
+    process_span = Span(name, "tool", parent if parent is not None else current(), {})
+    process = subprocess.Popen(args, **kwargs)
+    process_span.args["pid"] = process.pid
+    with _lock:
+        parent = process_span.parent
+        (parent.children if parent is not None else _roots).append(process_span)
+        _span_for_pid[process.pid] = process_span
+    return process
+
+
+def _reaped(process, status, rusage):
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    process_span = _end_process_span(process)
+    if process_span is not None:
+        _charge(process_span, rusage)
+
+
+def _lost(process):
+    """
+    The process was reaped by someone else (ECHILD), so its exit status and resource usage are lost. Unlike `Popen`,
+    which reports 0 then, report the process as failed.
+    """
+    process.returncode = UNKNOWN_RETURNCODE
+    _end_process_span(process)
+
+
+def _end_process_span(process):
+    with _lock:
+        process_span = _span_for_pid.pop(process.pid, None)
+    if process_span is not None:
+        process_span.end = time.time()
+        process_span.args["returncode"] = process.returncode
+    return process_span
+
+
+def poll(process):
+    """
+    Like `Popen.poll`, but reap the process with `wait4`.
+    """
+    if process.returncode is not None:
+        return process.returncode
+    try:
+        pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+    except ChildProcessError:
+        _lost(process)
+        return process.returncode
+    if pid:
+        _reaped(process, status, rusage)
+    return process.returncode
+
+
+def wait(process, timeout=None):
+    """
+    Like `Popen.wait`, but reap the process with `wait4`.
+    """
+    if process.returncode is not None:
+        return process.returncode
+    if timeout is None:
+        try:
+            _, status, rusage = os.wait4(process.pid, 0)
+        except ChildProcessError:
+            _lost(process)
+            return process.returncode
+        _reaped(process, status, rusage)
+        return process.returncode
+
+    time_to_stop = time.time() + timeout
+    delay = 0.001
+    while poll(process) is None:
+        remaining = time_to_stop - time.time()
+        if remaining <= 0:
+            raise subprocess.TimeoutExpired(process.args, timeout)
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.05)
+    return process.returncode
+
+
+class _PipeReader(threading.Thread):
+    def __init__(self, pipe):
+        super().__init__(daemon=True)
+        self.pipe = pipe
+        self.data = None
+
+    def run(self):
+        with self.pipe:
+            self.data = self.pipe.read()
+
+
+def communicate(process, timeout=None):
+    """
+    Like `Popen.communicate` without input, but reap the process with `wait4`.
+    Can be called again after `subprocess.TimeoutExpired`, e.g., after killing the process.
+    """
+    readers = getattr(process, "_profiler_readers", None)
+    if readers is None:
+        readers = [_PipeReader(pipe) if pipe is not None else None for pipe in (process.stdout, process.stderr)]
+        for reader in readers:
+            if reader is not None:
+                reader.start()
+        process._profiler_readers = readers
+
+    wait(process, timeout)
+
+    result = []
+    for reader in readers:
+        if reader is None:
+            result.append(None)
+        else:
+            reader.join()
+            result.append(reader.data)
+    return tuple(result)
+
+
+def write_json(path):
+    with _lock:
+        roots = list(_roots)
+    with open(path, 'w') as f:
+        json.dump({"spans": [x.to_dict() for x in roots]}, f, indent=1)
+
+
+def write_chrome_trace(path):
+    """
+    Write complete ("X") events; resource usage is in the arguments of each event.
+    """
+    events = []
+    pid = os.getpid()
+
+    def add(spans):
+        for x in spans:
+            args = dict(x.args)
+            if x.num_processes or x.child_user_time or x.child_system_time:
+                args.update({"child_user_time": x.child_user_time, "child_system_time": x.child_system_time,
+                             "child_max_rss_kb": x.child_max_rss})
+            events.append({
+                "name": x.name,
+                "cat": x.category,
+                "ph": "X",
+                "ts": int(x.start * 1e6),
+                "dur": int(x.get_duration() * 1e6),
+                "pid": pid,
+                "tid": x.thread_id,
+                "args": {key: str(value) if not isinstance(value, (int, float)) else value
+                         for key, value in args.items()}
+            })
+            add(x.children)
+
+    with _lock:
+        add(list(_roots))
+    with open(path, 'w') as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
@@ -21,6 +21,23 @@ def read_pickle(file_path):
     return pickle_object
 
 
+def read_kill_matrix(file_path, iteration_no=None):
+    """
+    Rebuild the kill matrix from the per-iteration deltas in `statistics/kill_matrix.jsonl`.
+    :param iteration_no: last iteration to include; None for all
+    :return: map from test index string to list of index strings of the patches killed by the test
+    """
+    kill_matrix = dict()
+    with open(file_path, 'r') as in_file:
+        for line in in_file:
+            delta = json.loads(line)
+            if iteration_no is not None and delta["iteration"] > iteration_no:
+                break
+            for test, patches in delta["kills"].items():
+                kill_matrix.setdefault(test, []).extend(patches)
+    return kill_matrix
+
+
 def read_ast_tree(json_file):
     with io.open(json_file, 'r', encoding='utf8', errors="ignore") as f:
         ast_json = json.loads(f.read())
@@ -2,7 +2,8 @@ import itertools
 import shlex
 import time
 
-from app import emitter, utilities, values
+from app import emitter, utilities, values, interning, executor, profiler, spectra_store
+from app.deadline import Deadline
 from app.patch import Patch
 from app.validator import indexed_suite_to_bin_dir
 
@@ -11,11 +12,11 @@ from pathlib import Path
 import glob
 import shutil
 import re
-import subprocess
 from subprocess import PIPE, DEVNULL
 import math
 import socket
 import asyncio
+import functools
 import json
 import random
 from app.test_suite import USER_TEST_GENERATION
@@ -55,7 +56,9 @@ def generate(dir_src, dir_bin, dir_test_bin, dir_deps, dir_patches,
              dir_tmp=None,
              log_file=None,
              localization_ignored_tests=None,
-             perfect_locations=None
+             perfect_locations=None,
+             fl_top_k=None,
+             deadline=None
              ):
     for x in dir_src, dir_bin, dir_test_bin:
         assert os.path.isabs(x), x
@@ -240,15 +243,19 @@ def generate(dir_src, dir_bin, dir_test_bin, dir_deps, dir_patches,
 
     if dir_gzoltar_data is not None:
         if not dry_run:
-            with open(Path(dir_gzoltar_data, "tests"), 'w') as f:
-                f.write(spectra.dump_tests_str())
-            with open(Path(dir_gzoltar_data, "spectra"), 'w') as f:
-                f.write(spectra.dump_susp_values_str(ignored_tests=localization_ignored_tests, perfect_locations=perfect_locations))
+            spectra.write_tests(Path(dir_gzoltar_data, "tests"))
+            spectra.write_susp_values(Path(dir_gzoltar_data, "spectra"), ignored_tests=localization_ignored_tests,
+                                      perfect_locations=perfect_locations, top_k=fl_top_k)
 
         repair_command += f' -DgzoltarDataDir {str(dir_gzoltar_data)}'
 
+    if deadline is None:
+        deadline = Deadline.of_run()
+    # do not plan for more time than is left
+    timeout_in_seconds = deadline.budget(timeout_in_seconds)
+
     # -DmaxTime is in minutes; set maxTime to be double timeout_in_seconds to be safe
-    max_time = math.ceil(timeout_in_seconds / 60 * 2)
+    max_time = max(math.ceil(timeout_in_seconds / 60 * 2), 1) if timeout_in_seconds else 0
     # maxTime in millisecond is an int in Arja
     assert max_time * 60 * 1000 <= 0x7fffffff
     repair_command += f' -DmaxTime {max_time}'
@@ -302,24 +309,19 @@ def generate(dir_src, dir_bin, dir_test_bin, dir_deps, dir_patches,
                 repair_log_fp = open(log_file, 'w')
             else:
                 repair_log_fp = None
-            popen = subprocess.Popen(shlex.split(repair_command), stdout=repair_log_fp, stderr=PIPE,
-                                     cwd=values.dir_info["project"], env=ARJA_ENV)
+            popen = executor.popen(shlex.split(repair_command), "ARJA", deadline=deadline, stdout=repair_log_fp,
+                                   stderr=PIPE, cwd=values.dir_info["project"], env=ARJA_ENV)
 
             def terminate_repair(timeout):
-                popen.terminate()
-                try:
-                    popen.communicate(timeout=timeout)
-                except subprocess.TimeoutExpired:
-                    utilities.error_exit(
-                        f"repair did not terminate within {timeout} seconds after SIGTERM (pid = {popen.pid});"
-                        f" repair aborted")
+                # also stops the JVMs that ARJA started for test execution
+                executor.terminate(popen, timeout)
 
             termination_timeout = 10
 
             time_to_stop = time.time() + timeout_in_seconds
             in_extension = False
             while True:
-                return_code = popen.poll()
+                return_code = executor.poll(popen)
 
                 # Arja writes the Patch_{n}.txt files lastly. If these are ready, then other patch files must have also
                 # been written. So only check these.
@@ -337,7 +339,7 @@ def generate(dir_src, dir_bin, dir_test_bin, dir_deps, dir_patches,
                     utilities.error_exit("repair did not exit normally",
                                         popen.stderr.read().decode("utf-8"), f"return code: {return_code}")
                 else:
-                    if utilities.timed_out():
+                    if deadline.expired():
                         msg = (f"\tstopping repair due to global timeout... {patch_count_msg}")
                         emitter.normal(msg)
 
@@ -397,20 +399,9 @@ def generate(dir_src, dir_bin, dir_test_bin, dir_deps, dir_patches,
             directory = Path(entry.path).with_suffix("")
             assert utilities.is_nonempty_dir(directory), str(directory)
 
-            diff_file = Path(directory, "diff")
-
-            patched_dir = Path(directory, "patched")
-
-            changed_files = [Path(x).relative_to(patched_dir) for x in
-                             glob.glob(os.path.join(patched_dir, "**", "*.java"), recursive=True)]
-
-            changed_classes = [".".join(file.with_suffix("").parts) for file in changed_files]
-
             key = directory.name.split("_")[1]
 
-            summary_file = Path(directory, "summary")
-
-            patches.append(Patch(diff_file, strip, changed_files, changed_classes, key, summary_file))
+            patches.append(Patch.load(directory, strip, key))
 
             if has_failed_tests:
                 failed_tests_file = Path(directory, "failed_tests")
@@ -424,15 +415,13 @@ def generate(dir_src, dir_bin, dir_test_bin, dir_deps, dir_patches,
     if expecting_fames:
         hall_of_fame_patches, failed_test_names = read_arja_output_root(dir_fames, has_failed_tests=True)
 
-        i_test_for_test_name = {}
-        for i_test in basic_i_tests:
-            i_test_for_test_name[i_test.get_full_test_name()] = i_test
-        for i_test in additional_i_tests:
-            i_test_for_test_name[i_test.get_full_test_name()] = i_test
-
         failed_i_tests = []
         for names in failed_test_names:
-            failed_i_tests.append(set([i_test_for_test_name[name] for name in names]))
+            i_tests, unknown_names = interning.tests.objects_of_keys(names)
+            if unknown_names:
+                emitter.warning(f"ignoring {len(unknown_names)} unknown failed tests reported by ARJA,"
+                                f" e.g. {unknown_names[0]}")
+            failed_i_tests.append(set(i_tests))
     else:
         hall_of_fame_patches = []
         failed_i_tests = []
@@ -440,7 +429,7 @@ def generate(dir_src, dir_bin, dir_test_bin, dir_deps, dir_patches,
     return patches, hall_of_fame_patches, failed_i_tests
 
 
-async def scan_for_tests(dir_bin, dir_test_bin, dir_deps, class_names_file):
+async def scan_for_tests(dir_bin, dir_test_bin, dir_deps, class_names_file, deadline=None):
     """
     returned dict looks like:
     {"foo.bar.Baz1": ["method01", "method02"], "foo.bar.Baz2": ["method02", "method03"]}
@@ -490,11 +479,14 @@ async def scan_for_tests(dir_bin, dir_test_bin, dir_deps, class_names_file):
 
         emitter.command(command)
 
-        process = await asyncio.create_subprocess_shell(command, stdout=DEVNULL, stderr=PIPE)
-        return_code = await process.wait()
+        # the server keeps running on the event loop while the scanner is waited for in another thread
+        process = await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(executor.run, shlex.split(command), "TestSuitesScanner",
+                                    priority=executor.current_priority(), deadline=deadline,
+                                    parent=profiler.current(), stdout=DEVNULL, stderr=PIPE))
+        return_code = process.returncode
         if return_code != 0:
-            stderr = await process.stderr.read()
-            utilities.error_exit("TestSuitesScanner did not exit normally", stderr.decode("utf-8"),
+            utilities.error_exit("TestSuitesScanner did not exit normally", process.stderr.decode("utf-8"),
                                  f"exit code is {return_code}")
 
     test_result = json.loads(result[0])
@@ -502,8 +494,19 @@ async def scan_for_tests(dir_bin, dir_test_bin, dir_deps, class_names_file):
     return test_result["passingTests"], test_result["failingTests"]
 
 
+def get_test_scanning_jars():
+    """
+    :return: the jars on the classpath of test scanning (see `arja_scan_and_filter_tests`)
+    """
+    dir_arja = Path(values._dir_root, "extern", "arja").resolve()
+    dir_evosuite = Path(values._dir_root, "extern", "evosuite").resolve()
+    return [Path(dir_arja, "target", "Arja-0.0.1-SNAPSHOT-jar-with-dependencies.jar"),
+            Path(dir_evosuite, "client", "target", "evosuite-client-1.2.0.jar"),
+            Path(dir_evosuite, "standalone_runtime", "target", "evosuite-standalone-runtime-1.2.0.jar")]
+
+
 def arja_scan_and_filter_tests(dir_src, dir_bin, dir_test_bin, dir_deps, orig_pos_tests_file, final_tests_file,
-                               spectra_file, log_file, source_version=None):
+                               spectra_file, log_file, source_version=None, deadline=None):
     for x in dir_src, dir_bin, dir_test_bin:
         assert os.path.isabs(x), x
         assert utilities.is_nonempty_dir(x), x
@@ -521,18 +524,9 @@ def arja_scan_and_filter_tests(dir_src, dir_bin, dir_test_bin, dir_deps, orig_po
     dir_arja = Path(values._dir_root, "extern", "arja").resolve()
     assert os.path.isdir(dir_arja), dir_arja
 
-    arja_jar = Path(dir_arja, "target", "Arja-0.0.1-SNAPSHOT-jar-with-dependencies.jar").resolve()
-    assert os.path.isfile(arja_jar), arja_jar
-
-    dir_evosuite = Path(values._dir_root, "extern", "evosuite").resolve()
-    assert os.path.isdir(dir_evosuite), dir_evosuite
-
-    evosuite_client_jar = Path(dir_evosuite, "client", "target", "evosuite-client-1.2.0.jar")
-    assert os.path.isfile(evosuite_client_jar), evosuite_client_jar
-
-    evosuite_standalone_rt_jar = Path(dir_evosuite, "standalone_runtime", "target",
-                                      "evosuite-standalone-runtime-1.2.0.jar")
-    assert os.path.isfile(evosuite_standalone_rt_jar), evosuite_standalone_rt_jar
+    arja_jar, evosuite_client_jar, evosuite_standalone_rt_jar = get_test_scanning_jars()
+    for x in arja_jar, evosuite_client_jar, evosuite_standalone_rt_jar:
+        assert os.path.isfile(x), x
 
     dummy_dir_patches = values.dir_output
 
@@ -559,8 +553,8 @@ def arja_scan_and_filter_tests(dir_src, dir_bin, dir_test_bin, dir_deps, orig_po
 
     emitter.command(repair_command)
     with open(log_file, 'w') as f:
-        process = subprocess.run(shlex.split(repair_command), stdout=f, stderr=PIPE, cwd=values.dir_info["project"],
-                                 env=ARJA_ENV)
+        process = executor.run(shlex.split(repair_command), "ARJA test scanning", deadline=deadline, stdout=f,
+                               stderr=PIPE, cwd=values.dir_info["project"], env=ARJA_ENV)
     if process.returncode != 0:
         utilities.error_exit("test scanning did not exit normally",
                              process.stderr.decode("utf-8"), f"return code: {process.returncode}")
@@ -568,8 +562,21 @@ def arja_scan_and_filter_tests(dir_src, dir_bin, dir_test_bin, dir_deps, orig_po
         utilities.error_exit(f"test scanning exited normally without generating expected file {str(spectra_file)}",
                                 f" see logs in {str(log_file)}")
 
+    return read_scanned_tests(spectra_file)
+
+
+def read_scanned_tests(spectra_file):
+    """
+    :return: names of passing tests and names of failing tests in the spectra written by test scanning
+    """
     passing_tests = set()
     failing_tests = set()
+    binary_file = spectra_store.get_up_to_date_binary(spectra_file)
+    if binary_file is not None:
+        with spectra_store.SpectraFile(binary_file) as spectra:
+            for test, result, _, _ in spectra.tests:
+                (passing_tests if result == "PASS" else failing_tests).add(test)
+        return passing_tests, failing_tests
     with open(spectra_file) as f:
         for line in f:
             test, result = line.strip().split(",")[:2]
@@ -583,7 +590,7 @@ def arja_scan_and_filter_tests(dir_src, dir_bin, dir_test_bin, dir_deps, orig_po
 
 
 def arja_get_tests_spectra(dir_src, dir_bin, dir_test_bin, dir_deps, i_tests, test_names_path, orig_pos_tests_file,
-                           spectra_file, log_file, source_version=None):
+                           spectra_file, log_file, source_version=None, deadline=None):
     for x in dir_src, dir_bin, dir_test_bin:
         assert os.path.isabs(x), x
         assert utilities.is_nonempty_dir(x), x
@@ -663,8 +670,8 @@ def arja_get_tests_spectra(dir_src, dir_bin, dir_test_bin, dir_deps, i_tests, te
     try:
         with open(log_file, 'w') as f:
             emitter.command(repair_command)
-            process = subprocess.run(shlex.split(repair_command), stdout=f, stderr=PIPE, cwd=values.dir_info["project"],
-                                     env=ARJA_ENV)
+            process = executor.run(shlex.split(repair_command), "ARJA spectra retrieval", deadline=deadline,
+                                   stdout=f, stderr=PIPE, cwd=values.dir_info["project"], env=ARJA_ENV)
         if process.returncode != 0:
             utilities.error_exit("spectra retrieval did not exit normally",
                                     process.stderr.decode("utf-8"), f"return code: {process.returncode}")
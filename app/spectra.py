@@ -1,6 +1,10 @@
-from collections import namedtuple, defaultdict
+from abc import ABC, abstractmethod
+from collections import namedtuple, Counter
+import heapq
 import math
 
+from app import interning, spectra_store
+
 
 Location = namedtuple("Location", ["class_name", "line_number"])
 
@@ -27,94 +31,341 @@ class FLAlgorithm:
                     math.sqrt((count.ex_fail + count.not_ex_fail) * ex_total))
 
 
-class Spectra:
-    def __init__(self) -> None:
-        self.test_results = {}
-        self.tests_for_location = defaultdict(set)
-        self.locations_for_test = defaultdict(set)
+if hasattr(int, "bit_count"):
+    def popcount(bits):
+        return bits.bit_count()
+else:
+    def popcount(bits):
+        return bin(bits).count("1")
 
-    def update(self, spectra_file):
-        with open(spectra_file) as f:
-            for line in f:
-                tmp = line.strip().split(",")
-                test, result = tmp[0], tmp[1]
-                assert result in ("PASS", "FAIL")
-                locations = []
-                for x in tmp[2:]:
-                    class_name, line_number = x.split(":")
-                    line_number = int(line_number)
-                    locations.append(Location(class_name, line_number))
 
-                if test in self.test_results:
-                    assert self.test_results[test] == result, test
-                self.test_results[test] = result
+def bitset(ids):
+    ids = list(ids)
+    if not ids:
+        return 0
+    data = bytearray(max(ids) // 8 + 1)
+    for id_ in ids:
+        data[id_ >> 3] |= 1 << (id_ & 7)
+    return int.from_bytes(data, "little")
+
 
-                for location in locations:
-                    self.tests_for_location[location].add(test)
+class _SpectraBase(ABC):
+    """
+    Queries and dumps shared by `Spectra` and `SpectraView`. Subclasses provide their tests and the
+    fault-localization counts; coverage is always looked up in the underlying `Spectra`.
+    """
+
+    @abstractmethod
+    def _get_spectra(self):
+        """
+        :return: the `Spectra` that stores the coverage of the tests
+        """
+        pass
+
+    @abstractmethod
+    def _iter_test_ids(self):
+        pass
+
+    @abstractmethod
+    def _contains(self, test_id):
+        pass
 
-                self.locations_for_test[test].update(locations)
-    
-    def restrict(self, tests):
-        result = Spectra()
-        result.test_results = { test: self.test_results[test] for test in tests }
-        result.tests_for_location = { loc: (self.tests_for_location[loc] & tests) for loc in self.tests_for_location }
-        result.locations_for_test = { test: self.locations_for_test[test] for test in tests }
-        return result
+    @abstractmethod
+    def _get_counts(self):
+        """
+        :return: ex_pass, ex_fail, num_passing, num_failing; see `Spectra`. The dicts must not be modified.
+        """
+        pass
 
-    def dump_tests_str(self):
-        tmp = ["name", ",", "outcome"]
+    def get_locations(self, test_id):
+        if not self._contains(test_id):
+            return frozenset()
+        return self._get_spectra().get_locations(test_id)
 
-        for test, result in sorted(self.test_results.items()):
-            tmp.append("\n")
-            tmp.append(test)
-            tmp.append(",")
-            tmp.append(result)
-            tmp.extend([f",{loc.class_name}:{loc.line_number}"
-                        for loc in self.locations_for_test[test]])
+    def get_failing_locations(self):
+        ex_fail = self._get_counts()[1]
+        return set(loc for loc, count in ex_fail.items() if count > 0)
 
-        return "".join(tmp)
+    def write_tests(self, path):
+        """
+        Write the tests, sorted by name, with their outcomes and covered locations to `path`.
+        """
+        spectra = self._get_spectra()
+        named_test_ids = sorted((interning.tests.key_of(test_id), test_id) for test_id in self._iter_test_ids())
+        with open(path, 'w') as f:
+            f.write("name,outcome")
+            for test, test_id in named_test_ids:
+                f.write(f"\n{test},{spectra.test_results[test_id]}")
+                for location_id in spectra.get_locations(test_id):
+                    loc = interning.locations.key_of(location_id)
+                    f.write(f",{loc.class_name}:{loc.line_number}")
 
     def __get_test_counts(self, ignored_tests=None):
-        count_for_location = defaultdict(TestCount)
-        for test, result in self.test_results.items():
-            if ignored_tests is not None and test in ignored_tests:
-                continue
-            covered = self.locations_for_test[test]
-            for loc in self.tests_for_location.keys():
-                if result == "PASS":
-                    if loc in covered:
-                        count_for_location[loc].ex_pass += 1
-                    else:
-                        count_for_location[loc].not_ex_pass += 1
-                else:
-                    if loc in covered:
-                        count_for_location[loc].ex_fail += 1
-                    else:
-                        count_for_location[loc].not_ex_fail += 1
-        return count_for_location
+        ex_pass, ex_fail, num_passing, num_failing = self._get_counts()
+
+        if ignored_tests:
+            # apply ignored tests as a delta on copies of the counts
+            ex_pass = dict(ex_pass)
+            ex_fail = dict(ex_fail)
+            delta_passing, delta_failing = self._get_spectra().count_classes(
+                ex_pass, ex_fail, [test_id for test_id in ignored_tests if self._contains(test_id)], -1)
+            num_passing += delta_passing
+            num_failing += delta_failing
+
+        return {loc: TestCount(ex_pass[loc], ex_fail[loc], num_passing - ex_pass[loc], num_failing - ex_fail[loc])
+                for loc in ex_pass}
 
     def __get_susp_values(self, algorithm=FLAlgorithm.ochiai, ignored_tests=None):
-        return {loc: algorithm(count)
+        return {interning.locations.key_of(loc): algorithm(count)
                 for loc, count in self.__get_test_counts(ignored_tests=ignored_tests).items()}
 
-    def dump_susp_values_str(self, ignored_tests=None, perfect_locations=None):
-        tmp = ["<className{#lineNumber,suspValue"]
+    def write_susp_values(self, path, ignored_tests=None, perfect_locations=None, top_k=None):
+        """
+        Write the suspiciousness value of each location to `path`, sorted by location in reverse order.
 
-        if perfect_locations is None:
-            susp_values = self.__get_susp_values(ignored_tests=ignored_tests)
-        else:
+        :param ignored_tests: ids of tests that are not used for fault localization
+        :param perfect_locations: `Location`s to use instead of the computed suspicious locations
+        :param top_k: if not None, only write the `top_k` most suspicious computed locations
+                      (in addition to `perfect_locations`)
+        """
+        susp_values = self.__get_susp_values(ignored_tests=ignored_tests)
+        if top_k is not None and len(susp_values) > top_k:
+            susp_values = dict(heapq.nlargest(top_k, susp_values.items(), key=lambda x: (x[1], x[0])))
+
+        if perfect_locations is not None:
             # If we set the susp value of given locations to 1, and omit any other location,
             # then Arja-e is likely to crash.
             # Instead, use a high susp value for given locations, and give a susp value of 1
             # to other locations. This way, other locations don't get ruled out by Arja-e,
             # but have a very low probability of being selected.
 
+            computed_locations = susp_values
             susp_values = {loc: 10000000 for loc in perfect_locations}
-            for loc in self.__get_susp_values(ignored_tests=ignored_tests):
+            for loc in computed_locations:
                 if loc not in susp_values:
                     susp_values[loc] = 1
 
-        for loc, value in sorted(susp_values.items(), reverse=True):
-            tmp.append("\n")
-            tmp.append(f"<{loc.class_name}{{#{loc.line_number},{value}")
-        return "".join(tmp)
+        with open(path, 'w') as f:
+            f.write("<className{#lineNumber,suspValue")
+            for loc in sorted(susp_values, reverse=True):
+                f.write(f"\n<{loc.class_name}{{#{loc.line_number},{susp_values[loc]}")
+
+
+class Spectra(_SpectraBase):
+    """
+    Coverage and outcomes of tests. Tests and locations are stored as ids from `interning.tests` and
+    `interning.locations`; names are only used when reading and dumping spectra.
+
+    Tests with the same outcome that cover the same locations form an equivalence class, which is stored once with
+    its number of tests. Coverage is a bit matrix over classes: for each location, an int whose bit i is set if the
+    class with id i covers the location.
+
+    Counts for fault localization (per location, the number of passing and failing tests covering it) are maintained
+    as tests are added, so computing suspiciousness values does not recount the whole history.
+    """
+
+    def __init__(self) -> None:
+        self.test_results = {}  # test id |-> "PASS" or "FAIL"
+        self.class_of_test = {}  # test id |-> class id
+        self.class_ids = {}  # (frozenset of location ids, "PASS" or "FAIL") |-> class id
+        self.class_locations = []  # class id |-> frozenset of location ids
+        self.class_results = []  # class id |-> "PASS" or "FAIL"
+        self.class_members = []  # class id |-> set of test ids
+        self.coverage = {}  # location id |-> bitset of class ids
+        self.ex_pass = {}  # location id |-> number of passing tests covering it
+        self.ex_fail = {}  # location id |-> number of failing tests covering it
+        self.num_passing = 0
+        self.num_failing = 0
+
+    def update(self, spectra_file):
+        """
+        Add the tests in `spectra_file`, either a CSV file written by the Java tools or a binary spectra file
+        (see `spectra_store`). A CSV file is loaded from its binary file instead, if that is up-to-date.
+        """
+        if spectra_store.is_binary_spectra(spectra_file):
+            self.__update_from_binary(spectra_file)
+            return
+        binary_file = spectra_store.get_up_to_date_binary(spectra_file)
+        if binary_file is not None:
+            self.__update_from_binary(binary_file)
+            return
+
+        with open(spectra_file) as f:
+            for line in f:
+                tmp = line.strip().split(",")
+                test, result = tmp[0], tmp[1]
+                assert result in ("PASS", "FAIL")
+                test_id = interning.tests.id_of(test)
+                location_ids = []
+                for x in tmp[2:]:
+                    class_name, line_number = x.split(":")
+                    line_number = int(line_number)
+                    location_ids.append(interning.locations.id_of(Location(class_name, line_number)))
+
+                self.__add_test(test_id, result, location_ids)
+
+    def __update_from_binary(self, spectra_file):
+        with spectra_store.SpectraFile(spectra_file) as spectra:
+            # each location is interned once, not once per covering test
+            location_ids = [interning.locations.id_of(Location(class_name, line_number))
+                            for class_name, line_number in spectra.locations]
+            for test, result, covered in spectra:
+                self.__add_test(interning.tests.id_of(test), result, [location_ids[i] for i in covered])
+
+    def __add_test(self, test_id, result, location_ids):
+        if test_id in self.test_results:
+            assert self.test_results[test_id] == result, interning.tests.key_of(test_id)
+            old_locations = self.get_locations(test_id)
+            new_locations = frozenset(location_ids) - old_locations
+            if not new_locations:
+                return
+            self.__leave_class(test_id)
+        else:
+            self.test_results[test_id] = result
+            if result == "PASS":
+                self.num_passing += 1
+            else:
+                self.num_failing += 1
+            old_locations = frozenset()
+            new_locations = frozenset(location_ids)
+
+        ex_counts = self.ex_pass if result == "PASS" else self.ex_fail
+        for location_id in new_locations:
+            if location_id not in self.coverage:
+                self.coverage[location_id] = 0
+                self.ex_pass[location_id] = 0
+                self.ex_fail[location_id] = 0
+            ex_counts[location_id] += 1
+
+        self.__join_class(test_id, old_locations | new_locations, result)
+
+    def __join_class(self, test_id, locations, result):
+        key = (locations, result)
+        class_id = self.class_ids.get(key)
+        if class_id is None:
+            class_id = len(self.class_locations)
+            self.class_ids[key] = class_id
+            self.class_locations.append(locations)
+            self.class_results.append(result)
+            self.class_members.append(set())
+            class_bit = 1 << class_id
+            for location_id in locations:
+                self.coverage[location_id] |= class_bit
+
+        self.class_members[class_id].add(test_id)
+        self.class_of_test[test_id] = class_id
+
+    def __leave_class(self, test_id):
+        # the class is kept even if it has no tests left, for later tests with the same coverage
+        class_id = self.class_of_test.pop(test_id)
+        self.class_members[class_id].remove(test_id)
+
+    def _get_spectra(self):
+        return self
+
+    def _iter_test_ids(self):
+        return self.test_results.keys()
+
+    def _contains(self, test_id):
+        return test_id in self.test_results
+
+    def _get_counts(self):
+        return self.ex_pass, self.ex_fail, self.num_passing, self.num_failing
+
+    def get_locations(self, test_id):
+        class_id = self.class_of_test.get(test_id)
+        if class_id is None:
+            return frozenset()
+        return self.class_locations[class_id]
+
+    def get_equivalence_class(self, test_id):
+        """
+        :return: id of the class of tests with the same outcome and coverage as `test_id`
+        """
+        return self.class_of_test[test_id]
+
+    def get_class_members(self, class_id):
+        return self.class_members[class_id]
+
+    def get_num_classes(self):
+        return sum(1 for members in self.class_members if members)
+
+    def count_classes(self, ex_pass, ex_fail, test_ids, delta):
+        """
+        Add `delta` to the counts in `ex_pass` and `ex_fail` for each test in `test_ids`, which are tests of this
+        spectra. Tests are grouped by equivalence class, so the locations of each class are visited once.
+
+        :return: changes of the number of passing and of failing tests
+        """
+        multiplicities = Counter(self.class_of_test[test_id] for test_id in test_ids)
+        delta_passing = 0
+        delta_failing = 0
+        for class_id, multiplicity in multiplicities.items():
+            if self.class_results[class_id] == "PASS":
+                ex_counts = ex_pass
+                delta_passing += delta * multiplicity
+            else:
+                ex_counts = ex_fail
+                delta_failing += delta * multiplicity
+            for location_id in self.class_locations[class_id]:
+                ex_counts[location_id] += delta * multiplicity
+        return delta_passing, delta_failing
+
+    def restrict(self, test_ids):
+        """
+        :param test_ids: set of ids of tests in this spectra
+        :return: view of this spectra that only contains `test_ids`; nothing is copied
+        """
+        return SpectraView(self, test_ids)
+
+
+class SpectraView(_SpectraBase):
+    """
+    The tests of a parent `Spectra` that are in a set of test ids. Reflects later updates of the parent;
+    counts are derived from the parent's counts when they are needed.
+    """
+
+    def __init__(self, parent, test_ids):
+        self.parent = parent
+        self.test_ids = test_ids
+
+    def _get_spectra(self):
+        return self.parent
+
+    def _iter_test_ids(self):
+        return self.test_ids
+
+    def _contains(self, test_id):
+        return test_id in self.test_ids
+
+    def _get_counts(self):
+        parent = self.parent
+        num_excluded = len(parent.test_results) - len(self.test_ids)
+
+        # start from whichever is smaller: the parent's counts minus excluded tests, or only the tests in the view
+        if num_excluded < len(self.test_ids):
+            ex_pass = dict(parent.ex_pass)
+            ex_fail = dict(parent.ex_fail)
+            num_passing = parent.num_passing
+            num_failing = parent.num_failing
+            test_ids = [test_id for test_id in parent.test_results if test_id not in self.test_ids]
+            delta = -1
+        else:
+            ex_pass = dict.fromkeys(parent.ex_pass, 0)
+            ex_fail = dict.fromkeys(parent.ex_fail, 0)
+            num_passing = 0
+            num_failing = 0
+            test_ids = self.test_ids
+            delta = 1
+
+        delta_passing, delta_failing = parent.count_classes(ex_pass, ex_fail, test_ids, delta)
+        return ex_pass, ex_fail, num_passing + delta_passing, num_failing + delta_failing
+
+    def get_failing_locations(self):
+        parent = self.parent
+        failing = bitset(set(parent.class_of_test[test_id] for test_id in self.test_ids
+                             if parent.test_results[test_id] == "FAIL"))
+        return set(loc for loc, covering in parent.coverage.items() if covering & failing)
+
+    def restrict(self, test_ids):
+        return SpectraView(self.parent, self.test_ids & test_ids)
@@ -0,0 +1,181 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+from pathlib import Path
+
+"""
+Compact binary storage of spectra, read through `mmap`.
+
+The CSV spectra written by the Java tools ("{test},{PASS|FAIL},{class}:{line},...") repeat each class name for every
+covered line of every test. The binary format stores each location once, and the coverage of a test as an array of
+indices into the location dictionary (all integers little-endian):
+
+    header:      magic, #class names, #locations, #tests                   "<8sIII"
+    class names: for each, length and UTF-8 bytes                          "<H", bytes
+    locations:   for each, index of its class name and its line number     "<II"
+    tests:       for each, length and UTF-8 bytes of the name,             "<H", bytes
+                 outcome (1 for PASS, 0 for FAIL), #covered locations,
+                 offset of its coverage in the coverage array              "<BIQ"
+    padding to a multiple of 4 bytes
+    coverage:    location indices of all tests, concatenated               "<I" each
+
+A binary file is worth writing for spectra that are loaded more than once, e.g., the cached scan of user tests. It is
+kept next to its CSV file (see `binary_file_of`), and loaded instead of the CSV file as long as it is up-to-date.
+"""
+
+MAGIC = b"EVOSPEC1"
+
+_HEADER = struct.Struct("<8sIII")
+_LENGTH = struct.Struct("<H")
+_LOCATION = struct.Struct("<II")
+_TEST = struct.Struct("<BIQ")
+
+
+def binary_file_of(csv_file):
+    return Path(csv_file).with_suffix(".bin")
+
+
+def get_up_to_date_binary(csv_file):
+    """
+    :return: the binary file of `csv_file` if it exists and is not older than `csv_file`; None otherwise
+    """
+    binary_file = binary_file_of(csv_file)
+    try:
+        if os.stat(binary_file).st_mtime >= os.stat(csv_file).st_mtime:
+            return binary_file
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def is_binary_spectra(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class SpectraFile:
+    """
+    Read-only view of a binary spectra file. Iterating yields (test name, "PASS" or "FAIL", covered), where
+    `covered` is a sequence of indices into `locations`, backed by the mapped file and valid until the next item.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, num_class_names, num_locations, num_tests = _HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            self.buffer.close()
+            raise ValueError(f"{str(path)} is not a binary spectra file")
+        pos = _HEADER.size
+
+        class_names = []
+        for _ in range(num_class_names):
+            name, pos = self.__read_str(pos)
+            class_names.append(name)
+
+        self.locations = []  # list of (class name, line number)
+        for _ in range(num_locations):
+            class_index, line_number = _LOCATION.unpack_from(self.buffer, pos)
+            pos += _LOCATION.size
+            self.locations.append((class_names[class_index], line_number))
+
+        self.tests = []  # list of (test name, outcome, #covered, offset)
+        for _ in range(num_tests):
+            name, pos = self.__read_str(pos)
+            passed, num_covered, offset = _TEST.unpack_from(self.buffer, pos)
+            pos += _TEST.size
+            self.tests.append((name, "PASS" if passed else "FAIL", num_covered, offset))
+
+        pos += -pos % 4
+        self.__coverage_view = memoryview(self.buffer)[pos:]
+        if sys.byteorder == "little":
+            self.coverage = self.__coverage_view.cast("I")
+        else:
+            self.coverage = array("I", self.__coverage_view)
+            self.coverage.byteswap()
+
+    def __read_str(self, pos):
+        (length,) = _LENGTH.unpack_from(self.buffer, pos)
+        pos += _LENGTH.size
+        return self.buffer[pos:pos + length].decode("utf-8"), pos + length
+
+    def __iter__(self):
+        for name, result, num_covered, offset in self.tests:
+            covered = self.coverage[offset:offset + num_covered]
+            try:
+                yield name, result, covered
+            finally:
+                # `covered` is only valid until the next test; the file cannot be closed while it is exported
+                if isinstance(covered, memoryview):
+                    covered.release()
+
+    def close(self):
+        if isinstance(self.coverage, memoryview):
+            self.coverage.release()
+        self.__coverage_view.release()
+        self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def write_spectra(path, tests):
+    """
+    :param tests: iterable of (test name, "PASS" or "FAIL", iterable of covered (class name, line number))
+    """
+    class_index = {}
+    location_index = {}
+    test_entries = []
+    coverage = array("I")
+    for name, result, covered in tests:
+        assert result in ("PASS", "FAIL"), result
+        offset = len(coverage)
+        for class_name, line_number in covered:
+            location = (class_index.setdefault(class_name, len(class_index)), line_number)
+            coverage.append(location_index.setdefault(location, len(location_index)))
+        test_entries.append((name, result, len(coverage) - offset, offset))
+    if sys.byteorder != "little":
+        coverage.byteswap()
+
+    def length_prefixed(s):
+        data = s.encode("utf-8")
+        return _LENGTH.pack(len(data)) + data
+
+    tmp_path = f"{str(path)}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, len(class_index), len(location_index), len(test_entries)))
+        for class_name in class_index:
+            f.write(length_prefixed(class_name))
+        for location in location_index:
+            f.write(_LOCATION.pack(*location))
+        for name, result, num_covered, offset in test_entries:
+            f.write(length_prefixed(name))
+            f.write(_TEST.pack(1 if result == "PASS" else 0, num_covered, offset))
+        f.write(b"\0" * (-f.tell() % 4))
+        f.write(coverage.tobytes())
+    os.replace(tmp_path, path)
+
+
+def read_csv_spectra(csv_file):
+    """
+    :return: generator of (test name, "PASS" or "FAIL", list of covered (class name, line number))
+    """
+    with open(csv_file) as f:
+        for line in f:
+            tmp = line.strip().split(",")
+            covered = []
+            for x in tmp[2:]:
+                class_name, line_number = x.split(":")
+                covered.append((class_name, int(line_number)))
+            yield tmp[0], tmp[1], covered
+
+
+def convert_csv(csv_file, binary_file=None):
+    write_spectra(binary_file if binary_file is not None else binary_file_of(csv_file), read_csv_spectra(csv_file))
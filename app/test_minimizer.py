@@ -0,0 +1,45 @@
+from app import emitter
+
+"""
+Minimization of generated killing tests before they are given to patch generation.
+
+Each killing test covers some requirements: the patches it kills, and the suspicious locations it executes.
+A subset of the tests is chosen greedily (set cover), such that the union of covered requirements is unchanged.
+"""
+
+
+def minimize_killing_tests(killing_i_tests, kill_matrix, spectra):
+    """
+    :param killing_i_tests: tests that kill at least one patch
+    :param kill_matrix: KillMatrix of the tests
+    :param spectra: Spectra that contains the generated tests; a location is suspicious if a failing test covers it
+    :return: list of tests, a subset of `killing_i_tests` that kills the same patches and covers the same
+             suspicious locations
+    """
+    suspicious_locations = spectra.get_failing_locations()
+
+    requirements_for_i_test = {}
+    for i_test in killing_i_tests:
+        requirements = set(("patch", patch_id) for patch_id in kill_matrix.get_killed_patches(i_test.id))
+        requirements.update(("location", loc)
+                            for loc in spectra.get_locations(i_test.id)
+                            if loc in suspicious_locations)
+        requirements_for_i_test[i_test] = requirements
+
+    uncovered = set().union(*requirements_for_i_test.values())
+
+    # sort for determinism: ties are broken by test index
+    candidates = sorted(requirements_for_i_test.keys(), key=lambda x: x.get_index())
+    result = []
+    while uncovered:
+        best = max(candidates, key=lambda x: len(requirements_for_i_test[x] & uncovered))
+        gain = requirements_for_i_test[best] & uncovered
+        if not gain:
+            break
+        result.append(best)
+        candidates.remove(best)
+        uncovered -= gain
+
+    emitter.normal(f"kept {len(result)} of {len(requirements_for_i_test)} killing tests after minimization")
+
+    return result
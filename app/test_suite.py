@@ -1,14 +1,15 @@
+import re
 import shlex
 import shutil
+import time
 
-from app import emitter, utilities, values
+from app import emitter, utilities, values, interning, executor
 
 import os
 from os.path import abspath
 from pathlib import Path
-import subprocess
 from subprocess import DEVNULL, PIPE
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 
 USER_TEST_GENERATION = -1
 
@@ -25,31 +26,121 @@ class TestSuite:
     def __repr__(self):
         return f"TestSuite[{self.junit_class}@{self.dir_src}]"
 
-    def compile(self, out_dir):
-        assert os.path.isabs(out_dir), out_dir
-        assert utilities.is_empty_dir(out_dir), out_dir
+    def compile(self, out_dir, deadline=None):
+        failed_suites = compile_suites([(self, out_dir)], deadline=deadline)
+        if failed_suites:
+            utilities.error_exit(f"failed to compile test suite {str(self)}")
+
+    def get_junit_file(self):
+        return os.path.join(self.dir_src, f"{self.junit_class.replace('.', os.path.sep)}.java")
+
+    def owns_class_file(self, relative_class_file):
+        """
+        Whether a class file, relative to the output directory of javac, is compiled from this suite,
+        i.e., the JUnit class, its scaffolding, or their nested classes.
+        """
+        relative_class_file = Path(relative_class_file)
+        package_dir = Path(*self.junit_class.split(".")[:-1])
+        if relative_class_file.parent != package_dir:
+            return False
+        simple_name = self.junit_class.split(".")[-1]
+        outer_name = relative_class_file.stem.split("$")[0]
+        return outer_name in (simple_name, f"{simple_name}_scaffolding")
 
-        junit_file = os.path.join(self.dir_src, f"{self.junit_class.replace('.', os.path.sep)}.java")
 
-        class_file = Path(junit_file).with_suffix(".class")
-        assert not class_file.exists(), f"{str(class_file)} already exists; compilation aborted"
+def compile_suites(suites_and_out_dirs, deadline=None):
+    """
+    Compile test suites with a single invocation of javac, and put the class files of each suite in its own
+    output directory.
 
-        javac_executable = shutil.which("javac")
-        if javac_executable is None:
-            raise RuntimeError("javac executable not found")
+    If javac fails, the suites with compilation errors are excluded and the rest are compiled again.
 
-        deps = ":".join((str(x) for x in self.compile_deps))
-        classpath = f"{str(self.dir_src)}:{deps}:{str(values.dir_info['classes'])}"
+    :param suites_and_out_dirs: list of (TestSuite, out_dir); JUnit class names of the suites must be distinct
+    :return: list of suites that failed to compile
+    """
+    junit_classes = [suite.junit_class for suite, _ in suites_and_out_dirs]
+    assert len(junit_classes) == len(set(junit_classes)), junit_classes
 
-        compile_command = f'{javac_executable} -cp "{classpath}" -d {out_dir} {junit_file}'
-
-        emitter.command(compile_command)
+    for suite, out_dir in suites_and_out_dirs:
+        assert os.path.isabs(out_dir), out_dir
+        assert utilities.is_empty_dir(out_dir), out_dir
 
-        process = subprocess.run(shlex.split(compile_command), stdout=DEVNULL, stderr=PIPE)
+        class_file = Path(suite.get_junit_file()).with_suffix(".class")
+        assert not class_file.exists(), f"{str(class_file)} already exists; compilation aborted"
 
-        if process.returncode != 0:
-            utilities.error_exit("failed to compiled test suite", process.stderr.decode("utf-8"),
-                                 f"exit code: {process.returncode}")
+    javac_executable = shutil.which("javac")
+    if javac_executable is None:
+        raise RuntimeError("javac executable not found")
+
+    failed_suites = []
+    remaining = list(suites_and_out_dirs)
+    while remaining:
+        while True:
+            dir_staging = Path(values.dir_tmp, f"suites_compile_{time.time()}")
+            if not dir_staging.exists():
+                break
+        os.makedirs(dir_staging)
+
+        try:
+            returncode, stderr = _run_javac(javac_executable, [suite for suite, _ in remaining], dir_staging,
+                                            deadline)
+
+            if returncode == 0:
+                for dir_path, _, file_names in os.walk(dir_staging):
+                    for file_name in file_names:
+                        if not file_name.endswith(".class"):
+                            continue
+                        relative_class_file = Path(dir_path, file_name).relative_to(dir_staging)
+                        for suite, out_dir in remaining:
+                            if suite.owns_class_file(relative_class_file):
+                                dst = Path(out_dir, relative_class_file)
+                                os.makedirs(dst.parent, exist_ok=True)
+                                shutil.move(str(Path(dir_staging, relative_class_file)), dst)
+                                break
+                break
+
+            erroneous_files = set(os.path.abspath(x) for x in re.findall(r"^(.+\.java):\d+: error:", stderr,
+                                                                          flags=re.MULTILINE))
+            culprits = [(suite, out_dir) for suite, out_dir in remaining
+                        if any(Path(suite.dir_src) in Path(x).parents for x in erroneous_files)]
+            if not culprits and len(remaining) > 1:
+                # errors cannot be attributed from javac's output; compile the suites one by one instead
+                for x in remaining:
+                    failed_suites.extend(compile_suites([x], deadline=deadline))
+                break
+            if not culprits:
+                culprits = remaining
+
+            for suite, _ in culprits:
+                emitter.warning(f"failed to compile test suite {str(suite)}")
+                failed_suites.append(suite)
+            emitter.warning(stderr)
+            remaining = [x for x in remaining if x not in culprits]
+        finally:
+            shutil.rmtree(dir_staging, ignore_errors=True)
+
+    return failed_suites
+
+
+def _run_javac(javac_executable, suites, out_dir, deadline=None):
+    dir_srcs = list(OrderedDict.fromkeys(str(suite.dir_src) for suite in suites))
+    deps = list(OrderedDict.fromkeys(str(dep) for suite in suites for dep in suite.compile_deps))
+    classpath = ":".join([*dir_srcs, *deps, str(values.dir_info['classes'])])
+
+    sources_file = Path(out_dir, "sources.txt")
+    with open(sources_file, 'w') as f:
+        f.write("\n".join(suite.get_junit_file() for suite in suites))
+
+    compile_command = f'{javac_executable} -cp "{classpath}" -d {out_dir} @{str(sources_file)}'
+
+    emitter.command(compile_command)
+    emitter.normal(f"\tcompiling {len(suites)} test suite(s)")
+
+    try:
+        process = executor.run(shlex.split(compile_command), "javac", deadline=deadline, stdout=DEVNULL, stderr=PIPE)
+    finally:
+        os.remove(sources_file)
+    return process.returncode, process.stderr.decode("utf-8")
 
 
 class Test:
@@ -60,57 +151,90 @@ class Test:
 
 SuiteIndex = namedtuple("SuiteIndex", ["generation", "key"])
 
+_interned_indexed_suites = {}
+
 
 class IndexedSuite:
-    def __init__(self, generation, suite):
+    __slots__ = ("generation", "suite", "_index", "_hash", "_index_str")
+
+    def __new__(cls, generation, suite):
+        # an indexed suite is immutable; share one instance per index
+        index = interning.intern_index(SuiteIndex(generation, suite.key))
+        existing = _interned_indexed_suites.get(index)
+        if existing is not None:
+            return existing
+
+        self = super().__new__(cls)
         self.generation = generation
         self.suite = suite
+        self._index = index
+        self._hash = hash(index)
+        self._index_str = interning.intern_str(f"{suite.key}@gen{generation}")
+        return _interned_indexed_suites.setdefault(index, self)
+
+    def __reduce__(self):
+        return IndexedSuite, (self.generation, self.suite)
 
     def __hash__(self):
-        return hash(self.get_index())
+        return self._hash
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if not isinstance(other, IndexedSuite):
             return False
-        return self.get_index() == other.get_index()
+        return self._index == other._index
 
     def __str__(self):
         return f"IndexedSuite[{self.suite.key}@gen{self.generation}]"
 
     def get_index(self):
-        return SuiteIndex(self.generation, self.suite.key)
+        return self._index
 
     def get_index_str(self):
-        return f"{self.suite.key}@gen{self.generation}"
+        return self._index_str
 
 
 TestIndex = namedtuple("TestIndex", ["generation", "suite_key", "method_name"])
 
 
 class IndexedTest:
+    __slots__ = ("indexed_suite", "method_name", "id", "_index", "_hash", "_index_str", "_full_test_name")
+
     def __init__(self, generation, test):
         self.indexed_suite = IndexedSuite(generation, test.suite)
-        self.method_name = test.method_name
+        self.method_name = interning.intern_str(test.method_name)
+        self._index = interning.intern_index(TestIndex(*self.indexed_suite.get_index(), self.method_name))
+        self._hash = hash(self._index)
+        self._index_str = interning.intern_str(f"{self.method_name}#{self.indexed_suite.get_index_str()}")
+        self._full_test_name = interning.intern_str(f"{self.indexed_suite.suite.junit_class}#{self.method_name}")
+        self.id = interning.tests.id_of(self._full_test_name)
+        interning.tests.register(self.id, self)
+
+    def __reduce__(self):
+        return IndexedTest, (self.indexed_suite.generation, Test(self.indexed_suite.suite, self.method_name))
 
     def __hash__(self):
-        return hash(self.get_index())
+        return self._hash
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if not isinstance(other, IndexedTest):
             return False
-        return self.get_index() == other.get_index()
+        return self._index == other._index
 
     def __str__(self):
         return f"{self.method_name}@{str(self.indexed_suite)}"
 
     def get_index(self):
-        return TestIndex(*self.indexed_suite.get_index(), self.method_name)
+        return self._index
 
     def get_suite_index(self):
         return self.indexed_suite.get_index()
 
     def get_index_str(self):
-        return f"{self.method_name}#{self.indexed_suite.get_index_str()}"
+        return self._index_str
 
     def get_full_test_name(self):
-        return f"{self.indexed_suite.suite.junit_class}#{self.method_name}"
+        return self._full_test_name
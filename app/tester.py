@@ -1,8 +1,9 @@
+import math
 import re
-import time
 from typing import List
 
-from app import emitter, utilities, values
+from app import emitter, utilities, values, evosuite_worker, executor, interning, profiler
+from app.deadline import Deadline, DeadlineExceeded
 from app.test_suite import TestSuite
 from app.patch import Patch
 from app.test_suite import Test, IndexedTest
@@ -20,11 +21,19 @@ import shlex
 
 from collections import defaultdict
 import json
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 """
 This function implements the developer testing to generate test-diagnostics for the repair 
 
 """
+
+# share of the time planned for an EvoSuite run that goes to the search when the time left is short; the rest is for
+# JVM startup, minimization and writing the tests
+EVOSUITE_SEARCH_SHARE = 0.75
+
 def generate_test_diagnostic():
     emitter.normal("running developer test-suite")
 
@@ -41,7 +50,8 @@ This is the interface for EvoSuite
 def generate_additional_test(indexed_patches, dir_output, junit_suffix,
                              target_patches_file=None,
                              seed_i_tests=None, seeds_file=None, kill_matrix=None,
-                             dry_run=False, timeout_per_class_in_seconds=0, random_seed=0):
+                             dry_run=False, timeout_per_class_in_seconds=0, random_seed=0, max_parallel=0,
+                             deadline=None):
     assert os.path.isabs(dir_output)
     assert os.path.isdir(dir_output)
     if not dry_run:
@@ -58,6 +68,9 @@ def generate_additional_test(indexed_patches, dir_output, junit_suffix,
             assert not os.path.exists(seeds_file), str(seeds_file)
         assert kill_matrix is not None
 
+    if deadline is None:
+        deadline = Deadline.of_run()
+
     emitter.sub_sub_title("Generating Test Cases")
 
     classes = set()
@@ -98,8 +111,8 @@ def generate_additional_test(indexed_patches, dir_output, junit_suffix,
                 "tests": [
                     {
                         "name": i_test.get_index_str(),
-                        "kills": [i_patch.get_index_str() for i_patch in kill_matrix[i_test]] if i_test in kill_matrix
-                                 else []
+                        "kills": [interning.patches.object_of(patch_id).get_index_str()
+                                  for patch_id in kill_matrix.get_killed_patches(i_test.id)]
                     }
                     for i_test in i_tests
                 ]
@@ -111,30 +124,75 @@ def generate_additional_test(indexed_patches, dir_output, junit_suffix,
             with open(seeds_file, 'w') as f:
                 json.dump(seeds_info, f)
 
-    result = []
-    while classes:
-        classname = classes.pop()
+    # one EvoSuite run per class, each with its own output directory and a seed derived from `random_seed`
+    classes = sorted(classes)
+    seed_random = random.Random(random_seed)
+    seed_for_class = {classname: seed_random.randint(-0x80000000, 0x7fffffff) for classname in classes}
+
+    num_workers = min(len(classes), max_parallel if max_parallel > 0 else utilities.available_cpus())
+    num_workers = max(num_workers, 1)
+    if len(classes) > 1:
+        emitter.normal(f"\trunning EvoSuite for {len(classes)} classes, at most {num_workers} at a time")
+
+    stop_event = threading.Event()
+    skipped_classes = []
+    parent_span = profiler.current()
+    parent_priority = executor.current_priority()
+    num_started = iter(range(len(classes)))
+
+    def generate_for(classname):
         dir_output_this_class = Path(dir_output, classname)
         os.makedirs(dir_output_this_class, exist_ok=True)
         if not dry_run:
             assert utilities.is_empty_dir(dir_output_this_class)
-        if not utilities.timed_out():
-            result.extend(
-                generate_tests_for_class(classname, values.dir_info["classes"], dir_output_this_class, junit_suffix,
-                                        dry_run=dry_run, timeout_in_seconds=timeout_per_class_in_seconds,
-                                        seeds_file=seeds_file, target_patches_file=target_patches_file,
-                                        random_seed=random_seed)
-            )
-        else:
-            emitter.normal(f"\tskipping test generation for these classes due to global timeout:"
-                           f" {', '.join(classes | set([classname]))}")
-            break
+        if deadline.expired() or stop_event.is_set():
+            skipped_classes.append(classname)
+            return []
+        # the classes that have not started share the time left, `num_workers` at a time
+        num_rounds = math.ceil((len(classes) - next(num_started)) / num_workers)
+        timeout_in_seconds = plan_search_budget(timeout_per_class_in_seconds, deadline, num_rounds)
+        with profiler.span(classname, "class", parent=parent_span), executor.priority(parent_priority):
+            return generate_tests_for_class(classname, values.dir_info["classes"], dir_output_this_class,
+                                            junit_suffix, dry_run=dry_run,
+                                            timeout_in_seconds=timeout_in_seconds,
+                                            seeds_file=seeds_file, target_patches_file=target_patches_file,
+                                            random_seed=seed_for_class[classname], stop_event=stop_event,
+                                            deadline=deadline)
+
+    result = []
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        futures = [pool.submit(generate_for, classname) for classname in classes]
+        try:
+            for future in futures:
+                result.extend(future.result())
+        except BaseException:
+            # kill running EvoSuite processes and do not start new ones
+            stop_event.set()
+            for future in futures:
+                future.cancel()
+            raise
+
+    if skipped_classes:
+        emitter.normal(f"\tskipping test generation for these classes due to global timeout:"
+                       f" {', '.join(sorted(skipped_classes))}")
 
     return result
 
 
+def plan_search_budget(timeout_in_seconds, deadline, num_rounds):
+    """
+    :param timeout_in_seconds: planned search budget of one EvoSuite run; 0 for no limit
+    :param num_rounds: number of EvoSuite runs, one after another, that share the time left
+    :return: search budget in whole seconds, reduced so that the runs finish before `deadline`; 0 for no limit
+    """
+    share = deadline.budget(timeout_in_seconds, parts=num_rounds)
+    if share is None or (timeout_in_seconds and share >= timeout_in_seconds):
+        return timeout_in_seconds
+    return max(int(share * EVOSUITE_SEARCH_SHARE), 1)
+
+
 def generate_tests_for_class(classname, dir_bin, dir_output, junit_suffix, dry_run=False, target_patches_file=None,
-                             seeds_file=None, timeout_in_seconds=0, random_seed=0):
+                             seeds_file=None, timeout_in_seconds=0, random_seed=0, stop_event=None, deadline=None):
     assert os.path.isabs(dir_bin)
     assert utilities.is_nonempty_dir(dir_bin)
     assert os.path.isabs(dir_output)
@@ -147,6 +205,8 @@ def generate_tests_for_class(classname, dir_bin, dir_output, junit_suffix, dry_r
         assert os.path.isfile(seeds_file), seeds_file
     if not dry_run:
         assert utilities.is_empty_dir(dir_output)
+    if deadline is None:
+        deadline = Deadline.of_run()
 
     java_executable = shutil.which("java")
     if java_executable is None:
@@ -156,24 +216,27 @@ def generate_tests_for_class(classname, dir_bin, dir_output, junit_suffix, dry_r
     evosuite_jar = Path(dir_evosuite, "master", "target", f"evosuite-master-{read_evosuite_version()}.jar")
     assert os.path.isfile(evosuite_jar), evosuite_jar
 
-    evosuite_command = (f"{java_executable}"
-                        f" -Drandom_seed={random_seed}"
-                        f" -Dclient_on_thread=true"
-                        f" -jar {str(evosuite_jar)} -class {classname} -projectCP {str(dir_bin)}"
-                        f" -base_dir {str(dir_output)} -Dassertions=false -Djunit_suffix={junit_suffix}"
-                        )
+    evosuite_args = (f"-class {classname} -projectCP {str(dir_bin)}"
+                     f" -base_dir {str(dir_output)} -Dassertions=false -Djunit_suffix={junit_suffix}"
+                     )
     if timeout_in_seconds:
-        evosuite_command += f" -Dsearch_budget={timeout_in_seconds} -Dstopping_condition=MaxTime"
+        evosuite_args += f" -Dsearch_budget={timeout_in_seconds} -Dstopping_condition=MaxTime"
 
     if target_patches_file is not None:
-        evosuite_command += f" -generateMOSuite -evorepair=testgen"
-        evosuite_command += f" -targetPatches {str(target_patches_file)}"
+        evosuite_args += f" -generateMOSuite -evorepair=testgen"
+        evosuite_args += f" -targetPatches {str(target_patches_file)}"
 
     if seeds_file is not None:
-        evosuite_command += f" -seeds {str(seeds_file)}"
+        evosuite_args += f" -seeds {str(seeds_file)}"
 
     if os.path.isfile(values.file_oracle_locations):
-        evosuite_command += f" -oracleLocations {str(values.file_oracle_locations)}"
+        evosuite_args += f" -oracleLocations {str(values.file_oracle_locations)}"
+
+    evosuite_command = (f"{java_executable}"
+                        f" -Drandom_seed={random_seed}"
+                        f" -Dclient_on_thread=true"
+                        f" -jar {str(evosuite_jar)} {evosuite_args}"
+                        )
 
     dir_test_src = Path(dir_output, "evosuite-tests")
 
@@ -182,33 +245,22 @@ def generate_tests_for_class(classname, dir_bin, dir_output, junit_suffix, dry_r
     test_names_file = Path(dir_test_src, "test_names.txt")
 
     if not dry_run:
-        if utilities.timed_out():
+        if deadline.expired():
             return []
 
         emitter.normal(f"\trunning evosuite for {classname}")
 
-        popen = subprocess.Popen(shlex.split(evosuite_command), stdout=PIPE, stderr=STDOUT)
-
-        emitter.command(evosuite_command)
-
         if timeout_in_seconds:
             emitter.normal(f"\t\twaiting for EvoSuite to terminate in {timeout_in_seconds} seconds\t")
         else:
             emitter.normal("\t\twaiting for EvoSuite to terminate automatically")
 
-        # trust EvoSuite always terminates
-        try:
-            stdout_data, _ = popen.communicate(
-                timeout=(values.time_system_end - time.time()) if values.time_system_end is not None else None)
-            return_code = popen.poll()
-            if return_code != 0:
-                utilities.error_exit("EvoSuite did not exit normally",
-                                     stdout_data.decode("utf-8"), f"return code: {return_code}")
-        except subprocess.TimeoutExpired:
-            popen.kill()
-            emitter.normal("\t\tkilled EvoSuite due to global timeout")
-            stdout_data, _ = popen.communicate()
-            emitter.debug(f"EvoSuite output: {stdout_data.decode('utf-8')}")
+        if values.use_evosuite_worker:
+            output = run_evosuite_job(evosuite_jar, f"{evosuite_args} -Drandom_seed={random_seed}", dir_output,
+                                      classname, stop_event, deadline)
+        else:
+            output = run_evosuite_process(evosuite_command, classname, stop_event, deadline)
+        if output is None:
             return []
 
         out_file_prefix = str(Path(dir_test_src, *classname.split('.')))
@@ -217,10 +269,10 @@ def generate_tests_for_class(classname, dir_bin, dir_output, junit_suffix, dry_r
         for x in test_source, test_scaffold, dump_file, test_names_file:
             if not os.path.isfile(x):
                 emitter.warning(f"EvoSuite exited normally without generating expected file {x}")
-                emitter.warning(f"EvoSuite output: {stdout_data.decode('utf-8')}")
+                emitter.warning(f"EvoSuite output: {output}")
                 return []
 
-        emitter.normal("\tEvoSuite terminated normally")
+        emitter.normal(f"\tEvoSuite terminated normally for {classname}")
     else:
         emitter.normal(f"\tDry run; will reuse tests in {dir_test_src}")
 
@@ -255,6 +307,77 @@ def generate_tests_for_class(classname, dir_bin, dir_output, junit_suffix, dry_r
     return [Test(suite, test_name) for test_name in suite.test_names]
 
 
+def run_evosuite_process(evosuite_command, classname, stop_event=None, deadline=None):
+    """
+    :return: output of EvoSuite; None if EvoSuite is killed because of `deadline` (default: of the run) or
+             `stop_event`
+    """
+    if deadline is None:
+        deadline = Deadline.of_run()
+    # EvoSuite runs the search in a client JVM of its own
+    try:
+        popen = executor.popen(shlex.split(evosuite_command), "EvoSuite", memory_mb=2 * executor.DEFAULT_MEMORY_MB,
+                               deadline=deadline, stdout=PIPE, stderr=STDOUT)
+    except DeadlineExceeded:
+        emitter.normal(f"\t\tdid not start EvoSuite for {classname} due to global timeout")
+        return None
+
+    emitter.command(evosuite_command)
+
+    # trust EvoSuite always terminates, unless there is a global timeout or other runs have failed
+    poll_interval = 1
+    while True:
+        try:
+            stdout_data, _ = executor.communicate(popen, timeout=poll_interval)
+            break
+        except subprocess.TimeoutExpired:
+            if deadline.expired() or (stop_event is not None and stop_event.is_set()):
+                if deadline.expired():
+                    emitter.normal(f"\t\tstopping EvoSuite for {classname} due to global timeout")
+                else:
+                    emitter.normal(f"\t\tstopping EvoSuite for {classname} because test generation is cancelled")
+                executor.terminate(popen)
+                stdout_data, _ = executor.communicate(popen)
+                emitter.debug(f"EvoSuite output: {stdout_data.decode('utf-8')}")
+                return None
+    return_code = popen.returncode
+    if return_code != 0:
+        utilities.error_exit(f"EvoSuite did not exit normally for {classname}",
+                             stdout_data.decode("utf-8"), f"return code: {return_code}")
+    return stdout_data.decode("utf-8")
+
+
+def run_evosuite_job(evosuite_jar, evosuite_args, dir_output, classname, stop_event=None, deadline=None):
+    """
+    Same as `run_evosuite_process`, but run EvoSuite in a long-running worker.
+    """
+    if deadline is None:
+        deadline = Deadline.of_run()
+    try:
+        # the job, not the worker, holds the resources (see evosuite_worker)
+        with executor.reserve(cpus=1, memory_mb=evosuite_worker.MEMORY_MB, deadline=deadline):
+            worker = evosuite_worker.acquire(evosuite_jar, Path(values.dir_info["test-gen"], "workers"))
+            emitter.command(f"[EvoSuite worker pid={worker.popen.pid}] {evosuite_args}")
+            try:
+                reply = worker.run_job(shlex.split(evosuite_args), dir_output, stop_event, deadline)
+            finally:
+                evosuite_worker.release(worker)
+    except DeadlineExceeded:
+        reply = None
+
+    if reply is None:
+        if deadline.expired():
+            emitter.normal(f"\t\tkilled EvoSuite worker for {classname} due to global timeout")
+        else:
+            emitter.normal(f"\t\tkilled EvoSuite worker for {classname} because test generation is cancelled")
+        return None
+    if reply["status"] != "ok":
+        utilities.error_exit(f"EvoSuite did not finish normally for {classname}", reply.get("message"),
+                             f"see logs in {str(worker.log_file)}")
+    emitter.debug(f"EvoSuite produced: {', '.join(reply.get('files') or [])}")
+    return f"see logs in {str(worker.log_file)}"
+
+
 def read_evosuite_version():
     pom_path = Path(values._dir_root, "extern", "evosuite", "pom.xml")
     root = ET.parse(pom_path).getroot()
@@ -1,16 +1,15 @@
-from app import emitter, utilities, values
+from app import emitter, utilities, values, executor
 from app.tester import read_evosuite_version
 
 import shlex
 import os
 from pathlib import Path
-import subprocess
 from subprocess import PIPE
 import xml.dom.minidom
 import re
 
 
-def run_uniapr(work_dir, patch_bin_dir, changed_classes, execute_tests):
+def run_uniapr(work_dir, patch_bin_dir, changed_classes, execute_tests, deadline=None):
     # link the original class files to mock a maven directory layout
     mock_bin_dir = Path(work_dir, "target", "classes")
     os.makedirs(mock_bin_dir.parent, exist_ok=True)  # may already exist because of test compilation
@@ -53,7 +52,8 @@ def run_uniapr(work_dir, patch_bin_dir, changed_classes, execute_tests):
 
         emitter.command(uniapr_command)
 
-        process = subprocess.run(shlex.split(uniapr_command), stdout=PIPE, stderr=PIPE, env=os.environ, cwd=work_dir)
+        process = executor.run(shlex.split(uniapr_command), "UniAPR", deadline=deadline, stdout=PIPE, stderr=PIPE,
+                               env=os.environ, cwd=work_dir)
         if process.returncode != 0:
             emitter.warning(f"UniAPR did not exit normally")
         with open(Path(values.dir_log_base, "uniapr.out"), 'w') as f:
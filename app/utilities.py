@@ -4,13 +4,14 @@ import sys
 import signal
 import random
 from contextlib import contextmanager
-from app import logger, emitter, values
+from app import logger, emitter, values, executor
+from app.deadline import DeadlineExceeded
 import base64
 import hashlib
 import time
 
 
-def execute_command(command, show_output=True):
+def execute_command(command, show_output=True, deadline=None):
     # Print executed command and execute it in console
     command = command.encode().decode('ascii', 'ignore')
     emitter.command(command)
@@ -18,8 +19,13 @@ def execute_command(command, show_output=True):
     if not show_output:
         command += " > /dev/null"
     # print(command)
-    process = subprocess.Popen([command], stdout=subprocess.PIPE, shell=True, env=os.environ)
-    (output, error) = process.communicate()
+    process = executor.popen([command], "shell command", stdout=subprocess.PIPE, shell=True, env=os.environ,
+                             deadline=deadline)
+    try:
+        (output, error) = executor.communicate(process, deadline.remaining() if deadline is not None else None)
+    except subprocess.TimeoutExpired:
+        executor.terminate(process)
+        raise DeadlineExceeded(f"command was stopped at the deadline: {command}")
     # out is the output of the command, and err is the exit value
     return int(process.returncode)
 
@@ -94,6 +100,37 @@ def timed_out():
             and time.time() >= values.time_system_end)
 
 
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def available_memory_mb():
+    """
+    :return: memory available to this process in MiB, taking cgroup limits into account
+    """
+    candidates = []
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    candidates.append(int(line.split()[1]) // 1024)
+    except OSError:
+        pass
+    if not candidates and hasattr(os, "sysconf"):
+        candidates.append(os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // (1 << 20))
+    for limit_file in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(limit_file) as f:
+                limit = f.read().strip()
+        except OSError:
+            continue
+        if limit.isdigit():
+            candidates.append(int(limit) // (1 << 20))
+    return min(candidates) if candidates else 4096
+
+
 def __dir_is_empty(path):
     assert os.path.isdir(path)
     return not any(os.scandir(path))
@@ -1,6 +1,7 @@
-import time
-from app import emitter, utilities, values
+from app import emitter, utilities, values, artifact_store, bytecode, executor, profiler
+from app.deadline import Deadline, DeadlineExceeded
 from app.uniapr import run_uniapr
+from app.test_suite import compile_suites
 
 import os
 from pathlib import Path
@@ -10,6 +11,8 @@ import socket
 import json
 import glob
 import asyncio
+import functools
+import shlex
 import shutil
 import pprint
 from collections import defaultdict, OrderedDict
@@ -27,6 +30,9 @@ Expected Input
 
 Expected Output
 @output matrix of result for each test x patch
+@output list of patches that do not compile
+(test suites that do not compile are not registered in `indexed_suite_to_bin_dir`, and their tests are not executed)
+@output list of patches whose bytecode is equivalent to the original program
 @output sorted list of plausible patches
 @output ranked list of test-cases and their mutation score
 """
@@ -35,11 +41,21 @@ indexed_patch_to_bin_dir = {}
 
 indexed_suite_to_bin_dir = {}
 
+bin_dir_to_class_hashes = {}
+
+original_class_hashes = {}
+
 
 def validate(indexed_patches, indexed_tests, work_dir, compile_patches=True, compile_tests=True, execute_tests=True,
-             use_d4j_instr=True):
+             use_d4j_instr=True, deadline=None):
+    """
+    :raise DeadlineExceeded: if `deadline` (default: of the run) passes while compiling; tests that cannot be run
+                             before it are reported as neither passing nor failing
+    """
     assert os.path.isabs(work_dir)
     assert os.path.isdir(work_dir)
+    if deadline is None:
+        deadline = Deadline.of_run()
 
     global indexed_suite_to_bin_dir, indexed_patch_to_bin_dir
 
@@ -65,52 +81,175 @@ def validate(indexed_patches, indexed_tests, work_dir, compile_patches=True, com
     compilable_i_patches = set(indexed_patches)
 
     if compile_patches:
-        emitter.normal("Compiling patches")
-        for i_patch in indexed_patches:
-            if i_patch not in indexed_patch_to_bin_dir:
-                index = i_patch.get_index()
-                out_dir = Path(dir_patches_bin, f"gen_{index.generation}_{index.key}")
-
-                assert not out_dir.exists(), f"{str(out_dir)} already exists"
-                os.makedirs(out_dir)
-
-                try:
-                    i_patch.patch.compile(out_dir)
-                except Exception:
-                    non_compilable_i_patches.append(i_patch)
-                    compilable_i_patches.remove(i_patch)
-                    emitter.warning(f"{str(i_patch)} does not compile")
-                    emitter.warning(traceback.format_exc())
-                    continue
-
-                indexed_patch_to_bin_dir[i_patch] = str(out_dir)
+        non_compilable_i_patches = compile_indexed_patches(indexed_patches, dir_patches_bin, deadline)
+        compilable_i_patches.difference_update(non_compilable_i_patches)
 
     if compile_tests:
         indexed_suites = set([it.indexed_suite for it in indexed_tests])
 
         emitter.normal("Compiling test suites")
-        for i_suite in indexed_suites:
+
+        # all new suites are compiled with one javac invocation, as long as their JUnit class names are distinct
+        junit_2_i_suites = defaultdict(list)
+        for i_suite in sorted(indexed_suites, key=lambda x: x.get_index()):
             if i_suite not in indexed_suite_to_bin_dir:
+                junit_2_i_suites[i_suite.suite.junit_class].append(i_suite)
+
+        while junit_2_i_suites:
+            batch = []
+            for junit in list(junit_2_i_suites.keys()):
+                i_suite = junit_2_i_suites[junit].pop(0)
+                if not junit_2_i_suites[junit]:
+                    del junit_2_i_suites[junit]
+
                 index = i_suite.get_index()
                 out_dir = Path(dir_tests_bin, f"gen_{index.generation}_{index.key}")
 
                 assert not out_dir.exists(), f"{str(out_dir)} already exists"
                 os.makedirs(out_dir)
 
-                i_suite.suite.compile(out_dir)
+                batch.append((i_suite, out_dir))
+
+            failed_suites = compile_suites([(i_suite.suite, out_dir) for i_suite, out_dir in batch],
+                                           deadline=deadline)
 
-                indexed_suite_to_bin_dir[i_suite] = str(out_dir)
+            for i_suite, out_dir in batch:
+                if i_suite.suite in failed_suites:
+                    emitter.warning(f"{str(i_suite)} does not compile; its tests are not used")
+                else:
+                    indexed_suite_to_bin_dir[i_suite] = str(out_dir)
+
+        indexed_tests = [it for it in indexed_tests if it.indexed_suite in indexed_suite_to_bin_dir]
+
+    equivalent_i_patch_groups, noop_i_patches = group_equivalent_patches(compilable_i_patches)
+    for i_patch in noop_i_patches:
+        emitter.warning(f"{str(i_patch)} compiles to the same bytecode as the original program")
+        compilable_i_patches.remove(i_patch)
+    emitter.normal(f"{len(compilable_i_patches)} compilable patches fall into"
+                   f" {len(equivalent_i_patch_groups)} classes of equivalent bytecode")
 
     if not execute_tests:
-        return [], non_compilable_i_patches
+        return [], non_compilable_i_patches, noop_i_patches
 
     if values.use_hotswap:
         raise NotImplementedError("UniAPR validation for indexed patches & tests has not been implemented")
-    else:
-        return plain_validate(compilable_i_patches, indexed_tests, dir_execution, use_d4j_instr), non_compilable_i_patches
+
+    # validate one representative of each class, and copy its result to the other patches in the class
+    group_for_representative = {group[0]: group for group in equivalent_i_patch_groups}
+    result = []
+    for representative, passing_i_tests, failing_i_tests in plain_validate(group_for_representative.keys(),
+                                                                           indexed_tests, dir_execution,
+                                                                           use_d4j_instr, deadline):
+        for i_patch in group_for_representative[representative]:
+            result.append((i_patch, passing_i_tests, failing_i_tests))
+    return result, non_compilable_i_patches, noop_i_patches
+
+
+def compile_indexed_patches(indexed_patches, dir_patches_bin, deadline):
+    """
+    Compile the patches that have not been compiled yet, linking their class files into `dir_patches_bin`.
+
+    :return: list of patches that do not compile
+    """
+    non_compilable_i_patches = []
+
+    emitter.normal("Compiling patches")
+    for i_patch in indexed_patches:
+        if i_patch not in indexed_patch_to_bin_dir:
+            index = i_patch.get_index()
+            out_dir = Path(dir_patches_bin, f"gen_{index.generation}_{index.key}")
+
+            assert not out_dir.exists(), f"{str(out_dir)} already exists"
+
+            # compiled class files are shared by all patches with the same normalized diff on the same base build
+            key = artifact_store.digest_strings(i_patch.patch.get_diff_digest(),
+                                                artifact_store.build_fingerprint())
+            cached = artifact_store.store.lookup("patches_bin", key) is not None
+            try:
+                with profiler.span(f"compile {i_patch.get_index_str()}", "patch"):
+                    bin_dir = artifact_store.store.obtain(
+                        "patches_bin", key, lambda out_dir: i_patch.patch.compile(out_dir, deadline=deadline))
+            except DeadlineExceeded:
+                raise
+            except Exception:
+                non_compilable_i_patches.append(i_patch)
+                emitter.warning(f"{str(i_patch)} does not compile")
+                emitter.warning(traceback.format_exc())
+                continue
+            if cached:
+                emitter.normal(f"\treusing compiled {str(i_patch)} from {str(bin_dir)}")
+
+            os.symlink(bin_dir, out_dir)
+            indexed_patch_to_bin_dir[i_patch] = str(bin_dir)
+
+    return non_compilable_i_patches
+
+
+def screen_patches(indexed_patches, work_dir, deadline=None):
+    """
+    Compile the patches and group them by equivalent bytecode, without running tests; the compiled patches are
+    reused by later `validate` calls. Used to drop patches that need no tests before tests are generated for them.
+
+    :return: list of patches that do not compile; list of patches equivalent to the original program;
+             list of groups of the other patches (see `group_equivalent_patches`)
+    :raise DeadlineExceeded: if `deadline` (default: of the run) passes while compiling
+    """
+    if deadline is None:
+        deadline = Deadline.of_run()
+    dir_patches_bin = Path(work_dir, "patches_bin")
+    os.makedirs(dir_patches_bin, exist_ok=True)
+
+    non_compilable_i_patches = compile_indexed_patches(indexed_patches, dir_patches_bin, deadline)
+    compilable_i_patches = set(indexed_patches).difference(non_compilable_i_patches)
+    equivalent_i_patch_groups, noop_i_patches = group_equivalent_patches(compilable_i_patches)
+    for i_patch in noop_i_patches:
+        emitter.warning(f"{str(i_patch)} compiles to the same bytecode as the original program")
+    return non_compilable_i_patches, noop_i_patches, equivalent_i_patch_groups
+
+
+def group_equivalent_patches(indexed_patches):
+    """
+    Group compiled patches whose class files are equal modulo debug information.
+
+    :return: list of groups, each a list of patches sorted by index; list of patches whose class files are equal
+             to those of the original program modulo debug information
+    """
+    groups = defaultdict(list)
+    noop_i_patches = []
+
+    for i_patch in sorted(indexed_patches, key=lambda x: x.get_index()):
+        bin_dir = indexed_patch_to_bin_dir[i_patch]
+        try:
+            if bin_dir not in bin_dir_to_class_hashes:
+                bin_dir_to_class_hashes[bin_dir] = bytecode.class_hashes(bin_dir)
+            class_hashes = bin_dir_to_class_hashes[bin_dir]
+        except bytecode.ClassFileError:
+            emitter.warning(f"cannot hash class files of {str(i_patch)}; it is not grouped with other patches")
+            emitter.warning(traceback.format_exc())
+            groups[bin_dir].append(i_patch)
+            continue
+
+        if all(class_hash == get_original_class_hash(relative_path)
+               for relative_path, class_hash in class_hashes.items()):
+            noop_i_patches.append(i_patch)
+        else:
+            groups[bytecode.digest_class_hashes(class_hashes)].append(i_patch)
+
+    return list(groups.values()), noop_i_patches
+
+
+def get_original_class_hash(relative_path):
+    if relative_path not in original_class_hashes:
+        class_file = Path(values.dir_info["classes"], relative_path)
+        try:
+            class_hash = bytecode.normalized_class_hash(class_file) if class_file.is_file() else None
+        except bytecode.ClassFileError:
+            class_hash = None
+        original_class_hashes[relative_path] = class_hash
+    return original_class_hashes[relative_path]
 
 
-def plain_validate(indexed_patches, indexed_tests, work_dir, use_d4j_instr):
+def plain_validate(indexed_patches, indexed_tests, work_dir, use_d4j_instr, deadline):
     assert os.path.isabs(work_dir), str(work_dir)
     assert utilities.is_empty_dir(work_dir), str(work_dir)
 
@@ -144,7 +283,7 @@ def plain_validate(indexed_patches, indexed_tests, work_dir, use_d4j_instr):
 
     indexed_patches_list = list(indexed_patches)
     for index, i_patch in enumerate(indexed_patches_list):
-        if utilities.timed_out():
+        if deadline.expired():
             result.extend([(i_patch, [], []) for i_patch in indexed_patches_list[index:]])
             break
 
@@ -153,29 +292,37 @@ def plain_validate(indexed_patches, indexed_tests, work_dir, use_d4j_instr):
 
         patch_bin_dir = indexed_patch_to_bin_dir[i_patch]
 
-        for i_suite_group in i_suite_groups:
-            validator_run_count += 1
+        with profiler.span(i_patch.get_index_str(), "patch"):
+            for i_suite_group in i_suite_groups:
+                validator_run_count += 1
 
-            suites_bin_dirs = [indexed_suite_to_bin_dir[i_suite] for i_suite in i_suite_group]
+                suites_bin_dirs = [indexed_suite_to_bin_dir[i_suite] for i_suite in i_suite_group]
 
-            suites_runtime_deps = set(map(os.path.abspath,
-                                          itertools.chain(
-                                              *[i_suite.suite.runtime_deps for i_suite in i_suite_group])))
+                suites_runtime_deps = set(map(os.path.abspath,
+                                              itertools.chain(
+                                                  *[i_suite.suite.runtime_deps for i_suite in i_suite_group])))
 
-            i_test_group = itertools.chain(*[i_suite_2_i_tests[i_suite] for i_suite in i_suite_group])
+                i_test_group = list(itertools.chain(*[i_suite_2_i_tests[i_suite] for i_suite in i_suite_group]))
 
-            name2itest = {f"{it.indexed_suite.suite.junit_class}#{it.method_name}": it for it in i_test_group}
+                # names are unique within a group, but not across groups (nor in `interning.tests`)
+                name2itest = {it.get_full_test_name(): it for it in i_test_group}
+                test_names = list(name2itest.keys())
 
-            test_names_file = Path(work_dir, f"tests{validator_run_count}.txt")
+                test_names_file = Path(work_dir, f"tests{validator_run_count}.txt")
 
-            message = asyncio.run(
-                run_plain_validator(patch_bin_dir, suites_bin_dirs, suites_runtime_deps, list(name2itest.keys()),
-                                    test_names_file, use_d4j_instr))
+                message = asyncio.run(
+                    run_plain_validator(patch_bin_dir, suites_bin_dirs, suites_runtime_deps, test_names,
+                                        test_names_file, use_d4j_instr, deadline))
 
-            obj = json.loads(message)
+                obj = json.loads(message)
 
-            passing_i_tests.extend([name2itest[name] for name in obj["passingTests"]])
-            failing_i_tests.extend([name2itest[name] for name in obj["failingTests"]])
+                for names, i_tests in (obj["passingTests"], passing_i_tests), (obj["failingTests"], failing_i_tests):
+                    known_i_tests = [name2itest[name] for name in names if name in name2itest]
+                    unknown_names = [name for name in names if name not in name2itest]
+                    if unknown_names:
+                        emitter.warning(f"ignoring {len(unknown_names)} unknown tests reported by the validator"
+                                        f" for {str(i_patch)}, e.g. {unknown_names[0]}")
+                    i_tests.extend(known_i_tests)
 
         result.append((i_patch, passing_i_tests, failing_i_tests))
 
@@ -183,7 +330,7 @@ def plain_validate(indexed_patches, indexed_tests, work_dir, use_d4j_instr):
 
 
 async def run_plain_validator(patch_bin_dir, suites_bin_dirs, suites_runtime_deps, full_test_names,
-                              test_names_file, use_d4j_instr):
+                              test_names_file, use_d4j_instr, deadline):
     assert os.path.isabs(patch_bin_dir), str(patch_bin_dir)
     assert utilities.is_nonempty_dir(patch_bin_dir), str(patch_bin_dir)
     for x in suites_bin_dirs:
@@ -246,23 +393,24 @@ async def run_plain_validator(patch_bin_dir, suites_bin_dirs, suites_runtime_dep
 
         empty_result = json.dumps({"passingTests": [], "failingTests": []})
 
-        if utilities.timed_out():
+        if deadline.expired():
             return empty_result
 
         emitter.command(command)
         emitter.normal(f"running {len(full_test_names)} test cases")
 
-        process = await asyncio.create_subprocess_shell(command, stdout=DEVNULL, stderr=PIPE)
+        # the server keeps running on the event loop while PlainValidator is waited for in another thread
         try:
-            timeout = (values.time_system_end - time.time()) if values.time_system_end is not None else None
-            return_code = await asyncio.wait_for(process.wait(), timeout=timeout)
-            if return_code != 0:
-                stderr = await process.stderr.read()
-                utilities.error_exit("PlainValidator did not exit normally", stderr.decode("utf-8"),
-                                    f"exit code is {return_code}")
-        except asyncio.TimeoutError:
-            process.kill()
+            process = await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(executor.run, shlex.split(command), "PlainValidator", deadline=deadline,
+                                        priority=executor.current_priority(), parent=profiler.current(),
+                                        stdout=DEVNULL, stderr=PIPE))
+        except DeadlineExceeded:
             emitter.normal("stopped test running because of global timeout")
             return empty_result
+        return_code = process.returncode
+        if return_code != 0:
+            utilities.error_exit("PlainValidator did not exit normally", process.stderr.decode("utf-8"),
+                                 f"exit code is {return_code}")
 
     return result[0]
@@ -34,6 +34,14 @@ init_ratio_fame = 0
 num_perfect_patches = 10
 patch_gen_timeout = 1200
 test_gen_timeout = 60
+test_gen_jobs = 0
+max_cpus = 0
+max_memory = 0  # MiB
+use_evosuite_worker = False  # not exposed until extern/evosuite-worker is built and tested with EvoSuite
+minimize_tests = False
+fl_top_k = None
+pipelined = False
+resume = False
 num_iterations = 0
 dry_run_repair = False
 dry_run_test_gen = False
@@ -58,6 +66,7 @@ dir_tmp = _dir_root + "/tmp"
 dir_backup = _dir_root + "/backup"
 dir_tools = _dir_root + "/tools"
 dir_data = _dir_root + "/data"
+dir_cache = _dir_root + "/cache"
 
 # ------------------- Files --------------------
 file_log_main = ""
@@ -76,8 +85,10 @@ tool_name = "EvoRepair"
 iteration_no = 0
 count_patch_gen = 0
 dir_info = dict()
+build_fingerprint = None
 
 # ------------------- Time Durations --------------------
 time_system_start = 0
 time_system_end = 0
+time_elapsed_before_resume = 0  # seconds used by earlier runs of a resumed run
 total_timeout = 0
@@ -0,0 +1,171 @@
+package evorepair;
+
+import com.google.gson.Gson;
+
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.OutputStreamWriter;
+import java.io.PrintWriter;
+import java.io.StringWriter;
+import java.lang.reflect.Method;
+import java.net.Socket;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.Paths;
+import java.util.ArrayList;
+import java.util.Arrays;
+import java.util.List;
+import java.util.stream.Collectors;
+import java.util.stream.Stream;
+
+/**
+ * Long-running EvoSuite process that takes generation jobs over a local socket.
+ *
+ * The worker connects to the port given as the only argument, then reads one JSON job per line:
+ *     {"args": ["-class", "foo.Bar", ...], "baseDir": "/path/to/output"}
+ * For each job, it runs EvoSuite in this JVM with the given command line arguments, and replies one JSON line:
+ *     {"status": "ok" | "error", "message": "...", "files": ["/path/to/output/evosuite-tests/...", ...]}
+ * The worker exits when the connection is closed.
+ *
+ * The client of EvoSuite always runs in this JVM, and the project classpath is loaded once and kept for the jobs
+ * that give the same -projectCP.
+ */
+public final class EvoSuiteWorker {
+    private static final String CLIENT_ON_THREAD = "-Dclient_on_thread=true";
+
+    private static String loadedProjectCP = null;  // -projectCP of the loaded project classpath
+    private static String loadedTargetCP = null;  // the loaded project classpath, as EvoSuite keeps it
+
+    public static void main(String[] args) {
+        // EvoSuite reads this before starting the client, which must run in this JVM to be reused
+        System.setProperty("client_on_thread", "true");
+
+        Socket socket = null;
+        try {
+            socket = new Socket("localhost", Integer.parseInt(args[0]));
+        } catch (Exception e) {
+            e.printStackTrace();
+            System.exit(-1);
+        }
+
+        Gson gson = new Gson();
+        try (BufferedReader in = new BufferedReader(
+                     new InputStreamReader(socket.getInputStream(), StandardCharsets.UTF_8));
+             PrintWriter out = new PrintWriter(
+                     new OutputStreamWriter(socket.getOutputStream(), StandardCharsets.UTF_8), true)) {
+            Class<?> evoSuiteClass = Class.forName("org.evosuite.EvoSuite");
+            Method parseCommandLine = evoSuiteClass.getMethod("parseCommandLine", String[].class);
+
+            String line;
+            while ((line = in.readLine()) != null) {
+                Job job = gson.fromJson(line, Job.class);
+                Reply reply = new Reply();
+                try {
+                    resetEvoSuite();
+                    String[] jobArgs = withClientOnThread(useLoadedProjectClassPath(job.args));
+                    parseCommandLine.invoke(evoSuiteClass.getConstructor().newInstance(), (Object) jobArgs);
+                    reply.status = "ok";
+                } catch (Throwable t) {
+                    StringWriter trace = new StringWriter();
+                    t.printStackTrace(new PrintWriter(trace));
+                    reply.status = "error";
+                    reply.message = trace.toString();
+                }
+                reply.files = listTestFiles(job.baseDir);
+                out.println(gson.toJson(reply));
+            }
+        } catch (Exception e) {
+            e.printStackTrace();
+            System.exit(-1);
+        }
+        System.exit(0);
+    }
+
+    /**
+     * Clear the static state that EvoSuite keeps from a previous job, if the EvoSuite version supports it.
+     */
+    private static void resetEvoSuite() throws Exception {
+        invokeIfPresent("org.evosuite.Properties", "resetToDefaults");
+        invokeIfPresent("org.evosuite.TestGenerationContext", "resetContext");
+    }
+
+    /**
+     * Resetting the properties of EvoSuite turns client_on_thread off again; turn it on for every job, or EvoSuite
+     * starts a client JVM per job.
+     */
+    private static String[] withClientOnThread(String[] args) {
+        List<String> result = new ArrayList<>();
+        result.add(CLIENT_ON_THREAD);
+        result.addAll(Arrays.asList(args));
+        return result.toArray(new String[0]);
+    }
+
+    /**
+     * Load the project classpath of a job into EvoSuite, unless it is the one loaded for a previous job, and take
+     * -projectCP out of the arguments so that EvoSuite does not process it again. If the EvoSuite version does not
+     * allow this, the arguments are returned as they are.
+     */
+    private static String[] useLoadedProjectClassPath(String[] args) {
+        int index = Arrays.asList(args).indexOf("-projectCP");
+        if (index < 0 || index + 1 >= args.length) {
+            return args;
+        }
+        String projectCP = args[index + 1];
+        try {
+            Class<?> handlerClass = Class.forName("org.evosuite.classpath.ClassPathHandler");
+            Object handler = handlerClass.getMethod("getInstance").invoke(null);
+            Method getTargetCP = handlerClass.getMethod("getTargetProjectClasspath");
+            if (!projectCP.equals(loadedProjectCP) || !getTargetCP.invoke(handler).equals(loadedTargetCP)) {
+                handlerClass.getMethod("changeTargetClassPath", String[].class)
+                        .invoke(handler, (Object) projectCP.split(File.pathSeparator));
+                loadedProjectCP = projectCP;
+                loadedTargetCP = (String) getTargetCP.invoke(handler);
+            }
+            // cleared by resetting the properties
+            Class.forName("org.evosuite.Properties").getField("CP").set(null, loadedTargetCP);
+        } catch (ReflectiveOperationException | RuntimeException e) {
+            loadedProjectCP = null;
+            loadedTargetCP = null;
+            return args;
+        }
+        List<String> result = new ArrayList<>(Arrays.asList(args));
+        result.subList(index, index + 2).clear();
+        return result.toArray(new String[0]);
+    }
+
+    private static void invokeIfPresent(String className, String methodName) throws Exception {
+        Class<?> clazz = Class.forName(className);
+        Object instance = clazz.getMethod("getInstance").invoke(null);
+        try {
+            clazz.getMethod(methodName).invoke(instance);
+        } catch (NoSuchMethodException e) {
+            // nothing to reset
+        }
+    }
+
+    private static List<String> listTestFiles(String baseDir) {
+        Path testDir = Paths.get(baseDir, "evosuite-tests");
+        if (!Files.isDirectory(testDir)) {
+            return new ArrayList<>();
+        }
+        try (Stream<Path> paths = Files.walk(testDir)) {
+            return paths.filter(Files::isRegularFile).map(Path::toString).collect(Collectors.toList());
+        } catch (IOException e) {
+            return new ArrayList<>();
+        }
+    }
+}
+
+class Job {
+    String[] args;
+    String baseDir;
+}
+
+class Reply {
+    String status;
+    String message;
+    List<String> files;
+}
@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 
+import argparse
+import csv
+import json
 import os
 from pathlib import Path
+import signal
 import subprocess
 from subprocess import DEVNULL
 import shutil
@@ -13,13 +17,56 @@ import sys
 
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 
+DEFAULT_CPUS_PER_JOB = 2
+DEFAULT_MEMORY_PER_JOB = 8192  # MiB
+TERMINATION_GRACE = 60  # seconds for the jobs to stop their tools after SIGTERM
+
+
+class Job:
+    def __init__(self, subject, seed):
+        self.subject = subject
+        self.seed = seed
+        self.dir_output = None
+        self.cpus = []
+        self.popen = None
+        self.start = None
+        self.end = None
+        self.exit_code = None
+        self.status = "not started"
+
+    def __str__(self):
+        return f"{self.subject},{self.seed}"
+
+    def to_dict(self):
+        return {
+            "subject": self.subject,
+            "seed": self.seed,
+            "status": self.status,
+            "exit_code": self.exit_code,
+            "start": datetime.fromtimestamp(self.start).isoformat() if self.start is not None else None,
+            "duration": round(self.end - self.start, 1) if self.end is not None else None,
+            "cpus": " ".join(str(x) for x in self.cpus),
+            "dir_output": str(self.dir_output) if self.dir_output is not None else None
+        }
+
+
+def output_dir_for_subject(out_dir_base, subject, taken_dirs):
+    time = datetime.now(tz=timezone(offset=timedelta(hours=8))).strftime("%y%m%d_%H%M%S")
+    dir_output = Path(SCRIPT_DIR, out_dir_base, f"{subject}-{time}")
+    # jobs of a same subject may be launched within a second, before they create their output directories
+    n = 1
+    while dir_output.exists() or dir_output in taken_dirs:
+        n += 1
+        dir_output = Path(SCRIPT_DIR, out_dir_base, f"{subject}-{time}_{n}")
+    return dir_output
+
 
-def command_for_subject(out_dir_base, subject, seed):
+def command_for_subject(dir_output, subject, seed, cpus, memory):
     python = shutil.which("python3")
     config_file = Path("d4j-subjects", subject, "config.json")
-    time = datetime.now(tz=timezone(offset=timedelta(hours=8))).strftime("%y%m%d_%H%M%S")
-    dir_output = Path(SCRIPT_DIR, out_dir_base, f"{subject}-{time}")
     command = f"{python} Repair.py -d --config {str(config_file)} --dir-output {str(dir_output)} --random-seed {seed}"
+    # the tools of a job share the resources given to the job
+    command += f" --max-cpus {cpus} --max-memory {memory}"
     # test filtering for time-4, 11, 14 is flaky due to static initialization
     # have to turn off before that is fixed
     if subject.startswith("time"):
@@ -27,15 +74,90 @@ def command_for_subject(out_dir_base, subject, seed):
     return command
 
 
+def detect_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def detect_memory():
+    """
+    :return: available memory in MiB, bounded by the limit of the cgroup if any; None if unknown
+    """
+    memory = None
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    memory = int(line.split()[1]) // 1024
+                    break
+    except OSError:
+        pass
+    for limit_file in "/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes":
+        try:
+            with open(limit_file) as f:
+                limit = f.read().strip()
+        except OSError:
+            continue
+        if limit.isdigit():
+            limit = int(limit) // (1024 * 1024)
+            memory = min(memory, limit) if memory is not None else limit
+        break
+    return memory
+
+
+SUMMARY_FIELDS = ["subject", "seed", "status", "exit_code", "start", "duration", "cpus", "dir_output"]
+
+
+def write_summary(out_dir_base, jobs):
+    """
+    Write the status of all jobs to summary.csv and summary.json in `out_dir_base`; rewritten whenever a job starts
+    or ends, so that it is up-to-date while the batch runs.
+    """
+    rows = [job.to_dict() for job in jobs]
+
+    tmp_path = Path(out_dir_base, ".summary.csv")
+    with open(tmp_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, Path(out_dir_base, "summary.csv"))
+
+    tmp_path = Path(out_dir_base, ".summary.json")
+    with open(tmp_path, 'w') as f:
+        json.dump(rows, f, indent=1)
+    os.replace(tmp_path, Path(out_dir_base, "summary.json"))
+
+
+def decode_wait_status(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description="Run subjects in parallel, as many at a time as the machine fits.")
+    parser.add_argument("out_dir_base")
+    parser.add_argument("tasks", nargs="*", metavar="subject[,seed]")
+    parser.add_argument("--cpus-per-job", type=int, default=DEFAULT_CPUS_PER_JOB,
+                        help="CPUs each job is pinned to")
+    parser.add_argument("--memory-per-job", type=int, default=DEFAULT_MEMORY_PER_JOB,
+                        help="memory in MiB each job may use")
+    parser.add_argument("--max-jobs", type=int, default=0,
+                        help="maximum number of jobs at a time; 0 means as many as the CPUs and memory fit")
+    return parser.parse_args(args)
+
+
 def main(*args):
     if not args:
         print(f"Usage: {sys.argv[0]} out_dir_base subject1[,seed1] subject2[,seed2] ...")
         sys.exit(0)
 
-    out_dir_base = args[0]
+    parsed_args = parse_args(args)
+    out_dir_base = parsed_args.out_dir_base
 
     task_list = []
-    for task in args[1:]:
+    for task in parsed_args.tasks:
         tmp = task.split(",")
         subject = tmp[0]
         if len(tmp) == 1:
@@ -44,45 +166,84 @@ def main(*args):
             seed = int(tmp[1])
         else:
             raise ValueError(f"Unknown task: {task}")
-        task_list.append((subject, seed))
+        task_list.append(Job(subject, seed))
 
     if task_list:
         os.makedirs(out_dir_base, exist_ok=True)
     else:
         sys.exit(0)
 
-    print(f"{len(task_list)} tasks in total: {' '.join([f'{subject},{seed}' for subject, seed in task_list])}")
-
-    n_parallel = 1
-    
-    popen_for_subject = {}
-    while task_list or popen_for_subject:
-        poll_for_subject = {subject: popen.poll() for subject, popen in popen_for_subject.items()}
-
-        live_count = 0
-        for subject, poll in poll_for_subject.items():
-            if poll is None:
-                live_count += 1
-            else:
-                print(f"{'Finished' if poll == 0 else 'Crashed'}: {subject} {poll}")
-                popen_for_subject.pop(subject)
-        if live_count == n_parallel:
-            time.sleep(60)
-            continue
-
-        for _ in range(n_parallel - live_count):
-            if task_list:
-                subject, seed = task_list.pop(0)
-                command = command_for_subject(out_dir_base, subject, seed)
-                p = subprocess.Popen(shlex.split(command), shell=False, stdout=DEVNULL, stderr=DEVNULL)
-                print(f"Launched {subject} (pid={p.pid}): {command}")
-                popen_for_subject[subject] = p
-                time.sleep(20)
-            else:
-                print("All subjects lauched; wait for 60s...")
-                time.sleep(60)
-                break
-    print("Done")
+    print(f"{len(task_list)} tasks in total: {' '.join([str(job) for job in task_list])}")
+
+    free_cpus = detect_cpus()
+    cpus_per_job = max(min(parsed_args.cpus_per_job, len(free_cpus)), 1)
+    free_memory = detect_memory()
+    memory_per_job = parsed_args.memory_per_job
+    if free_memory is not None:
+        memory_per_job = min(memory_per_job, free_memory)
+    n_parallel = len(free_cpus) // cpus_per_job
+    if free_memory is not None:
+        n_parallel = min(n_parallel, max(free_memory // memory_per_job, 1))
+    if parsed_args.max_jobs > 0:
+        n_parallel = min(n_parallel, parsed_args.max_jobs)
+    n_parallel = max(n_parallel, 1)
+    print(f"{len(free_cpus)} CPUs and {free_memory if free_memory is not None else 'unknown'} MiB available;"
+          f" running at most {n_parallel} jobs at a time, each with {cpus_per_job} CPUs and {memory_per_job} MiB")
+
+    jobs = list(task_list)
+    job_for_pid = {}
+    write_summary(out_dir_base, jobs)
+    try:
+        while task_list or job_for_pid:
+            while task_list and len(job_for_pid) < n_parallel and len(free_cpus) >= cpus_per_job:
+                job = task_list.pop(0)
+                job.cpus, free_cpus = free_cpus[:cpus_per_job], free_cpus[cpus_per_job:]
+                job.dir_output = output_dir_for_subject(out_dir_base, job.subject, [x.dir_output for x in jobs])
+                command = command_for_subject(job.dir_output, job.subject, job.seed, cpus_per_job, memory_per_job)
+                cpu_set = set(job.cpus)
+                # a session of its own, so that the job and its tools can be stopped together
+                job.popen = subprocess.Popen(shlex.split(command), shell=False, stdout=DEVNULL, stderr=DEVNULL,
+                                             start_new_session=True,
+                                             preexec_fn=lambda: os.sched_setaffinity(0, cpu_set))
+                job.start = time.time()
+                job.status = "running"
+                job_for_pid[job.popen.pid] = job
+                print(f"Launched {job.subject} (pid={job.popen.pid}, cpus={job.cpus}): {command}")
+                write_summary(out_dir_base, jobs)
+
+            # block until any job exits
+            pid, status = os.wait()
+            job = job_for_pid.pop(pid, None)
+            if job is None:
+                continue
+            job.end = time.time()
+            job.exit_code = job.popen.returncode = decode_wait_status(status)
+            job.status = "finished" if job.exit_code == 0 else "crashed"
+            free_cpus = sorted(free_cpus + job.cpus)
+            print(f"{job.status.capitalize()}: {job.subject} {job.exit_code}"
+                  f" after {(job.end - job.start) / 60:.1f} minutes")
+            write_summary(out_dir_base, jobs)
+    except KeyboardInterrupt:
+        print(f"Stopping {len(job_for_pid)} running jobs...")
+        for pid, job in job_for_pid.items():
+            try:
+                # Repair.py stops its tools on SIGTERM
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        time_to_stop = time.time() + TERMINATION_GRACE
+        for pid, job in job_for_pid.items():
+            try:
+                job.popen.wait(max(time_to_stop - time.time(), 0))
+            except subprocess.TimeoutExpired:
+                os.killpg(pid, signal.SIGKILL)
+                job.popen.wait()
+            job.end = time.time()
+            job.exit_code = job.popen.returncode
+            job.status = "killed"
+        write_summary(out_dir_base, jobs)
+        sys.exit(1)
+    print(f"Done; see {str(Path(out_dir_base, 'summary.csv'))}")
 
 
 if __name__ == '__main__':
@@ -22,4 +22,8 @@ echo "Setting up validator..."
 (set -x; cd ${EXTERN_DIR}/plain-validator; mvn clean package -DskipTests -q)
 echo -e "Done.\n"
 
+echo "Setting up EvoSuite worker..."
+(set -x; cd ${EXTERN_DIR}/evosuite-worker; mvn clean package -DskipTests -q)
+echo -e "Done.\n"
+
 echo "EvoRepair successfully set up."
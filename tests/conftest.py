@@ -0,0 +1,16 @@
+import pytest
+
+from app import logger, values
+
+
+@pytest.fixture
+def log_files(tmp_path, monkeypatch):
+    """
+    Send the logs of the code under test to a temporary directory.
+    """
+    monkeypatch.setattr(values, "dir_log_base", str(tmp_path))
+    monkeypatch.setattr(values, "file_log_error", str(tmp_path / "log-error"))
+    monkeypatch.setattr(values, "file_log_cmd", str(tmp_path / "log-command"))
+    monkeypatch.setattr(values, "file_log_build", str(tmp_path / "log-build"))
+    monkeypatch.setattr(values, "silence_emitter", True)
+    logger.create_log_files()
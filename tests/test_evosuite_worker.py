@@ -0,0 +1,24 @@
+from app import evosuite_worker, executor
+
+
+class FakeWorker:
+    def __init__(self):
+        self.closed = False
+
+    def is_alive(self):
+        return not self.closed
+
+    def close(self):
+        self.closed = True
+
+
+def test_idle_pool_is_capped_at_what_the_budget_holds(monkeypatch):
+    monkeypatch.setattr(executor, "_budget", executor.Budget(8, 2 * evosuite_worker.MEMORY_MB))
+    monkeypatch.setattr(evosuite_worker, "_idle_workers", [])
+
+    workers = [FakeWorker() for _ in range(3)]
+    for worker in workers:
+        evosuite_worker.release(worker)
+
+    assert evosuite_worker._idle_workers == workers[:2]
+    assert [worker.closed for worker in workers] == [False, False, True]
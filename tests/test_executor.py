@@ -0,0 +1,32 @@
+import pytest
+
+from app import executor
+
+
+class Started(Exception):
+    pass
+
+
+@pytest.fixture
+def started_args(monkeypatch):
+    result = []
+
+    def popen(args, name, **kwargs):
+        result.append(args)
+        raise Started()
+
+    monkeypatch.setattr(executor.profiler, "popen", popen)
+    monkeypatch.setattr(executor, "_budget", executor.Budget(4, 8192))
+    return result
+
+
+def test_heap_is_only_set_from_a_given_reservation(started_args):
+    with pytest.raises(Started):
+        executor.popen(["java", "-jar", "arja.jar"], "ARJA")
+    with pytest.raises(Started):
+        executor.popen(["java", "-jar", "evosuite.jar"], "EvoSuite", memory_mb=1024)
+
+    assert started_args == [["java", "-jar", "arja.jar"], ["java", f"-Xmx{int(1024 * executor.JVM_HEAP_RATIO)}m",
+                                                           "-jar", "evosuite.jar"]]
+    budget = executor.get_budget()
+    assert budget.free_memory_mb == budget.memory_mb
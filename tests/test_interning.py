@@ -0,0 +1,13 @@
+from app.interning import Interner
+
+
+def test_objects_of_keys_skips_unknown_keys():
+    interner = Interner()
+    interner.register(interner.id_of("Foo#test1"), "test1")
+    interner.id_of("Foo#test2")  # interned, but without an object
+
+    objects, unknown_keys = interner.objects_of_keys(["Foo#test1", "Foo#test2", "Foo#test3"])
+
+    assert objects == ["test1"]
+    assert unknown_keys == ["Foo#test2", "Foo#test3"]
+    assert interner.object_of_key("Foo#test3") is None
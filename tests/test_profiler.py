@@ -0,0 +1,17 @@
+import os
+import sys
+
+from app import profiler
+
+
+def test_process_reaped_elsewhere_is_not_reported_as_success():
+    with profiler.span("run", "test") as parent:
+        process = profiler.popen([sys.executable, "-c", "pass"], "python")
+        os.waitpid(process.pid, 0)  # reaped behind the back of the profiler
+
+        assert profiler.wait(process) == profiler.UNKNOWN_RETURNCODE
+        assert profiler.poll(process) == profiler.UNKNOWN_RETURNCODE
+
+    process_span, = parent.children
+    assert process_span.end is not None
+    assert process_span.args["returncode"] == profiler.UNKNOWN_RETURNCODE
@@ -0,0 +1,156 @@
+import random
+from collections import defaultdict
+
+import pytest
+
+from app import interning, spectra_store
+from app.spectra import FLAlgorithm, Location, Spectra, _SpectraBase
+from app.spectra import TestCount as Count  # not collected by pytest
+
+
+class ReferenceSpectra:
+    """
+    Spectra as they were computed before tests and locations were interned and grouped into equivalence classes:
+    every test is counted against every location.
+    """
+
+    def __init__(self):
+        self.test_results = {}
+        self.tests_for_location = defaultdict(set)
+        self.locations_for_test = defaultdict(set)
+
+    def update(self, spectra_file):
+        with open(spectra_file) as f:
+            for line in f:
+                tmp = line.strip().split(",")
+                test, result = tmp[0], tmp[1]
+                locations = []
+                for x in tmp[2:]:
+                    class_name, line_number = x.split(":")
+                    locations.append(Location(class_name, int(line_number)))
+                assert self.test_results.setdefault(test, result) == result
+                for location in locations:
+                    self.tests_for_location[location].add(test)
+                self.locations_for_test[test].update(locations)
+
+    def restrict(self, tests):
+        result = ReferenceSpectra()
+        result.test_results = {test: self.test_results[test] for test in tests}
+        result.tests_for_location = {loc: self.tests_for_location[loc] & tests for loc in self.tests_for_location}
+        result.locations_for_test = {test: self.locations_for_test[test] for test in tests}
+        return result
+
+    def get_susp_values(self, ignored_tests=()):
+        num_passing = num_failing = 0
+        ex_pass = dict.fromkeys(self.tests_for_location, 0)
+        ex_fail = dict.fromkeys(self.tests_for_location, 0)
+        for test, result in self.test_results.items():
+            if test in ignored_tests:
+                continue
+            if result == "PASS":
+                num_passing += 1
+            else:
+                num_failing += 1
+            for loc in self.locations_for_test[test]:
+                (ex_pass if result == "PASS" else ex_fail)[loc] += 1
+        return {loc: FLAlgorithm.ochiai(Count(ex_pass[loc], ex_fail[loc],
+                                              num_passing - ex_pass[loc], num_failing - ex_fail[loc]))
+                for loc in self.tests_for_location}
+
+    def get_failing_locations(self):
+        return set(loc for test, result in self.test_results.items() if result == "FAIL"
+                   for loc in self.locations_for_test[test])
+
+
+def random_spectra_files(rng, directory, trial):
+    locations = [f"foo.Bar{rng.randrange(3)}:{rng.randrange(1, 30)}" for _ in range(rng.randrange(1, 25))]
+    tests = [f"foo.BarTest{trial}#test{i}" for i in range(rng.randrange(1, 40))]
+    results = {test: rng.choice(["PASS", "PASS", "FAIL"]) for test in tests}
+    files = []
+    for n in range(rng.randrange(1, 4)):
+        path = directory / f"spectra{trial}_{n}.csv"
+        with open(path, 'w') as f:
+            for test in rng.sample(tests, rng.randrange(1, len(tests) + 1)):
+                covered = rng.sample(locations, rng.randrange(0, min(len(locations), 6) + 1))
+                f.write(",".join([test, results[test], *covered]) + "\n")
+        files.append(path)
+    return tests, files
+
+
+def read_susp_values(path):
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert lines[0] == "<className{#lineNumber,suspValue"
+    return [line[1:] for line in lines[1:]]
+
+
+def expected_susp_values(susp_values):
+    return [f"{loc.class_name}{{#{loc.line_number},{value}" for loc, value in sorted(susp_values.items(), reverse=True)]
+
+
+def read_tests(path):
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert lines[0] == "name,outcome"
+    result = {}
+    for line in lines[1:]:
+        test, outcome, *locations = line.split(",")
+        result[test] = (outcome, set(locations))
+    return result
+
+
+def expected_tests(reference):
+    return {test: (result, set(f"{loc.class_name}:{loc.line_number}" for loc in reference.locations_for_test[test]))
+            for test, result in reference.test_results.items()}
+
+
+def check_same(spectra, reference, tmp_path, ignored_tests):
+    ids = set(interning.tests.id_of(test) for test in ignored_tests)
+
+    try:
+        susp_values = reference.get_susp_values(ignored_tests)
+    except ZeroDivisionError:
+        # Ochiai is undefined if a location is covered but no test fails
+        with pytest.raises(ZeroDivisionError):
+            spectra.write_susp_values(tmp_path / "susp.csv", ignored_tests=ids)
+    else:
+        spectra.write_susp_values(tmp_path / "susp.csv", ignored_tests=ids)
+        assert read_susp_values(tmp_path / "susp.csv") == expected_susp_values(susp_values)
+
+    spectra.write_tests(tmp_path / "tests.csv")
+    assert read_tests(tmp_path / "tests.csv") == expected_tests(reference)
+
+    assert ({interning.locations.key_of(loc) for loc in spectra.get_failing_locations()}
+            == reference.get_failing_locations())
+
+
+def test_spectra_base_is_abstract():
+    with pytest.raises(TypeError):
+        _SpectraBase()
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_spectra_agree_with_reference(tmp_path, binary):
+    rng = random.Random(2022)
+    for trial in range(100):
+        tests, files = random_spectra_files(rng, tmp_path, trial)
+
+        spectra = Spectra()
+        reference = ReferenceSpectra()
+        for path in files:
+            if binary:
+                spectra_store.convert_csv(path)
+            spectra.update(path)
+            reference.update(path)
+
+        ignored_tests = set(rng.sample(tests, rng.randrange(0, len(tests) + 1)))
+        check_same(spectra, reference, tmp_path, ignored_tests)
+
+        kept_tests = set(rng.sample(sorted(reference.test_results), rng.randrange(0, len(reference.test_results) + 1)))
+        view = spectra.restrict(set(interning.tests.id_of(test) for test in kept_tests))
+        reference_view = reference.restrict(kept_tests)
+        check_same(view, reference_view, tmp_path, ignored_tests & kept_tests)
+
+        nested_tests = set(rng.sample(sorted(kept_tests), rng.randrange(0, len(kept_tests) + 1)))
+        nested_view = view.restrict(set(interning.tests.id_of(test) for test in nested_tests))
+        check_same(nested_view, reference_view.restrict(nested_tests), tmp_path, set())
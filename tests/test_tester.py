@@ -0,0 +1,33 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("unidiff")
+
+from app import executor, tester, values
+from app.deadline import Deadline
+
+
+def test_generate_dry_run_runs_every_class(tmp_path, monkeypatch, log_files):
+    dir_classes = tmp_path / "classes"
+    dir_classes.mkdir()
+    monkeypatch.setitem(values.dir_info, "classes", str(dir_classes))
+
+    calls = []
+
+    def generate_tests_for_class(classname, dir_bin, dir_output, junit_suffix, **kwargs):
+        calls.append((classname, executor.current_priority(), kwargs["timeout_in_seconds"], kwargs["dry_run"]))
+        return []
+
+    monkeypatch.setattr(tester, "generate_tests_for_class", generate_tests_for_class)
+
+    i_patches = [SimpleNamespace(patch=SimpleNamespace(changed_classes=["foo.A", "foo.B"])),
+                 SimpleNamespace(patch=SimpleNamespace(changed_classes=["foo.B", "foo.C"]))]
+    with executor.priority(executor.PRIORITY_BACKGROUND):
+        tests = tester.generate_additional_test(i_patches, str(tmp_path), "_gen0_ESTest", dry_run=True,
+                                                timeout_per_class_in_seconds=60, max_parallel=2,
+                                                deadline=Deadline())
+
+    assert tests == []
+    assert sorted(calls) == [(classname, executor.PRIORITY_BACKGROUND, 60, True)
+                             for classname in ("foo.A", "foo.B", "foo.C")]
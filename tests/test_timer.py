@@ -0,0 +1,40 @@
+import threading
+
+import pytest
+
+pytest.importorskip("unidiff")
+
+from app.main import Timer
+
+
+def test_merge_keeps_the_running_phase_last():
+    timer = Timer()
+    timer.start_phase("Validation")
+    timer.pause_phase("Validation")
+    timer.resume_phase("Validation")
+
+    other = Timer()
+
+    def evaluate():
+        for phase in "Test Generation", "Validation":
+            other.start_phase(phase)
+            other.pause_phase(phase)
+
+    thread = threading.Thread(target=evaluate)
+    thread.start()
+    thread.join()
+
+    timer.merge(other)
+    timer.pause_phase("Validation")
+
+    intervals = timer.time_intervals["Validation"]
+    assert len(intervals) == 3
+    assert [x.start for x in intervals[:2]] == sorted(x.start for x in intervals[:2])
+    assert set(timer.summarize()) == {"Validation", "Test Generation"}
+
+
+def test_merge_rejects_running_phases():
+    other = Timer()
+    other.start_phase("Validation")
+    with pytest.raises(AssertionError):
+        Timer().merge(other)
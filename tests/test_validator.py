@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+pytest.importorskip("unidiff")
+
+from app import test_suite, validator
+from app.deadline import Deadline
+
+
+class FakePatch:
+    def get_index_str(self):
+        return "patch"
+
+
+def test_results_of_suites_with_the_same_junit_class_are_kept_apart(tmp_path, monkeypatch):
+    i_tests = []
+    for generation in 1, 2:
+        suite = test_suite.TestSuite(tmp_path, "foo.BarTest", None, ["test0"], [], [], key=f"suite{generation}")
+        i_tests.append(test_suite.IndexedTest(generation, test_suite.Test(suite, "test0")))
+    i_patch = FakePatch()
+
+    for name in "patch", "suite1", "suite2":
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "A.class").touch()
+    monkeypatch.setitem(validator.indexed_patch_to_bin_dir, i_patch, str(tmp_path / "patch"))
+    for i_test, name in zip(i_tests, ["suite1", "suite2"]):
+        monkeypatch.setitem(validator.indexed_suite_to_bin_dir, i_test.indexed_suite, str(tmp_path / name))
+
+    async def run_plain_validator(patch_bin_dir, suites_bin_dirs, suites_runtime_deps, full_test_names,
+                                  test_names_file, use_d4j_instr, deadline):
+        return json.dumps({"passingTests": [], "failingTests": full_test_names})
+
+    monkeypatch.setattr(validator, "run_plain_validator", run_plain_validator)
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+
+    (_, passing_i_tests, failing_i_tests), = validator.plain_validate([i_patch], i_tests, work_dir, True, Deadline())
+
+    assert passing_i_tests == []
+    assert sorted(failing_i_tests, key=lambda x: x.get_index()) == i_tests
+    assert failing_i_tests[0] is not failing_i_tests[1]